@@ -1,11 +1,18 @@
 import httpx
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 import sys
 import json
+import re
+import traceback
+import asyncio
+import random
 import copy
 import logging
+import logging.handlers
+import queue
+import atexit
 import time
 from datetime import datetime, timedelta
 from openai_adapter import detect_and_convert_request, convert_response_to_openai, get_codex_direct_config
@@ -14,10 +21,13 @@ import threading
 from contextlib import asynccontextmanager
 import gzip
 import io
-from typing import Any, Dict, List, Optional
+import codecs
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from enum import Enum
 from config_manager import get_config_manager
 import uuid
+import itertools
+from collections import ChainMap, deque
 
 # 导入实时统计管理器
 try:
@@ -27,6 +37,37 @@ except ImportError:
     stats_mgr = None
     print("警告: 无法导入token_stats，实时统计功能将不可用", file=sys.stderr)
 
+# 可选的orjson加速（未安装时回退到标准库json）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps_bytes(obj) -> bytes:
+    """序列化为UTF-8编码的JSON字节（保留非ASCII字符），有orjson时一次完成编码"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+# 解析JSON（接受str或bytes），解析失败时抛出ValueError的子类
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# 非流式转换的OpenAI chat.completion响应结构固定，预先编码好不变的部分，每次只编码动态字段
+_OPENAI_COMPLETION_HEAD = b'{"id":"chatcmpl-adapter","object":"chat.completion","created":'
+_OPENAI_COMPLETION_MODEL = b',"model":'
+_OPENAI_COMPLETION_CONTENT = b',"choices":[{"index":0,"message":{"role":"assistant","content":'
+_OPENAI_COMPLETION_TAIL = (b'},"finish_reason":"stop"}],'
+                           b'"usage":{"prompt_tokens":0,"completion_tokens":0,"total_tokens":0}}')
+
+def encode_openai_completion(model, content: str, created: int) -> bytes:
+    """编码非流式的OpenAI chat.completion响应（JSON字节）"""
+    return b''.join((
+        _OPENAI_COMPLETION_HEAD, str(created).encode('ascii'),
+        _OPENAI_COMPLETION_MODEL, json_dumps_bytes(model),
+        _OPENAI_COMPLETION_CONTENT, json_dumps_bytes(content),
+        _OPENAI_COMPLETION_TAIL,
+    ))
+
 # 统一配置管理 - 所有配置从config_manager加载
 config_mgr = get_config_manager()
 
@@ -35,9 +76,24 @@ class ConfigType(Enum):
     API = "api"
     CODEX = "codex"
 
+class ConfigStatus:
+    """单个API/Codex配置的运行状态（使用__slots__，状态切换时原地修改而不重新分配字典）"""
+    __slots__ = ("status", "error_count", "cooldown_until")
+
+    def __init__(self, status: str = "normal", error_count: int = 0, cooldown_until: Optional[datetime] = None):
+        self.status = status
+        self.error_count = error_count
+        self.cooldown_until = cooldown_until
+
+    def reset(self):
+        """恢复为正常状态"""
+        self.status = "normal"
+        self.error_count = 0
+        self.cooldown_until = None
+
 def _init_status_dict(configs: list) -> dict:
     """通用的状态字典初始化函数"""
-    return {i: {"status": "normal", "error_count": 0, "cooldown_until": None} for i in range(len(configs))}
+    return {i: ConfigStatus() for i in range(len(configs))}
 
 def _get_primary_indices(configs: list) -> List[int]:
     """通用的获取主配置索引函数"""
@@ -54,15 +110,15 @@ def _record_error_core(api_index: int, error_code: int, silent: bool,
     now = datetime.now()
     
     if api_index not in status_dict:
-        status_dict[api_index] = {"status": "normal", "error_count": 0, "cooldown_until": None}
+        status_dict[api_index] = ConfigStatus()
     
-    status_dict[api_index]["error_count"] += 1
+    status_dict[api_index].error_count += 1
     
     msg = None
-    if status_dict[api_index]["error_count"] >= threshold:
+    if status_dict[api_index].error_count >= threshold:
         cooldown_seconds = TimeoutConfig.get_api_cooldown_seconds()
-        status_dict[api_index]["cooldown_until"] = now + timedelta(seconds=cooldown_seconds)
-        status_dict[api_index]["status"] = "warning"
+        status_dict[api_index].cooldown_until = now + timedelta(seconds=cooldown_seconds)
+        status_dict[api_index].status = "warning"
         cooldown_end_time = (now + timedelta(seconds=cooldown_seconds)).strftime('%H:%M:%S')
         msg = f"[{now.strftime('%H:%M:%S')}] {config_type_name} {configs[api_index]['name']} 连续{threshold}次错误，设置{cooldown_seconds//60}分钟冷却(至{cooldown_end_time})"
     else:
@@ -97,7 +153,7 @@ MODEL_CONVERSIONS = config_mgr.get_enabled_model_conversions()
 CODEX_PATH_PREFIX = "openai"
 codex_timeout_extra_seconds = 0  # 额外超时秒数（每次失败+60）
 codex_success_count = 0  # 连续成功计数
-codex_timeout_lock = threading.Lock()  # 保护Codex超时全局变量的线程锁
+# 以上计数只在事件循环中读写（中间没有await），单线程内的读改写天然不会交错，无需加锁
 
 # Codex KEY轮动状态管理
 # codex_current_config_index 会在初始化阶段计算
@@ -191,6 +247,7 @@ def refresh_api_runtime_state(reset_backup_state: bool = False) -> None:
     global API_CONFIGS, api_status
     API_CONFIGS = config_mgr.get_enabled_api_configs()
     api_status = init_api_status()
+    clear_circuit_breakers(False)
     ensure_current_api_index(datetime.now(), reset_backup_state=reset_backup_state)
 
 
@@ -200,6 +257,7 @@ def refresh_codex_runtime_state(reset_backup_state: bool = False) -> None:
     CODEX_CONFIGS = config_mgr.get_enabled_codex_configs()
     CODEX_DIRECT_CONFIG = config_mgr.get_codex_config()
     codex_api_status = init_codex_api_status()
+    clear_circuit_breakers(True)
     if CODEX_CONFIGS:
         preferred = get_first_available_primary_codex_index()
         if preferred is not None:
@@ -249,6 +307,9 @@ async def refresh_timeout_client() -> None:
     # 创建新的client实例
     client = httpx.AsyncClient(timeout=timeout, limits=limits)
 
+    # 共享客户端沿用原连接池，只更新默认超时
+    refresh_pooled_client_timeouts()
+
 def get_primary_openai_to_claude_config() -> Dict[str, Any]:
     """获取首选的OpenAI转Claude配置"""
     for cfg in OPENAI_TO_CLAUDE_CONFIGS:
@@ -269,10 +330,10 @@ def is_codex_api_available(api_index):
     if not codex_config.get("enabled", True):
         return False
     
-    # 检查时间使能
-    time_enabled = codex_config.get("time_enabled", [1, 1, 1, 1, 1, 1, 1])
+    # 检查时间使能（未配置时视为每天启用）；当前时间只取一次，冷却检查也复用
+    now = datetime.now()
+    time_enabled = codex_config.get("time_enabled")
     if time_enabled:
-        now = datetime.now()
         weekday = now.weekday()  # 0=周一, 1=周二, ..., 6=周日
         if weekday < len(time_enabled) and not time_enabled[weekday]:
             # 当前星期几不在使能范围内
@@ -283,15 +344,14 @@ def is_codex_api_available(api_index):
         return True
     
     status = codex_api_status[api_index]
-    now = datetime.now()
     
     # 检查冷却时间
-    if status["cooldown_until"] and now < status["cooldown_until"]:
+    if status.cooldown_until and now < status.cooldown_until:
         return False
     
     # 冷却时间过了，重置状态
-    if status["cooldown_until"]:
-        codex_api_status[api_index].update({"status": "normal", "error_count": 0, "cooldown_until": None})
+    if status.cooldown_until:
+        codex_api_status[api_index].reset()
         print(f"[{now.strftime('%H:%M:%S')}] Codex {CODEX_CONFIGS[api_index]['name']} 冷却期结束，恢复可用")
 
     return True  # 所有检查通过，Codex API可用
@@ -509,8 +569,8 @@ def get_current_api_info():
     # 添加API冷却状态信息
     cooldown_info = []
     for i, api_config in enumerate(API_CONFIGS):
-        if i in api_status and api_status[i]["cooldown_until"]:
-            cooldown_until = api_status[i]["cooldown_until"]
+        if i in api_status and api_status[i].cooldown_until:
+            cooldown_until = api_status[i].cooldown_until
             if now < cooldown_until:
                 remaining_seconds = int((cooldown_until - now).total_seconds())
                 remaining_minutes = remaining_seconds // 60
@@ -545,8 +605,8 @@ def get_current_codex_info():
     # 添加Codex API冷却状态信息
     cooldown_info = []
     for i, codex_config in enumerate(CODEX_CONFIGS):
-        if i in codex_api_status and codex_api_status[i]["cooldown_until"]:
-            cooldown_until = codex_api_status[i]["cooldown_until"]
+        if i in codex_api_status and codex_api_status[i].cooldown_until:
+            cooldown_until = codex_api_status[i].cooldown_until
             if now < cooldown_until:
                 remaining_seconds = int((cooldown_until - now).total_seconds())
                 remaining_minutes = remaining_seconds // 60
@@ -596,6 +656,48 @@ USER_KEY_MAPPING = {
 # 调试开关 - 可以通过环境变量设置 PROXY_DEBUG=1 来启用详细调试
 DEBUG = os.getenv("PROXY_DEBUG", "0") == "1"
 
+def setup_proxy_logger():
+    """
+    设置控制台请求日志器：DEBUG模式下输出逐请求诊断，否则只输出简要INFO行
+    """
+    proxy_logger = logging.getLogger('proxy_console')
+    proxy_logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+    if not proxy_logger.handlers:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        proxy_logger.addHandler(console_handler)
+        proxy_logger.propagate = False  # 防止传播到根日志器
+    return proxy_logger
+
+# 全局控制台日志器
+proxy_logger = setup_proxy_logger()
+
+def setup_stderr_logger():
+    """
+    设置重试诊断日志器：记录先放入队列，由后台线程写stderr，请求协程不再阻塞在终端IO上
+    """
+    stderr_logger = logging.getLogger('proxy_stderr')
+    # 可通过环境变量 PROXY_RETRY_LOG_LEVEL=ERROR 等降低诊断输出量，被过滤的记录不会格式化
+    level = getattr(logging, os.getenv("PROXY_RETRY_LOG_LEVEL", "INFO").upper(), None)
+    stderr_logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    listener = None
+    if not stderr_logger.handlers:
+        log_queue = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter('%(message)s'))
+        listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        listener.start()
+        atexit.register(listener.stop)  # 退出时把队列中剩余的日志写完
+        stderr_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        stderr_logger.propagate = False  # 防止传播到根日志器
+    return stderr_logger, listener
+
+stderr_logger, stderr_log_listener = setup_stderr_logger()
+
+def elog(msg, *args):
+    """输出一条诊断信息到stderr（经由日志队列异步写出；带参数时按%格式延迟格式化）"""
+    stderr_logger.warning(msg, *args)
+
 # 完整日志记录开关 - 强制启用API输入输出日志
 ENABLE_FULL_LOG = True  # 强制启用，记录所有API输入输出
 MAX_LOG_SIZE = 3 * 1024 * 1024  # 3MB
@@ -634,14 +736,106 @@ def trim_log_file(log_filepath):
     except Exception as e:
         print(f"[日志管理] 修剪日志文件出错: {e}", file=sys.stderr)
 
+# ========== 熔断器（按配置索引区分API/Codex） ==========
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_VOLUME_THRESHOLD = 5  # 统计窗口内至少5次请求才判断是否熔断
+CIRCUIT_ERROR_RATIO = 0.5  # 失败率超过50%时熔断
+CIRCUIT_ROLLING_WINDOW = 60  # 失败率统计窗口（秒）
+CIRCUIT_SLEEP_WINDOW = 10  # 熔断后多久放行一个探测请求（秒）
+
+class CircuitBreaker:
+    """单个上游配置的熔断器：closed -> open -> half_open -> closed/open"""
+    __slots__ = ("state", "failure_count", "success_count", "window_start", "opened_at")
+
+    def __init__(self):
+        self.state = CIRCUIT_CLOSED
+        self.failure_count = 0
+        self.success_count = 0
+        self.window_start = time.monotonic()
+        self.opened_at = 0.0
+
+# 键为 (配置索引, 是否Codex)
+BREAKERS: Dict[tuple, CircuitBreaker] = {}
+
+def clear_circuit_breakers(is_codex: bool) -> None:
+    """配置列表变化后索引失效，清空对应类型的熔断器"""
+    for key in [key for key in BREAKERS if key[1] == is_codex]:
+        del BREAKERS[key]
+
+def circuit_allows_request(api_index: int, is_codex: bool) -> bool:
+    """检查熔断器是否放行请求；熔断期满后每个休眠窗口只放行一个探测请求"""
+    breaker = BREAKERS.get((api_index, is_codex))
+    if breaker is None or breaker.state == CIRCUIT_CLOSED:
+        return True
+    now = time.monotonic()
+    if now - breaker.opened_at < CIRCUIT_SLEEP_WINDOW:
+        return False
+    # 进入半开状态并重新计时（事件循环单线程，检查与置位之间没有await，不会放行多个探测）
+    # 探测请求若未回报结果，下一个休眠窗口结束后还可以再探测
+    breaker.state = CIRCUIT_HALF_OPEN
+    breaker.opened_at = now
+    return True
+
+def circuit_is_open(api_index: int, is_codex: bool) -> bool:
+    """熔断器是否处于熔断期（只读检查，不改变状态，供切换API时跳过已知故障的配置）"""
+    breaker = BREAKERS.get((api_index, is_codex))
+    return (breaker is not None and breaker.state == CIRCUIT_OPEN
+            and time.monotonic() - breaker.opened_at < CIRCUIT_SLEEP_WINDOW)
+
+def record_circuit_result(api_index: int, is_codex: bool, success: bool) -> None:
+    """记录一次请求结果，更新熔断器状态"""
+    key = (api_index, is_codex)
+    breaker = BREAKERS.get(key)
+    if breaker is None:
+        if success:
+            return  # 没有失败记录，无需创建熔断器
+        breaker = BREAKERS[key] = CircuitBreaker()
+
+    now = time.monotonic()
+    if success:
+        if breaker.state != CIRCUIT_CLOSED:
+            # 探测成功（或无备用配置时直接请求成功），恢复闭合
+            breaker.state = CIRCUIT_CLOSED
+            breaker.failure_count = 0
+            breaker.success_count = 0
+            breaker.window_start = now
+        else:
+            breaker.success_count += 1
+        return
+
+    if breaker.state == CIRCUIT_HALF_OPEN:
+        # 探测失败，重新熔断
+        breaker.state = CIRCUIT_OPEN
+        breaker.opened_at = now
+        return
+
+    if now - breaker.window_start >= CIRCUIT_ROLLING_WINDOW:
+        breaker.failure_count = 0
+        breaker.success_count = 0
+        breaker.window_start = now
+    breaker.failure_count += 1
+
+    total = breaker.failure_count + breaker.success_count
+    if (breaker.state == CIRCUIT_CLOSED and total >= CIRCUIT_VOLUME_THRESHOLD
+            and breaker.failure_count / total > CIRCUIT_ERROR_RATIO):
+        breaker.state = CIRCUIT_OPEN
+        breaker.opened_at = now
+        configs = CODEX_CONFIGS if is_codex else API_CONFIGS
+        name = configs[api_index]['name'] if 0 <= api_index < len(configs) else api_index
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] [熔断] {'Codex' if is_codex else 'API'} {name} 失败率过高({breaker.failure_count}/{total})，{CIRCUIT_SLEEP_WINDOW}秒内跳过该配置", file=sys.stderr)
+
 def record_api_error(api_index, error_code, silent=False):
     """记录API错误"""
     threshold = TimeoutConfig.get_api_error_threshold()
+    record_circuit_result(api_index, False, False)
     return _record_error_core(api_index, error_code, silent, api_status, API_CONFIGS, threshold, "API")
 
 def record_codex_error(api_index, error_code, silent=False):
     """记录Codex API错误"""
     threshold = TimeoutConfig.get_codex_error_threshold()
+    record_circuit_result(api_index, True, False)
     return _record_error_core(api_index, error_code, silent, codex_api_status, CODEX_CONFIGS, threshold, "Codex")
 
 def get_error_strategy(error_code, error_type="http_status_code"):
@@ -674,6 +868,28 @@ def get_error_strategy(error_code, error_type="http_status_code"):
 
     return None
 
+# 各策略对应的HTTP状态码集合缓存（配置版本号变化时重建）
+_STRATEGY_CACHE = {"version": None, "switch": frozenset(), "no_retry": frozenset(), "strategy_retry": frozenset()}
+_DEFAULT_STRATEGY_RETRY_CODES = frozenset({400, 404, 429, 500, 502, 503, 520, 521, 522, 524})
+
+def get_strategy_code_sets() -> Dict[str, frozenset]:
+    """获取各错误处理策略的状态码集合（按配置版本缓存，避免每次重试都重新解析策略配置）"""
+    version = config_mgr.version
+    if _STRATEGY_CACHE["version"] != version:
+        http_codes = config_mgr.get_error_handling_strategies().get("http_status_codes", {})
+        codes_by_strategy = {"normal_retry": set(), "strategy_retry": set()}
+        for code, strategy in http_codes.items():
+            # 跳过"default"键，只处理数字状态码
+            if code != "default" and strategy in codes_by_strategy:
+                codes_by_strategy[strategy].add(int(code))
+        _STRATEGY_CACHE.update({
+            "version": version,
+            "switch": config_mgr.get_switch_api_codes(),
+            "no_retry": frozenset(codes_by_strategy["normal_retry"]),
+            "strategy_retry": frozenset(codes_by_strategy["strategy_retry"]) or _DEFAULT_STRATEGY_RETRY_CODES,
+        })
+    return _STRATEGY_CACHE
+
 def is_api_available(api_index):
     """检查API是否可用（包括enabled状态和时间使能检查）"""
 
@@ -687,10 +903,10 @@ def is_api_available(api_index):
     if not api_config.get("enabled", True):
         return False
     
-    # 检查时间使能
-    time_enabled = api_config.get("time_enabled", [1, 1, 1, 1, 1, 1, 1])
+    # 检查时间使能（未配置时视为每天启用）；当前时间只取一次，冷却检查也复用
+    now = datetime.now()
+    time_enabled = api_config.get("time_enabled")
     if time_enabled:
-        now = datetime.now()
         weekday = now.weekday()  # 0=周一, 1=周二, ..., 6=周日
         if weekday < len(time_enabled) and not time_enabled[weekday]:
             # 当前星期几不在使能范围内
@@ -701,19 +917,18 @@ def is_api_available(api_index):
         return True
     
     status = api_status[api_index]
-    now = datetime.now()
     
     # 检查冷却时间
-    if status["cooldown_until"] and now < status["cooldown_until"]:
-        remaining_seconds = int((status["cooldown_until"] - now).total_seconds())
+    if status.cooldown_until and now < status.cooldown_until:
+        remaining_seconds = int((status.cooldown_until - now).total_seconds())
         remaining_minutes = remaining_seconds // 60
         remaining_seconds = remaining_seconds % 60
         # 不在这里打印，避免日志过多，冷却信息会在get_current_api_info中显示
         return False
     
     # 冷却时间过了，重置状态
-    if status["cooldown_until"]:
-        api_status[api_index].update({"status": "normal", "error_count": 0, "cooldown_until": None})
+    if status.cooldown_until:
+        api_status[api_index].reset()
         print(f"[{now.strftime('%H:%M:%S')}] API {API_CONFIGS[api_index]['name']} 冷却期结束，恢复可用")
 
     return True  # 所有检查通过，API可用
@@ -755,7 +970,7 @@ def smart_switch_api(current_api_index, error_code):
         threshold = TimeoutConfig.get_api_error_threshold()
 
         # 检查错误计数是否达到切换阈值
-        if api_status[current_api_index]["error_count"] < threshold:
+        if api_status[current_api_index].error_count < threshold:
             # 错误次数不足，不切换API，让重试逻辑继续使用当前API
             return False, current_api_index
 
@@ -764,7 +979,7 @@ def smart_switch_api(current_api_index, error_code):
         if is_using_backup:
             # 如果主API已恢复，切回主API继续执行后续逻辑
             primary_index = get_first_available_primary_api_index()
-            if primary_index is not None and is_api_available(primary_index):
+            if primary_index is not None and is_api_available(primary_index) and not circuit_is_open(primary_index, False):
                 print(f"[{now.strftime('%H:%M:%S')}] 备用API出错，但优先级主API已恢复，尝试切回主API {API_CONFIGS[primary_index]['name']}")
                 is_using_backup = False
                 backup_start_time = None
@@ -772,10 +987,10 @@ def smart_switch_api(current_api_index, error_code):
                 return True, primary_index
             # 如果主API仍不可用，尝试切换到另一个备用API
         
-        # 第一层：尝试切换到备用API
+        # 第一层：尝试切换到备用API（跳过处于熔断期的配置）
         backup_indices = get_backup_api_indices()
         for backup_idx in backup_indices:
-            if is_api_available(backup_idx):
+            if is_api_available(backup_idx) and not circuit_is_open(backup_idx, False):
                 old_api_name = API_CONFIGS[current_config_index]['name']
                 is_using_backup = True
                 backup_start_time = now
@@ -788,8 +1003,8 @@ def smart_switch_api(current_api_index, error_code):
         # 收集所有API的冷却信息
         cooldown_details = []
         for i, api_config in enumerate(API_CONFIGS):
-            if i in api_status and api_status[i]["cooldown_until"] and now < api_status[i]["cooldown_until"]:
-                remaining_seconds = int((api_status[i]["cooldown_until"] - now).total_seconds())
+            if i in api_status and api_status[i].cooldown_until and now < api_status[i].cooldown_until:
+                remaining_seconds = int((api_status[i].cooldown_until - now).total_seconds())
                 remaining_minutes = remaining_seconds // 60
                 remaining_seconds = remaining_seconds % 60
                 if remaining_minutes > 0:
@@ -821,13 +1036,13 @@ def smart_codex_switch_api(current_api_index, error_code):
         # record_codex_error(current_api_index, error_code)
         codex_threshold = TimeoutConfig.get_codex_error_threshold()
 
-        if codex_api_status[current_api_index]["error_count"] < codex_threshold:
+        if codex_api_status[current_api_index].error_count < codex_threshold:
             return False, current_api_index
 
         print(f"[{now.strftime('%H:%M:%S')}] Codex API {CODEX_CONFIGS[current_api_index]['name']} 连续{codex_threshold}次错误，开始切换...")
         if codex_is_using_backup:
             primary_index = get_first_available_primary_codex_index()
-            if primary_index is not None and is_codex_api_available(primary_index):
+            if primary_index is not None and is_codex_api_available(primary_index) and not circuit_is_open(primary_index, True):
                 print(f"[{now.strftime('%H:%M:%S')}] 备用Codex API出错，但优先级主API已恢复，尝试切回主API {CODEX_CONFIGS[primary_index]['name']}")
                 codex_is_using_backup = False
                 codex_backup_start_time = None
@@ -836,7 +1051,7 @@ def smart_codex_switch_api(current_api_index, error_code):
         
         backup_indices = get_codex_backup_api_indices()
         for backup_idx in backup_indices:
-            if is_codex_api_available(backup_idx):
+            if is_codex_api_available(backup_idx) and not circuit_is_open(backup_idx, True):
                 old_api_name = CODEX_CONFIGS[codex_current_config_index]['name']
                 codex_is_using_backup = True
                 codex_backup_start_time = now
@@ -847,8 +1062,8 @@ def smart_codex_switch_api(current_api_index, error_code):
         
         cooldown_details = []
         for i, codex_config in enumerate(CODEX_CONFIGS):
-            if i in codex_api_status and codex_api_status[i]["cooldown_until"] and now < codex_api_status[i]["cooldown_until"]:
-                remaining_seconds = int((codex_api_status[i]["cooldown_until"] - now).total_seconds())
+            if i in codex_api_status and codex_api_status[i].cooldown_until and now < codex_api_status[i].cooldown_until:
+                remaining_seconds = int((codex_api_status[i].cooldown_until - now).total_seconds())
                 remaining_minutes = remaining_seconds // 60
                 remaining_seconds = remaining_seconds % 60
                 if remaining_minutes > 0:
@@ -890,7 +1105,6 @@ def setup_full_logger():
     if not full_logger.handlers:
         try:
             # 使用脚本所在目录的绝对路径
-            import os
             script_dir = os.path.dirname(os.path.abspath(__file__))
             log_filename = os.path.join(script_dir, "logs", "api_full_io.log")
             
@@ -1026,84 +1240,198 @@ def log_original_response(request_id, response_chunks, is_codex_request=False):
     except Exception as e:
         print(f"记录输出数据时出错: {e}", file=sys.stderr)
 
-def extract_usage_from_chunks(response_chunks, is_codex_request=False):
+# 非SSE响应（完整JSON等）读取时聚合的块大小
+STREAM_AGGREGATE_CHUNK_SIZE = 64 * 1024
+
+# 非SSE的JSON响应转换时最多缓冲的字节数，超过后放弃转换、原样转发
+JSON_CONVERT_MAX_BUFFER = 1024 * 1024
+
+# 流式响应保留的开头/末尾原始字节数（只用于日志和兜底解析，usage所在的data行另行完整保留）
+RESPONSE_HEAD_BYTES = 16 * 1024
+RESPONSE_TAIL_BYTES = 16 * 1024
+
+class ResponseChunkBuffer:
     """
-    从响应chunks中提取usage数据
+    流式响应缓冲：只保留开头和末尾的原始字节并记录总块数，内存占用与响应大小无关；keep_all时保留全部块（完整日志）
+    usage所在的data行（Codex的response.completed会带上完整output，可能远超末尾窗口）按行切分后完整保留最后一条
+    """
+    __slots__ = ('chunks', 'head', 'tail', 'count', 'line', 'line_is_data', 'usage_line')
+
+    def __init__(self, keep_all: bool = False):
+        self.chunks: Optional[List[bytes]] = [] if keep_all else None
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.count = 0
+        # 当前未结束的行；确认不是data行后不再累积，避免无换行的大响应占用内存
+        self.line = bytearray()
+        self.line_is_data: Optional[bool] = None
+        self.usage_line: Optional[bytes] = None
+
+    def append(self, chunk: bytes):
+        self.count += 1
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+            return
+        self._scan_lines(chunk)
+        room = RESPONSE_HEAD_BYTES - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+            if not chunk:
+                return
+        self.tail += chunk
+        if len(self.tail) > RESPONSE_TAIL_BYTES:
+            del self.tail[:-RESPONSE_TAIL_BYTES]
+
+    def _scan_lines(self, chunk: bytes):
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            if end < 0:
+                self._extend_line(chunk[start:])
+                return
+            self._extend_line(chunk[start:end])
+            self._finish_line()
+            start = end + 1
+
+    def _extend_line(self, part: bytes):
+        if self.line_is_data is False or not part:
+            return
+        self.line += part
+        if self.line_is_data is None and len(self.line) >= len(SSE_DATA_PREFIX):
+            self.line_is_data = self.line.startswith(SSE_DATA_PREFIX)
+            if not self.line_is_data:
+                self.line.clear()
+
+    def _finish_line(self):
+        line = self.line
+        if self.line_is_data and (b'"usage"' in line or b'response.completed' in line):
+            self.usage_line = bytes(line)
+        self.line = bytearray()
+        self.line_is_data = None
+
+    def data_payloads(self):
+        """返回流中可能携带usage的data行内容（bytes）：首尾窗口中完整的data行，加上完整保留的usage行"""
+        if self.chunks is not None:
+            return [m.group(1) for m in SSE_DATA_LINE.finditer(b''.join(self.chunks))]
+        payloads = [m.group(1) for m in SSE_DATA_LINE.finditer(b''.join(self))]
+        # 流结束时最后一行可能没有换行
+        last_line = self.usage_line
+        if self.line_is_data and (b'"usage"' in self.line or b'response.completed' in self.line):
+            last_line = bytes(self.line)
+        if last_line is not None:
+            payloads.append(last_line[len(SSE_DATA_PREFIX):])
+        return payloads
+
+    def __iter__(self):
+        if self.chunks is not None:
+            return iter(self.chunks)
+        # 首尾相接时拼接结果与原始数据一致；中间被丢弃时接缝处的残行解析失败会被忽略
+        return iter((bytes(self.head), bytes(self.tail)))
+
+    def __len__(self):
+        return self.count
+
+# SSE行前缀（bytes），流式转换按字节判断行类型，只有JSON负载交给解析器
+SSE_DATA_PREFIX = b'data: '
+SSE_DONE_LINE = b'data: [DONE]'
+SSE_EVENT_PREFIX = b'event:'
+
+# SSE data行（bytes），用C实现的正则一次扫描完成分行和前缀匹配，无需先整体解码
+SSE_DATA_LINE = re.compile(rb'^data: (.+)$', re.M)
+
+def parse_sse_payload(payload: bytes):
+    """解析SSE data行的内容（bytes），返回JSON对象；是[DONE]或解析失败时返回None"""
+    if payload == b'[DONE]':
+        return None
+    try:
+        return json_loads(payload)
+    except ValueError:
+        return None
+
+def is_usage_event(data) -> bool:
+    """判断已解析的SSE事件是否可能携带usage数据"""
+    return isinstance(data, dict) and ('usage' in data or data.get('type') == 'response.completed')
+
+def extract_usage_from_events(events, is_codex_request=False):
+    """
+    从已解析的SSE事件中提取usage数据
 
     Args:
-        response_chunks: 响应数据块列表
+        events: 已解析的SSE事件（dict）序列
         is_codex_request: 是否为Codex请求
 
     Returns:
         dict: usage数据，格式统一为：
             {input_tokens, output_tokens, cache_creation_input_tokens, cache_read_input_tokens, total_tokens}
     """
-    try:
-        # 合并所有chunks
-        complete_response = b''.join(response_chunks)
-        response_text = complete_response.decode('utf-8', errors='ignore')
-
-        # 查找usage数据
-        lines = response_text.split('\n')
-        usage_lines_found = 0
-        for line in lines:
-            if line.startswith('data: ') and line != 'data: [DONE]':
-                try:
-                    json_str = line[6:]
-                    data = json.loads(json_str)
+    for data in events:
+        try:
+            if is_codex_request:
+                # Codex API格式：response.completed事件中包含usage
+                if data.get('type') == 'response.completed':
+                    codex_usage = data.get('response', {}).get('usage', {})
+                    if codex_usage:
+                        # 提取缓存token（Codex使用input_tokens_details.cached_tokens）
+                        input_tokens_details = codex_usage.get('input_tokens_details', {})
+                        cached_tokens = input_tokens_details.get('cached_tokens', 0)
+
+                        # Codex的input_tokens包含了新输入+缓存输入
+                        # 需要分离出真正的新输入和缓存读取
+                        total_input = codex_usage.get('input_tokens', 0)
+                        new_input = total_input - cached_tokens
+
+                        return {
+                            'input_tokens': new_input,  # 新输入（非缓存）
+                            'output_tokens': codex_usage.get('output_tokens', 0),
+                            'cache_creation_input_tokens': 0,  # Codex缓存创建不单独计费
+                            'cache_read_input_tokens': cached_tokens,  # 缓存读取
+                            'total_tokens': (
+                                new_input +
+                                codex_usage.get('output_tokens', 0) +
+                                cached_tokens
+                            )
+                        }
+            else:
+                # Claude API格式：message_delta或message_stop事件中包含usage
+                if 'usage' in data:
+                    usage = data['usage']
+                    # 完整计算：包括所有tokens（input + output + cache_creation + cache_read）
+                    return {
+                        'input_tokens': usage.get('input_tokens', 0),
+                        'output_tokens': usage.get('output_tokens', 0),
+                        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
+                        'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0),
+                        'total_tokens': (
+                            usage.get('input_tokens', 0) +
+                            usage.get('output_tokens', 0) +
+                            usage.get('cache_creation_input_tokens', 0) +
+                            usage.get('cache_read_input_tokens', 0)
+                        )
+                    }
+        except Exception:
+            continue
 
-                    # 检查是否包含usage
-                    if 'usage' in data:
-                        usage_lines_found += 1
+    return None
 
-                    if is_codex_request:
-                        # Codex API格式：response.completed事件中包含usage
-                        if data.get('type') == 'response.completed':
-                            codex_usage = data.get('response', {}).get('usage', {})
-                            if codex_usage:
-                                # 提取缓存token（Codex使用input_tokens_details.cached_tokens）
-                                input_tokens_details = codex_usage.get('input_tokens_details', {})
-                                cached_tokens = input_tokens_details.get('cached_tokens', 0)
-
-                                # Codex的input_tokens包含了新输入+缓存输入
-                                # 需要分离出真正的新输入和缓存读取
-                                total_input = codex_usage.get('input_tokens', 0)
-                                new_input = total_input - cached_tokens
-
-                                result = {
-                                    'input_tokens': new_input,  # 新输入（非缓存）
-                                    'output_tokens': codex_usage.get('output_tokens', 0),
-                                    'cache_creation_input_tokens': 0,  # Codex缓存创建不单独计费
-                                    'cache_read_input_tokens': cached_tokens,  # 缓存读取
-                                    'total_tokens': (
-                                        new_input +
-                                        codex_usage.get('output_tokens', 0) +
-                                        cached_tokens
-                                    )
-                                }
-                                return result
-                    else:
-                        # Claude API格式：message_delta或message_stop事件中包含usage
-                        if 'usage' in data:
-                            usage = data['usage']
-                            # 完整计算：包括所有tokens（input + output + cache_creation + cache_read）
-                            result = {
-                                'input_tokens': usage.get('input_tokens', 0),
-                                'output_tokens': usage.get('output_tokens', 0),
-                                'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
-                                'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0),
-                                'total_tokens': (
-                                    usage.get('input_tokens', 0) +
-                                    usage.get('output_tokens', 0) +
-                                    usage.get('cache_creation_input_tokens', 0) +
-                                    usage.get('cache_read_input_tokens', 0)
-                                )
-                            }
-                            return result
-                except Exception as parse_error:
-                    continue
+def extract_usage_from_chunks(response_chunks, is_codex_request=False):
+    """
+    从响应chunks中提取usage数据
 
-        return None
+    Args:
+        response_chunks: 响应数据块序列（列表或ResponseChunkBuffer）
+        is_codex_request: 是否为Codex请求
+
+    Returns:
+        dict: usage数据，格式同 extract_usage_from_events
+    """
+    try:
+        if isinstance(response_chunks, ResponseChunkBuffer):
+            payloads = response_chunks.data_payloads()
+        else:
+            payloads = (m.group(1) for m in SSE_DATA_LINE.finditer(b''.join(response_chunks)))
+        events = (data for data in map(parse_sse_payload, payloads) if is_usage_event(data))
+        return extract_usage_from_events(events, is_codex_request)
     except Exception as e:
         return None
 
@@ -1117,36 +1445,43 @@ def validate_and_replace_user_key(authorization_header):
     Returns:
         tuple: (is_valid, real_api_key_header, error_message)
     """
+    key_source, error_msg = lookup_user_key_source(authorization_header)
+    if key_source is None:
+        return False, None, error_msg
+    return True, resolve_real_auth_header(key_source), None
+
+def lookup_user_key_source(authorization_header):
+    """
+    验证用户Key，返回 (key来源, 错误信息)
+    key来源是静态key或返回当前API key的函数；同一请求内验证结果不变，切换API后只需重新解析key来源
+    """
     if not authorization_header:
-        return False, None, "缺少Authorization头"
+        return None, "缺少Authorization头"
     
     # 解析Bearer token
     if not authorization_header.startswith('Bearer '):
-        return False, None, "Authorization头格式错误，需要Bearer token"
+        return None, "Authorization头格式错误，需要Bearer token"
     
     user_key = authorization_header[7:]  # 去掉'Bearer '前缀
     
     # 验证用户key是否存在于映射中
     if user_key not in USER_KEY_MAPPING:
-        return False, None, f"无效的用户Key: {user_key}"
+        return None, f"无效的用户Key: {user_key}"
     
-    # 获取真正的API key（支持动态获取）
-    key_source = USER_KEY_MAPPING[user_key]
+    return USER_KEY_MAPPING[user_key], None
+
+def resolve_real_auth_header(key_source) -> str:
+    """根据key来源获取真正的API key（支持动态获取），返回Authorization头"""
     if callable(key_source):
         real_api_key = key_source()  # 调用函数获取当前key
     else:
         real_api_key = key_source  # 直接使用静态key
-    
-    real_auth_header = f"Bearer {real_api_key}"
-    
-    return True, real_auth_header, None
+    return f"Bearer {real_api_key}"
 
 def get_exact_test_headers():
     """获取验证成功的sonnet-4请求头配置（使用动态API key和防缓存头部）"""
     current_key = get_current_api_key()
     # 添加时间戳和随机数以避免网络缓存
-    import time
-    import random
     timestamp = int(time.time() * 1000)  # 毫秒级时间戳
     rand_id = random.randint(1000, 9999)
     return {
@@ -1224,7 +1559,6 @@ def detect_compressed_error(chunk_data):
                                     # 处理Unicode转义的压缩数据
                                     if '\\u001f\\u008b' in details:
                                         # 将Unicode转义序列转换为实际字节
-                                        import codecs
                                         unescaped = codecs.decode(details, 'unicode_escape')
                                         compressed_data = unescaped.encode('latin-1')
                                     else:
@@ -1336,21 +1670,27 @@ def handle_detected_error(request_id, error_info, decompressed_content, context=
 # 使用动态API端点配置
 def build_upstream_url(clean_path, query_string=None, is_openai_format=False, base_url=None):
     """构建上游API的完整URL"""
-    if base_url is None:
-        config = get_current_config()
-        base_url = config["base_url"]
+    return join_upstream_url(base_url, build_upstream_suffix(clean_path, query_string, is_openai_format))
 
-    url = f"{base_url}/{clean_path}"
+def build_upstream_suffix(clean_path, query_string=None, is_openai_format=False) -> str:
+    """构建上游URL中base_url之后的部分（路径和查询参数），同一请求内不变，切换API时只需替换base_url"""
+    suffix = f"/{clean_path}"
     
     if query_string:
         if is_openai_format:
-            url += f"?{query_string}&beta=true"
+            suffix += f"?{query_string}&beta=true"
         else:
-            url += f"?{query_string}"
+            suffix += f"?{query_string}"
     elif is_openai_format:
-        url += "?beta=true"
+        suffix += "?beta=true"
     
-    return url
+    return suffix
+
+def join_upstream_url(base_url, suffix: str) -> str:
+    """拼接base_url和路径后缀，base_url为None时使用当前API配置"""
+    if base_url is None:
+        base_url = get_current_config()["base_url"]
+    return base_url + suffix
 
 # 保持向后兼容
 def get_current_base_url():
@@ -1470,13 +1810,8 @@ class TimeoutConfig:
     
     @classmethod
     def get_strategy_retry_status_codes(cls):
-        """获取策略重试状态码集合（从错误处理策略配置读取）"""
-        strategies = config_mgr.get_error_handling_strategies()
-        http_codes = strategies.get("http_status_codes", {})
-        # 跳过"default"键，只处理数字状态码
-        retry_codes = [int(code) for code, strategy in http_codes.items()
-                      if strategy == "strategy_retry" and code != "default"]
-        return set(retry_codes) if retry_codes else {400, 404, 429, 500, 502, 503, 520, 521, 522, 524}
+        """获取策略重试状态码集合（从错误处理策略配置读取，按配置版本缓存）"""
+        return get_strategy_code_sets()["strategy_retry"]
     
     @classmethod
     def get_network_error_strategy(cls, error_type: str) -> str:
@@ -1512,6 +1847,16 @@ class TimeoutConfig:
             pool=cls.get_pool_timeout()
         )
     
+    @classmethod
+    def get_codex_timeout(cls):
+        """获取Codex请求超时配置（禁用read超时，由流式总超时手动控制）"""
+        return httpx.Timeout(
+            connect=cls.get_connect_timeout(),
+            read=None,
+            write=cls.get_write_timeout(),
+            pool=cls.get_pool_timeout()
+        )
+
     @classmethod
     def get_retry_timeout(cls, is_non_streaming=False):
         """获取重试请求超时配置"""
@@ -1538,6 +1883,19 @@ class TimeoutConfig:
             pool=cls.get_pool_timeout()
         )
 
+class RetryContext:
+    """单个请求的重试配置快照：请求入口处读取一次，重试循环各分支只做属性访问"""
+    __slots__ = ("network_error_strategies", "strategy_code_sets", "codex_connect_timeout")
+
+    def __init__(self, is_codex_request: bool):
+        self.network_error_strategies = {
+            error_type: TimeoutConfig.get_network_error_strategy(error_type)
+            for error_type in ("ReadError", "ConnectError", "ReadTimeout")
+        }
+        # 缓存字典在配置变更时会被原地更新，这里复制一份作为本请求的快照
+        self.strategy_code_sets = dict(get_strategy_code_sets())
+        self.codex_connect_timeout = TimeoutConfig.get_codex_connect_timeout() if is_codex_request else None
+
 # 计费优化功能 - 定时启动计费周期
 import time
 import json
@@ -1754,7 +2112,6 @@ You are producing plain text that will later be styled by the CLI. Follow these
   * Examples: src/app.ts, src/app.ts:42, b/server/index.js#L10, C:\\\\repo\\\\project\\\\main.rs:12:5"""
         
         # 构建环境上下文（Codex CLI必需）
-        import os
         env_context = {
             'cwd': os.path.abspath('.'),
             'approval_policy': 'on-request',
@@ -2029,7 +2386,7 @@ def init_codex_activation_status():
 
 def api_activation_scheduler():
     """API定时激活调度器 - 每分钟检查是否需要激活，失败则重试最多20次"""
-    global api_activation_status, codex_activation_status
+    global api_activation_status, codex_activation_status, API_CONFIGS, CODEX_CONFIGS
     print(f"[{datetime.now().strftime('%H:%M:%S')}] 🕐 API定时激活调度器已启动（Claude + Codex）")
     
     last_check_date = None
@@ -2113,6 +2470,9 @@ def api_activation_scheduler():
                         # 只更新激活时间字段
                         if original_index is not None:
                             config_mgr.update_api_config(original_index, {'activation_time': next_activation_time})
+                            # 配置行是写时复制发布的，运行时列表仍持有旧行，需重新获取才能看到新的激活时间
+                            # （启用的配置集合和顺序不变，只换列表，不重置状态和熔断器）
+                            API_CONFIGS = config_mgr.get_enabled_api_configs()
                         
                         print(f"[{now.strftime('%H:%M:%S')}] ✅ Claude API激活成功: {config['name']}")
                         print(f"[{now.strftime('%H:%M:%S')}] ⏰ 下次激活时间已更新为: {next_activation_time}")
@@ -2191,6 +2551,9 @@ def api_activation_scheduler():
                         # 只更新激活时间字段
                         if original_index is not None:
                             config_mgr.update_codex_config(original_index, {'activation_time': next_activation_time})
+                            # 配置行是写时复制发布的，运行时列表仍持有旧行，需重新获取才能看到新的激活时间
+                            # （启用的配置集合和顺序不变，只换列表，不重置状态和熔断器）
+                            CODEX_CONFIGS = config_mgr.get_enabled_codex_configs()
                         
                         print(f"[{now.strftime('%H:%M:%S')}] ✅ Codex API激活成功: {config['name']}")
                         print(f"[{now.strftime('%H:%M:%S')}] ⏰ 下次激活时间已更新为: {next_activation_time}")
@@ -2266,8 +2629,8 @@ async def lifespan(app: FastAPI):
     
     yield
     
-    # 关闭时执行（如果需要的话）
-    pass
+    # 关闭时执行：释放共享连接池
+    await close_pooled_clients()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -2680,8 +3043,8 @@ async def reset_api_cooldown(data: dict = None):
         # 重置单个API的冷却
         index = data["index"]
         if 0 <= index < len(API_CONFIGS):
-            if index in api_status and api_status[index]["cooldown_until"]:
-                api_status[index] = {"status": "normal", "error_count": 0, "cooldown_until": None}
+            if index in api_status and api_status[index].cooldown_until:
+                api_status[index].reset()
                 api_name = API_CONFIGS[index]['name']
                 print(f"[{now.strftime('%H:%M:%S')}] 手动重置API冷却: {api_name}")
                 return {"success": True, "message": f"已重置 {api_name} 的冷却状态"}
@@ -2690,13 +3053,13 @@ async def reset_api_cooldown(data: dict = None):
         return {"success": False, "message": "无效的API索引"}
     else:
         # 重置所有API的冷却
-        reset_count = 0
-        reset_names = []
-        for i in range(len(API_CONFIGS)):
-            if i in api_status and api_status[i]["cooldown_until"]:
-                api_status[i] = {"status": "normal", "error_count": 0, "cooldown_until": None}
-                reset_names.append(API_CONFIGS[i]['name'])
-                reset_count += 1
+        # 单次遍历状态表，同时收集索引和名称
+        cooling = [(i, API_CONFIGS[i]['name']) for i, status in api_status.items()
+                   if 0 <= i < len(API_CONFIGS) and status.cooldown_until]
+        for i, _ in cooling:
+            api_status[i].reset()
+        reset_names = [name for _, name in cooling]
+        reset_count = len(cooling)
         
         if reset_count > 0:
             print(f"[{now.strftime('%H:%M:%S')}] 手动重置所有API冷却: {', '.join(reset_names)}")
@@ -2714,8 +3077,8 @@ async def reset_codex_cooldown(data: dict = None):
         # 重置单个Codex的冷却
         index = data["index"]
         if 0 <= index < len(CODEX_CONFIGS):
-            if index in codex_api_status and codex_api_status[index]["cooldown_until"]:
-                codex_api_status[index] = {"status": "normal", "error_count": 0, "cooldown_until": None}
+            if index in codex_api_status and codex_api_status[index].cooldown_until:
+                codex_api_status[index].reset()
                 codex_name = CODEX_CONFIGS[index]['name']
                 print(f"[{now.strftime('%H:%M:%S')}] 手动重置Codex冷却: {codex_name}")
                 return {"success": True, "message": f"已重置 {codex_name} 的冷却状态"}
@@ -2724,13 +3087,13 @@ async def reset_codex_cooldown(data: dict = None):
         return {"success": False, "message": "无效的Codex索引"}
     else:
         # 重置所有Codex的冷却
-        reset_count = 0
-        reset_names = []
-        for i in range(len(CODEX_CONFIGS)):
-            if i in codex_api_status and codex_api_status[i]["cooldown_until"]:
-                codex_api_status[i] = {"status": "normal", "error_count": 0, "cooldown_until": None}
-                reset_names.append(CODEX_CONFIGS[i]['name'])
-                reset_count += 1
+        # 单次遍历状态表，同时收集索引和名称
+        cooling = [(i, CODEX_CONFIGS[i]['name']) for i, status in codex_api_status.items()
+                   if 0 <= i < len(CODEX_CONFIGS) and status.cooldown_until]
+        for i, _ in cooling:
+            codex_api_status[i].reset()
+        reset_names = [name for _, name in cooling]
+        reset_count = len(cooling)
         
         if reset_count > 0:
             print(f"[{now.strftime('%H:%M:%S')}] 手动重置所有Codex冷却: {', '.join(reset_names)}")
@@ -2789,7 +3152,7 @@ async def reload_configs():
         sections_text = "、".join(updated_sections)
 
         api_index_info = current_config_index if current_config_index is not None and current_config_index >= 0 else "-"
-        codex_index_info = codex_current_config_index if 'codex_current_config_index' in globals() and codex_current_config_index is not None and codex_current_config_index >= 0 else "-"
+        codex_index_info = codex_current_config_index if codex_current_config_index is not None and codex_current_config_index >= 0 else "-"
         print(f"[{now.strftime('%H:%M:%S')}] 配置重新加载：更新项={sections_text}；主API索引={api_index_info}，Codex索引={codex_index_info}")
 
         return {"success": True, "message": f"已刷新：{sections_text}"}
@@ -2797,7 +3160,24 @@ async def reload_configs():
 
 
 # ========== cache_control 数量限制函数 ==========
-def limit_cache_control_blocks(request_data: Dict[str, Any], max_blocks: int = 4) -> Dict[str, Any]:
+def _iter_cache_control_blocks(request_data: Dict[str, Any]):
+    """逐个产出 system 和 messages 中带 cache_control 的块"""
+    for item in request_data.get("system", []):
+        if isinstance(item, dict) and "cache_control" in item:
+            yield item
+    for msg in request_data.get("messages", []):
+        if isinstance(msg, dict):
+            content = msg.get("content", [])
+            if isinstance(content, list):
+                for c_item in content:
+                    if isinstance(c_item, dict) and "cache_control" in c_item:
+                        yield c_item
+
+def count_cache_control_blocks(request_data: Dict[str, Any], cap: int) -> int:
+    """统计 cache_control 块数量，数到 cap 个即停止（只需判断是否超限时不必遍历全部历史消息）"""
+    return sum(1 for _ in itertools.islice(_iter_cache_control_blocks(request_data), cap))
+
+def limit_cache_control_blocks(request_data: Dict[str, Any], max_blocks: int = 4) -> Tuple[Dict[str, Any], bytes]:
     """
     限制请求中 cache_control 块的数量，避免超过 Claude API 的限制
 
@@ -2806,10 +3186,9 @@ def limit_cache_control_blocks(request_data: Dict[str, Any], max_blocks: int = 4
         max_blocks: 最大允许的 cache_control 块数量（默认 4）
 
     Returns:
-        修复后的请求数据
+        (修复后的请求数据, 序列化后的请求体)，调用方无需再次编码
     """
     try:
-        import copy
         fixed_request = copy.deepcopy(request_data)
         cache_control_count = 0
 
@@ -2867,10 +3246,10 @@ def limit_cache_control_blocks(request_data: Dict[str, Any], max_blocks: int = 4
         if cache_control_count > max_blocks:
             print(f"[cache_control限制] 检测到{cache_control_count}个cache_control块，已限制为{max_blocks}个", file=sys.stderr)
 
-        return fixed_request
+        return fixed_request, json_dumps_bytes(fixed_request)
     except Exception as e:
         print(f"[cache_control限制] 处理失败: {e}", file=sys.stderr)
-        return request_data  # 出错时返回原始数据
+        return request_data, json_dumps_bytes(request_data)  # 出错时返回原始数据
 
 
 # 在初始化客户端时，我们不设置 base_url，以便在请求时构建完整的 URL
@@ -2883,16 +3262,399 @@ non_streaming_timeout = TimeoutConfig.get_non_streaming_timeout()
 limits = httpx.Limits(max_keepalive_connections=0, max_connections=100)
 client = httpx.AsyncClient(timeout=timeout, limits=limits)
 
+# 重试退避时间表（1, 2, 4, 8, 16, 30秒），另加随机抖动，避免大量请求同时重试冲击上游
+_RETRY_BACKOFF = tuple(min(2.0 ** i, 30.0) for i in range(6))
+_RETRY_BACKOFF_JITTER = 0.5
+
+# switch_api扩展重试在两次切换之间的退避（full jitter：0 ~ min(上限, 基数*2^n) 之间均匀随机）
+EXTENDED_RETRY_BASE = 0.1
+EXTENDED_RETRY_CAP = 2.0
+_AUTH_ERROR_CODES = frozenset((401, 403))
+
+def extended_switch_delay(switch_count: int, last_status_code: Optional[int]) -> float:
+    """扩展重试第switch_count次切换前的等待秒数，首次切换和认证错误（快速失败）不等待"""
+    if switch_count <= 1 or last_status_code in _AUTH_ERROR_CODES:
+        return 0.0
+    return random.random() * min(EXTENDED_RETRY_CAP, EXTENDED_RETRY_BASE * (2 ** (switch_count - 1)))
+
+# 重试请求的固定防缓存头部：强制关闭连接复用，确保API不使用缓存
+_ANTI_CACHE_TEMPLATE = {
+    'connection': 'close',
+    'cache-control': 'no-cache, no-store, must-revalidate',
+    'pragma': 'no-cache',
+    'expires': '0',
+}
+# 防缓存标识：进程启动时间（毫秒）+ 自增计数，只用于绕过缓存，无需随机数
+_CACHE_BUST_EPOCH = time.time_ns() // 1_000_000
+_cache_bust = itertools.count()
+# "重试时修改请求头"开关缓存（配置版本号变化时重新读取）
+_MODIFY_RETRY_HEADERS = {"version": None, "enabled": True}
+
+def build_retry_headers(base_headers: dict, request_tag: str, retry_count: Optional[int] = None) -> ChainMap:
+    """
+    构建重试请求头：开启"修改重试请求头"时附加防缓存头部和唯一标识，让每次重试都像全新请求
+    request_tag 为 x-request-id 的前缀，retry_count 不为None时附加 x-retry-count
+
+    返回 ChainMap 叠加视图（本次重试的动态头部 -> 防缓存模板 -> 基础请求头），不复制基础请求头；
+    写入只会落到最上层的动态头部，不影响模板和基础请求头。视图需在构建请求时立即使用
+    """
+    if _MODIFY_RETRY_HEADERS["version"] != config_mgr.version:
+        _MODIFY_RETRY_HEADERS["enabled"] = TimeoutConfig.get_modify_retry_headers()
+        _MODIFY_RETRY_HEADERS["version"] = config_mgr.version
+    if not _MODIFY_RETRY_HEADERS["enabled"]:
+        return ChainMap({}, base_headers)
+
+    retry_headers = ChainMap({}, _ANTI_CACHE_TEMPLATE, base_headers)
+    refresh_retry_headers(retry_headers, request_tag, retry_count)
+    return retry_headers
+
+def refresh_retry_headers(retry_headers: ChainMap, request_tag: str, retry_count: Optional[int] = None) -> None:
+    """
+    原地刷新 build_retry_headers 返回视图中的动态头部（x-request-id 等），供同一请求多次重发时复用同一视图；
+    未开启"修改重试请求头"时视图没有叠加防缓存模板，不做任何修改
+    """
+    if len(retry_headers.maps) < 3:
+        return
+    bust_id = next(_cache_bust)
+    dynamic_headers = retry_headers.maps[0]
+    dynamic_headers['x-request-id'] = f"{request_tag}-{bust_id}"
+    dynamic_headers['x-cache-bypass'] = f"{_CACHE_BUST_EPOCH}-{bust_id}"
+    if retry_count is not None:
+        dynamic_headers['x-retry-count'] = str(retry_count)
+
+# 重试路径上频繁判断的httpx异常类型，预先绑定为模块级名称，省去每次的属性查找
+_HX_ReadError = httpx.ReadError
+_HX_ConnectError = httpx.ConnectError
+_HX_ReadTimeout = httpx.ReadTimeout
+_HX_HTTPStatusError = httpx.HTTPStatusError
+_HX_EXC = (httpx.HTTPStatusError, httpx.RequestError)
+_HX_TIMEOUT_EXC = (httpx.ReadTimeout, httpx.ConnectTimeout)
+
+# 流处理中视为连接中断的异常类型；第三方包装过的异常再按消息文本兜底匹配
+_CONN_EXC = (httpx.RemoteProtocolError, httpx.ReadError,
+             ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+_CONN_ERROR_TEXT = re.compile(
+    r'peer closed connection|incomplete chunked read|remoteprotocolerror|connection reset|broken pipe|connection aborted',
+    re.I)
+
+# Claude请求重试全部失败后记录的错误码（按最后的错误处理策略）：
+# switch_api / normal_retry 重试max_retries次都失败，记录最后的状态码；strategy_retry 所有备用节点都失败，记录503
+_STRATEGY_CODE = {
+    "switch_api": lambda status_code: status_code,
+    "strategy_retry": lambda status_code: 503,
+    "normal_retry": lambda status_code: status_code,
+}
+
+def record_final_retry_error(strategy: Optional[str], status_code: Optional[int]) -> None:
+    """Claude请求在所有重试都失败后统一记录+1次错误"""
+    code_for = _STRATEGY_CODE.get(strategy)
+    if code_for is None:
+        return
+    code = code_for(status_code)
+    if code:
+        msg = record_api_error(current_config_index, code, silent=True)
+        if msg:
+            elog(msg)
+
+# 单个请求保留的重试错误信息条数上限
+RETRY_ERRORS_MAXLEN = 128
+
+# 连接类错误：(异常类型, 策略配置键, 日志标签, 错误描述, x-request-id标记)
+_CONNECTION_ERROR_KINDS = (
+    (httpx.ReadError, "ReadError", "SSL读取错误", "检测到SSL读取错误或连接中断", "readerror"),
+    (httpx.ConnectError, "ConnectError", "连接失败", "检测到连接错误", "connecterror"),
+)
+
+def match_connection_error(error: Exception):
+    """匹配连接类错误，返回 (策略配置键, 日志标签, 错误描述, x-request-id标记)，不是连接类错误时返回None"""
+    for error_class, strategy_key, error_label, error_desc, tag in _CONNECTION_ERROR_KINDS:
+        if isinstance(error, error_class):
+            return strategy_key, error_label, error_desc, tag
+    return None
+
+# Python 3.11+ 的 asyncio.timeout 直接在当前任务上计时，不像 wait_for 那样额外包一层Task
+_HAS_ASYNCIO_TIMEOUT = sys.version_info >= (3, 11)
+
+async def send_with_connect_timeout(client: httpx.AsyncClient, req: httpx.Request, timeout: float) -> httpx.Response:
+    """以流式方式发送请求，超过timeout秒未收到响应头时抛出 asyncio.TimeoutError"""
+    if _HAS_ASYNCIO_TIMEOUT:
+        async with asyncio.timeout(timeout):
+            return await client.send(req, stream=True)
+    return await asyncio.wait_for(client.send(req, stream=True), timeout=timeout)
+
+async def anext_with_timeout(stream_aiter, timeout: float):
+    """读取异步迭代器的下一项，超过timeout秒时抛出 asyncio.TimeoutError（3.11+不为每个chunk创建Task）"""
+    if _HAS_ASYNCIO_TIMEOUT:
+        async with asyncio.timeout(timeout):
+            return await stream_aiter.__anext__()
+    return await asyncio.wait_for(stream_aiter.__anext__(), timeout=timeout)
+
+async def switch_api_and_resend(error_label: str, error_desc: str, tag: str, request: Request,
+                                headers: dict, converted_body: bytes, request_id: str, retry_attempt: int,
+                                clean_path: str, is_openai_format: bool, base_url_override: Optional[str],
+                                user_auth_header: Optional[str], retry_errors: Deque[str]) -> Optional[httpx.Response]:
+    """
+    Claude请求遇到连接类错误且策略为switch_api时：强制切换API，并立即用新API重发一次
+    会更新 headers 中的 authorization；只有新API返回成功（< 400）时返回响应，否则返回None继续正常重试
+    """
+    detect_msg = f"[{error_label}-切换API][{request_id}] {error_desc}，强制切换API"
+    retry_errors.append(detect_msg)
+    elog(detect_msg)
+
+    # 连接类错误视为严重连接错误，直接尝试切换API
+    switch_success, _ = smart_switch_api(current_config_index, 503)  # 使用503错误码触发切换
+    if not switch_success:
+        fail_msg = f"[{error_label}-切换API失败][{request_id}] API切换失败，继续正常重试流程"
+        retry_errors.append(fail_msg)
+        elog(fail_msg)
+        return None
+
+    switch_msg = f"[{error_label}-切换API成功][{request_id}] API切换成功，使用新API重试"
+    retry_errors.append(switch_msg)
+    elog(switch_msg)
+
+    # 重新构建请求头和URL，使用新API
+    is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
+    if not is_valid:
+        retry_errors.append(f"[{error_label}-切换API失败][{request_id}] 新API的Key验证失败: {error_msg}")
+        return None
+    headers['authorization'] = real_auth_header
+    new_upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
+    switch_retry_headers = build_retry_headers(headers, f"{request_id}-{tag}-{retry_attempt + 1}", retry_attempt + 1)
+
+    try:
+        # 使用共享的流式客户端
+        switch_client = get_pooled_client("streaming")
+        switch_req = switch_client.build_request(
+            method=request.method,
+            url=new_upstream_url,
+            headers=switch_retry_headers,
+            content=converted_body
+        )
+        switch_resp = await switch_client.send(switch_req, stream=True)
+    except Exception as switch_retry_exception:
+        retry_errors.append(f"[{error_label}-切换API失败][{request_id}] 新API重试也失败: {switch_retry_exception}")
+        return None
+
+    status_msg = f"[{error_label}-切换API][{request_id}] 新API响应状态码: {switch_resp.status_code}"
+    retry_errors.append(status_msg)
+    elog(status_msg)
+    # 只有成功响应（< 400）才交给调用方跳出重试循环，错误响应继续重试
+    if switch_resp.status_code < 400:
+        return switch_resp
+    error_status_msg = f"[{error_label}-切换API][{request_id}] 新API仍返回错误{switch_resp.status_code}，继续重试"
+    retry_errors.append(error_status_msg)
+    elog(error_status_msg)
+    await switch_resp.aclose()
+    return None
+
+# 扩展重试舱壁：全局最多同时进行的扩展重试数，上游大面积故障时限制重试放大，避免占满连接池
+RETRY_BULKHEAD_LIMIT = 32
+RETRY_BULKHEAD_WAIT = 0.5  # 名额已满时最多等待的秒数，超时直接放弃扩展重试
+_RETRY_BULKHEAD: Optional[asyncio.Semaphore] = None
+
+def get_retry_bulkhead() -> asyncio.Semaphore:
+    """获取扩展重试信号量（首次使用时在事件循环内创建，兼容Python 3.8/3.9的事件循环绑定）"""
+    global _RETRY_BULKHEAD
+    if _RETRY_BULKHEAD is None:
+        _RETRY_BULKHEAD = asyncio.Semaphore(RETRY_BULKHEAD_LIMIT)
+    return _RETRY_BULKHEAD
+
+async def extended_switch_retry(request: Request, headers: dict, converted_body: bytes, request_id: str,
+                                upstream_url: str, failed_status_code: int, switch_api_codes: frozenset,
+                                stop_on_other_errors: bool, *, is_codex_request: bool, clean_path: str,
+                                is_openai_format: bool, base_url_override: Optional[str],
+                                user_auth_header: Optional[str], client_profile: str,
+                                codex_connect_timeout: Optional[float]) -> Tuple[Optional[httpx.Response], str]:
+    """
+    switch_api扩展重试：主重试循环失败后依次切换到其他可用API重发请求（每个API最多尝试3次）
+    会更新 headers 中的 authorization；返回 (响应, 最后使用的上游URL)
+    响应为None表示所有API均已尝试仍然失败；stop_on_other_errors为True时，
+    遇到非switch_api错误立即停止并返回该错误响应；扩展重试名额已满时直接返回None（快速失败）
+    """
+    bulkhead = get_retry_bulkhead()
+    try:
+        # wait_for在超时与获取同时发生时可能丢失已获取的名额，这里与anext_with_timeout一致改用asyncio.timeout；
+        # 旧版本Python没有asyncio.timeout，名额已满时直接快速失败，未满时acquire不会挂起
+        if _HAS_ASYNCIO_TIMEOUT:
+            async with asyncio.timeout(RETRY_BULKHEAD_WAIT):
+                await bulkhead.acquire()
+        elif bulkhead.locked():
+            raise asyncio.TimeoutError()
+        else:
+            await bulkhead.acquire()
+    except asyncio.TimeoutError:
+        elog("[switch_api扩展重试][%s] 同时进行的扩展重试已达上限(%s)，放弃扩展重试", request_id, RETRY_BULKHEAD_LIMIT)
+        return None, upstream_url
+
+    try:
+        # Codex/Claude对应的配置列表、错误记录和切换函数只选择一次
+        if is_codex_request:
+            configs, record_error, smart_switch = CODEX_CONFIGS, record_codex_error, smart_codex_switch_api
+            current_index = lambda: codex_current_config_index
+        else:
+            configs, record_error, smart_switch = API_CONFIGS, record_api_error, smart_switch_api
+            current_index = lambda: current_config_index
+        max_api_count = len(configs)
+        max_extended_switches = max_api_count * 3  # 每个API最多尝试3次
+        extended_switch_count = 0
+        extended_last_status = failed_status_code
+        # 重试请求头视图整个扩展重试只构建一次：每次切换只刷新动态头部，
+        # authorization 写在基础请求头上，通过视图直接读到最新值
+        extended_headers = build_retry_headers(headers, f"{request_id}-extended-0")
+        # 路径和查询参数在整个请求内不变，切换API时只替换base_url
+        upstream_suffix = build_upstream_suffix(clean_path, request.url.query, is_openai_format)
+        # 用户Key在整个请求内不变，只验证一次；每次切换后只重新解析当前API的真实key
+        if not is_codex_request:
+            key_source, key_error_msg = lookup_user_key_source(user_auth_header)
+
+        while extended_switch_count < max_extended_switches:
+            # 尝试切换API
+            switch_success, _ = smart_switch(current_index(), failed_status_code)
+
+            if not switch_success:
+                elog("[switch_api扩展重试][%s] 无法切换到新API，所有API已尝试", request_id)
+                break
+
+            extended_switch_count += 1
+            stderr_logger.info("[switch_api扩展重试][%s] 第%s次API切换", request_id, extended_switch_count)
+            delay = extended_switch_delay(extended_switch_count, extended_last_status)
+            if delay:
+                await asyncio.sleep(delay)
+
+            # 重新构建请求
+            extended_resp = None
+            try:
+                if is_codex_request:
+                    current_codex_config = get_current_codex_config()
+                    print(f"\n{get_current_codex_info()}")
+                    upstream_url = join_upstream_url(current_codex_config["base_url"], upstream_suffix)
+                    headers['authorization'] = f'Bearer {current_codex_config["key"]}'
+                else:
+                    if key_source is None:
+                        elog("[switch_api扩展重试][%s] 验证Key失败: %s", request_id, key_error_msg)
+                        break
+                    headers['authorization'] = resolve_real_auth_header(key_source)
+                    upstream_url = join_upstream_url(base_url_override, upstream_suffix)
+                    print(f"\n{get_current_api_info()}")
+
+                # 复用共享客户端，切换API时不再新建连接池
+                extended_client = get_pooled_client(client_profile)
+                refresh_retry_headers(extended_headers, f"{request_id}-extended-{extended_switch_count}")
+                extended_req = extended_client.build_request(
+                    method=request.method,
+                    url=upstream_url,
+                    headers=extended_headers,
+                    content=converted_body
+                )
+
+                if is_codex_request:
+                    try:
+                        extended_resp = await send_with_connect_timeout(extended_client, extended_req, codex_connect_timeout)
+                    except asyncio.TimeoutError:
+                        elog("[switch_api扩展重试][%s] Codex连接超时", request_id)
+                        extended_last_status = 503
+                        continue
+                else:
+                    extended_resp = await extended_client.send(extended_req, stream=True)
+
+                stderr_logger.info("[switch_api扩展重试][%s] 响应状态码: %s", request_id, extended_resp.status_code)
+
+                # 检查响应
+                if extended_resp.status_code < 400:
+                    # 成功！使用这个响应
+                    stderr_logger.info("[switch_api扩展重试][%s] 成功！使用新API响应", request_id)
+                    return extended_resp, upstream_url
+                if stop_on_other_errors and extended_resp.status_code not in switch_api_codes:
+                    # 不同类型的错误，停止扩展重试
+                    elog("[switch_api扩展重试][%s] API返回非switch_api错误%s，停止扩展重试", request_id, extended_resp.status_code)
+                    return extended_resp, upstream_url
+
+                # 失败，继续尝试其他API
+                elog("[switch_api扩展重试][%s] API返回错误%s，继续尝试其他API", request_id, extended_resp.status_code)
+                extended_last_status = extended_resp.status_code
+                record_error(current_index(), extended_resp.status_code, silent=True)
+                await extended_resp.aclose()
+
+            except Exception as extended_error:
+                elog("[switch_api扩展重试][%s] 扩展重试异常: %s", request_id, extended_error)
+                extended_last_status = 503
+                record_error(current_index(), 503, silent=True)
+                # 发送之后出错时释放本次尝试的响应，把连接还给共享连接池
+                if extended_resp is not None:
+                    await extended_resp.aclose()
+            except BaseException:
+                # 任务被取消（客户端断开）等情况：同样释放响应后继续抛出
+                if extended_resp is not None:
+                    await extended_resp.aclose()
+                raise
+
+        return None, upstream_url
+    finally:
+        bulkhead.release()
+
+# ========== 共享连接池客户端 ==========
+# 重试路径按超时配置复用客户端，避免每次重试都新建连接池（重新DNS解析和TLS握手）
+# 出错的连接由httpx自动丢弃；开启"修改重试请求头"时请求带 connection: close，仍不会复用连接
+pooled_limits = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+_POOLED_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+_CLIENT_TIMEOUT_PROFILES = {
+    "codex": TimeoutConfig.get_codex_timeout,
+    "streaming": TimeoutConfig.get_streaming_timeout,
+    "non_streaming": TimeoutConfig.get_non_streaming_timeout,
+    "strategy": TimeoutConfig.get_strategy_retry_timeout,
+}
+
+def get_pooled_client(profile: str) -> httpx.AsyncClient:
+    """按超时配置获取共享客户端（首次使用时创建）"""
+    pooled = _POOLED_CLIENTS.get(profile)
+    if pooled is None:
+        pooled = httpx.AsyncClient(timeout=_CLIENT_TIMEOUT_PROFILES[profile](), limits=pooled_limits)
+        _POOLED_CLIENTS[profile] = pooled
+    return pooled
+
+def is_pooled_client(candidate) -> bool:
+    """共享客户端不能在单个请求结束时关闭"""
+    return any(candidate is pooled for pooled in _POOLED_CLIENTS.values())
+
+def refresh_pooled_client_timeouts() -> None:
+    """超时配置变更后更新共享客户端的默认超时：之后构建的请求使用新超时，进行中的流式响应不受影响，连接池继续复用"""
+    for profile, pooled in _POOLED_CLIENTS.items():
+        pooled.timeout = _CLIENT_TIMEOUT_PROFILES[profile]()
+
+async def close_pooled_clients() -> None:
+    """关闭所有共享客户端"""
+    for pooled in list(_POOLED_CLIENTS.values()):
+        try:
+            await pooled.aclose()
+        except Exception as e:
+            print(f"关闭共享client时出错: {e}", file=sys.stderr)
+    _POOLED_CLIENTS.clear()
+
+# 非API路径（浏览器/爬虫自动请求的资源），命中即直接404
+_SKIP_PATH_TOKENS = ('favicon.ico', 'robots.txt', 'sitemap.xml', 'apple-touch-icon', '.well-known')
+
+# CORS预检请求的固定应答头
+_PREFLIGHT_HEADERS = {
+    "access-control-allow-origin": "*",
+    "access-control-allow-methods": "GET, POST, PUT, DELETE, PATCH, OPTIONS",
+    "access-control-allow-headers": "*",
+    "access-control-max-age": "86400",
+}
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def reverse_proxy(request: Request, path: str):
     """
     一个高保真异步反向代理，支持OpenAI到Claude格式的自动转换。
     核心特性是"绝对透传"响应头，以应对具有非标准头依赖的客户端。
     """
-    # 跳过非API路径的请求（浏览器自动请求的资源）
-    skip_paths = ['favicon.ico', 'robots.txt', 'sitemap.xml', 'apple-touch-icon', '.well-known']
-    if any(skip_path in path for skip_path in skip_paths):
+    # 跳过非API路径的请求（浏览器自动请求的资源），必须在读取请求体之前返回
+    if any(skip_path in path for skip_path in _SKIP_PATH_TOKENS):
         return JSONResponse(content={"error": "Not Found"}, status_code=404)
+
+    # CORS预检请求直接应答，不做Key验证和格式转换，也不转发上游
+    if request.method == "OPTIONS":
+        return Response(status_code=204, headers=_PREFLIGHT_HEADERS)
     
     # 生成请求ID用于日志跟踪
     request_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
@@ -2909,6 +3671,7 @@ async def reverse_proxy(request: Request, path: str):
     base_url_override = get_current_codex_config()["base_url"] if is_codex_request else None
 
     # 简化日志记录：仅记录基本信息和用户模型
+    user_model = None  # 仅在完整日志开启时解析，统计时未解析则回退到请求体
     if ENABLE_FULL_LOG and full_logger:
         try:
             full_logger.info("="*40)
@@ -2965,15 +3728,15 @@ async def reverse_proxy(request: Request, path: str):
     # 提前检测是否为OpenAI客户端（用于正确显示API信息）
     is_openai_client_early = (path == "v1/chat/completions" or path.endswith("/v1/chat/completions")) and not is_codex_request
 
-    print(f"\n" + "=" * 50)
-    print(f"Key验证成功，用户Key: {user_auth_header[7:] if user_auth_header else 'None'}")
+    # 当前API信息每个请求只计算一次（内部会遍历配置并拼接冷却信息）
     if is_codex_request:
-        print(f"{get_current_codex_info()}")
+        current_api_info = get_current_codex_info()
     elif is_openai_client_early:
-        print(f"{get_openai_to_claude_info()}")
+        current_api_info = get_openai_to_claude_info()
     else:
-        print(f"{get_current_api_info()}")
-    print()
+        current_api_info = get_current_api_info()
+    proxy_logger.debug("Key验证成功，用户Key: %s", user_auth_header[7:] if user_auth_header else 'None')
+    proxy_logger.info("[%s] %s", request_id, current_api_info)
 
     if is_codex_request:
         current_codex_config = get_current_codex_config()
@@ -2985,6 +3748,7 @@ async def reverse_proxy(request: Request, path: str):
     # 3. 处理OpenAI格式转换
     original_request_data = None
     is_openai_format = False
+    conversion_headers = None  # OpenAI转换返回的请求头配置
     converted_body = body
     user_wants_stream = True  # 记录用户原始的stream设置
     original_model = None  # 用户输入的原始模型
@@ -3067,7 +3831,6 @@ async def reverse_proxy(request: Request, path: str):
                         model_conversion_info = f"{user_original_model} → {target_model}"
                     else:
                         # 简单模型名替换
-                        import copy
                         converted_request = copy.deepcopy(original_request_data)
                         converted_request["model"] = target_model
                         converted_body = json.dumps(converted_request, ensure_ascii=False).encode('utf-8')
@@ -3140,7 +3903,6 @@ async def reverse_proxy(request: Request, path: str):
                     path = "v1/messages"
                     
                 except Exception as convert_error:
-                    import traceback
                     error_msg = f"OpenAI请求转换失败: {convert_error}"
                     print(error_msg, file=sys.stderr)
                     print(f"转换错误详情: {traceback.format_exc()}", file=sys.stderr)
@@ -3171,32 +3933,31 @@ async def reverse_proxy(request: Request, path: str):
             # 不是JSON请求，保持原样
             pass
         except Exception as e:
-            import traceback
             print(f"转换请求时出错: {e}")
             print(f"错误详情: {traceback.format_exc()}")
             # 删除原始请求数据记录
     
     # 5. 复制请求头，排除 host 头和 authorization 头（将使用验证后的真正API key）
-    headers = {key: value for key, value in request.headers.items() 
-               if key.lower() not in ['host', 'authorization']}
+    # 请求头统一使用小写键名，后续按键名增删时直接做O(1)查找
+    headers = {key.lower(): value for key, value in request.headers.items()
+               if key.lower() not in ('host', 'authorization')}
     
     # 添加验证后的真正API key
     headers['authorization'] = real_auth_header
     
     # 对于OpenAI格式请求，使用从转换函数返回的头信息配置
     if is_openai_format:
-        successful_headers = conversion_headers if 'conversion_headers' in locals() else get_exact_test_headers()
+        successful_headers = conversion_headers if conversion_headers is not None else get_exact_test_headers()
         
         # OpenAI转Claude时，强制使用专用配置的key
         if openai_config_for_request and openai_config_for_request.get("key"):
             successful_headers['authorization'] = f"Bearer {openai_config_for_request['key']}"
         
         # 更新为成功的头信息
-        headers.update(successful_headers)
+        headers.update({key.lower(): value for key, value in successful_headers.items()})
         
         # 处理外部请求路径：提取核心API路径，去掉所有前缀
         # 不管是 api/v1/messages 还是 ao/api2/v1/messages，都提取出 v1/messages
-        import re
         # 匹配最后的 v1/... 部分
         path_match = re.search(r'(v1/(?:messages|chat/completions).*?)(?:\?|$)', path)
         if path_match:
@@ -3227,12 +3988,11 @@ async def reverse_proxy(request: Request, path: str):
         
         # 添加缺失的默认头信息
         for key, value in default_headers.items():
-            if key.lower() not in {h.lower() for h in headers.keys()}:
+            if key not in headers:
                 headers[key] = value
         
         # 处理外部请求路径：提取核心API路径，去掉所有前缀
         # 不管是 api/v1/messages 还是 ao/api2/v1/messages，都提取出 v1/messages
-        import re
         # 匹配最后的 v1/... 部分  
         path_match = re.search(r'(v1/(?:messages|chat/completions).*?)(?:\?|$)', path)
         if path_match:
@@ -3257,8 +4017,12 @@ async def reverse_proxy(request: Request, path: str):
         # 完整地重建上游 URL，包括查询参数
         upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
     
-    # 如果转换了请求体，需要更新Content-Length
-    if converted_body != body:
+    # 路径和查询参数在整个请求内不变，重试切换API时只替换base_url
+    upstream_suffix = build_upstream_suffix(clean_path, request.url.query, is_openai_format)
+    
+    # 如果转换了请求体，需要更新Content-Length（按对象身份判断，避免逐字节比较大请求体）
+    # 重试时复用同一个bytes对象和预设的长度，httpx不会复制请求体
+    if converted_body is not body:
         headers['content-length'] = str(len(converted_body))
     
     # 打印用户请求信息（精简版）
@@ -3296,44 +4060,70 @@ async def reverse_proxy(request: Request, path: str):
     # 注意：临时性错误（400, 404, 429, 500, 502, 503, 520-524）使用策略重试处理
     # 持续性错误（401, 403）使用智能API切换处理（达到切换阈值后）
     last_error = None
-    retry_errors = []
+    # 只保留最近的错误信息，重试风暴时内存有上限
+    retry_errors: Deque[str] = deque(maxlen=RETRY_ERRORS_MAXLEN)
+    # 重试相关配置在整个请求期间不变，只读取一次
+    retry_ctx = RetryContext(is_codex_request)
+    codex_connect_timeout = retry_ctx.codex_connect_timeout
+    # 已做过cache_control限制检查的请求体（按对象身份比较）
+    cache_limit_checked_body = None
+    # switch_api扩展重试使用的共享客户端
+    extended_client_profile = "codex" if is_codex_request else ("non_streaming" if should_convert_to_openai and not user_wants_stream else "streaming")
     
     # Claude请求的错误追踪（用于在重试循环结束后统一记录错误）
     last_error_status_code = None  # 最后的HTTP状态码
     last_error_strategy = None  # 最后的错误处理策略
     should_record_error_after_retry = False  # 是否在重试结束后记录错误
+    upstream_resp = None  # 当前尝试打开的上游响应
     
     for retry_attempt in range(max_retries):
-        # 为每次重试创建独立的client实例，避免连接复用问题
-        # 包括第一次也使用新client，确保不复用可能有坏连接的全局client
+        # 熔断检查：当前配置处于熔断期时不发请求，直接切换到其他配置后在本次尝试内继续检查
+        # 跳过熔断配置不消耗重试次数；无法切换（没有其他可用配置或已轮转一圈）时仍然照常请求
+        breaker_index = codex_current_config_index if is_codex_request else current_config_index
+        skipped_indices = set()
+        while not circuit_allows_request(breaker_index, is_codex_request):
+            if is_codex_request:
+                switch_success, new_index = smart_codex_switch_api(breaker_index, 503)
+            else:
+                switch_success, new_index = smart_switch_api(breaker_index, 503)
+            if not switch_success or new_index == breaker_index or new_index in skipped_indices:
+                break
+            skipped_indices.add(breaker_index)
+            elog("[熔断][%s] 当前配置已熔断，跳过请求并切换配置", request_id)
+            if is_codex_request:
+                current_codex_config = get_current_codex_config()
+                upstream_url = join_upstream_url(current_codex_config["base_url"], upstream_suffix)
+                headers['authorization'] = f'Bearer {current_codex_config["key"]}'
+            else:
+                is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
+                if is_valid:
+                    headers['authorization'] = real_auth_header
+                    upstream_url = join_upstream_url(base_url_override, upstream_suffix)
+            breaker_index = new_index
+
+        # 按超时配置取共享客户端（连接池跨重试和请求复用）
         # 根据是否为非流式请求选择合适的超时配置
         if is_codex_request:
-            # Codex请求：连接30秒超时（asyncio.wait_for控制）+ 流式总超时（手动计时控制）
+            # Codex请求：连接30秒超时（send_with_connect_timeout控制）+ 流式总超时（手动计时控制）
             # 禁用httpx的read超时，完全由流式总超时控制
-            codex_timeout = httpx.Timeout(
-                connect=TimeoutConfig.get_connect_timeout(),
-                read=None,  # ✅ 禁用read超时，由流式总超时控制
-                write=TimeoutConfig.get_write_timeout(),
-                pool=TimeoutConfig.get_pool_timeout()
-            )
-            retry_client = httpx.AsyncClient(timeout=codex_timeout, limits=limits)
+            codex_timeout = TimeoutConfig.get_codex_timeout()
+            retry_client = get_pooled_client("codex")
             # 显示 Codex 超时信息
             codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
-            with codex_timeout_lock:
-                current_extra_seconds = codex_timeout_extra_seconds
-            print(f"[Codex超时配置] 连接超时: {TimeoutConfig.get_codex_connect_timeout()}秒 | 流式总超时: {codex_base_timeout + current_extra_seconds}秒", file=sys.stderr)
+            current_extra_seconds = codex_timeout_extra_seconds
+            stderr_logger.info("[Codex超时配置] 连接超时: %s秒 | 流式总超时: %s秒", codex_connect_timeout, codex_base_timeout + current_extra_seconds)
             if current_extra_seconds > 0:
-                print(f"[Codex自适应超时] 流式总超时详情: 基础{codex_base_timeout}秒 + 额外{current_extra_seconds}秒", file=sys.stderr)
+                stderr_logger.info("[Codex自适应超时] 流式总超时详情: 基础%s秒 + 额外%s秒", codex_base_timeout, current_extra_seconds)
         elif should_convert_to_openai and not user_wants_stream:
             # 非流式请求使用60秒超时
-            retry_client = httpx.AsyncClient(timeout=non_streaming_timeout, limits=limits)
+            retry_client = get_pooled_client("non_streaming")
             # 显示 Claude 非流式超时信息
-            print(f"[Claude超时配置] 连接超时: {TimeoutConfig.get_connect_timeout()}秒 | 读取超时: {TimeoutConfig.get_non_streaming_read_timeout()}秒", file=sys.stderr)
+            stderr_logger.info("[Claude超时配置] 连接超时: %s秒 | 读取超时: %s秒", TimeoutConfig.get_connect_timeout(), TimeoutConfig.get_non_streaming_read_timeout())
         else:
             # 流式请求或非OpenAI请求使用标准超时
-            retry_client = httpx.AsyncClient(timeout=timeout, limits=limits)
+            retry_client = get_pooled_client("streaming")
             # 显示 Claude 流式超时信息
-            print(f"[Claude超时配置] 连接超时: {TimeoutConfig.get_connect_timeout()}秒 | 流式读取超时: {TimeoutConfig.get_streaming_read_timeout()}秒", file=sys.stderr)
+            stderr_logger.info("[Claude超时配置] 连接超时: %s秒 | 流式读取超时: %s秒", TimeoutConfig.get_connect_timeout(), TimeoutConfig.get_streaming_read_timeout())
         
         try:
             # 记录发API前的原数据（仅在第一次尝试时记录）
@@ -3352,54 +4142,29 @@ async def reverse_proxy(request: Request, path: str):
             current_config = get_current_codex_config() if is_codex_request else get_current_config()
             
             # 根据配置决定是否修改重试请求头
-            retry_headers = headers.copy()
-            if TimeoutConfig.get_modify_retry_headers():
-                # 强制关闭连接复用，让每次重试都像新请求一样使用全新连接
-                retry_headers['connection'] = 'close'
-                # 添加唯一标识和完整的防缓存头部，确保API不使用缓存
-                import random
-                import time
-                retry_rand = random.randint(1000,9999)
-                retry_timestamp = int(time.time() * 1000)
-                retry_headers['x-request-id'] = f"{request_id}-retry{retry_attempt}-{retry_rand}"
-                retry_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                retry_headers['pragma'] = 'no-cache'
-                retry_headers['expires'] = '0'
-                retry_headers['x-cache-bypass'] = f'{retry_timestamp}-{retry_rand}'
-                retry_headers['x-retry-count'] = str(retry_attempt + 1)
+            retry_headers = build_retry_headers(headers, f"{request_id}-retry{retry_attempt}", retry_attempt + 1)
 
             # 应用 cache_control 数量限制（实际限制是3个，而不是文档说的4个）
             # 检查是否启用了cache_control限制功能
             optimization_settings = config_mgr.get_optimization_settings()
-            if optimization_settings.get("enable_cache_control_limit", True):
+            # 同一个请求体只检查一次：限制后的请求体在后续重试中复用，无需重复解析
+            if converted_body is not cache_limit_checked_body and optimization_settings.get("enable_cache_control_limit", True):
                 try:
                     request_data_to_limit = json.loads(converted_body.decode('utf-8'))
 
-                    # 先统计cache_control块数量
-                    cache_count = 0
-                    for item in request_data_to_limit.get("system", []):
-                        if isinstance(item, dict) and "cache_control" in item:
-                            cache_count += 1
-                    for msg in request_data_to_limit.get("messages", []):
-                        if isinstance(msg, dict):
-                            content = msg.get("content", [])
-                            if isinstance(content, list):
-                                for c_item in content:
-                                    if isinstance(c_item, dict) and "cache_control" in c_item:
-                                        cache_count += 1
+                    # 先统计cache_control块数量（数到4个即可判断超限）
+                    cache_count = count_cache_control_blocks(request_data_to_limit, 4)
 
                     # 只有超过3个时才打印诊断信息并限制
                     if cache_count > 3:
-                        print(f"🔍 [cache_control诊断][{request_id}] 检测到 {cache_count} 个cache_control块", file=sys.stderr)
-                        limited_request_data = limit_cache_control_blocks(request_data_to_limit, max_blocks=3)
-                        converted_body = json.dumps(limited_request_data, ensure_ascii=False).encode('utf-8')
-                        # 修改了请求体后，必须删除旧的 Content-Length 头，让 httpx 重新计算
-                        # HTTP 头名称不区分大小写，需要逐一检查
-                        headers_to_remove = [k for k in retry_headers.keys() if k.lower() == 'content-length']
-                        for h in headers_to_remove:
-                            del retry_headers[h]
+                        elog("🔍 [cache_control诊断][%s] 检测到超过3个cache_control块", request_id)
+                        limited_request_data, converted_body = limit_cache_control_blocks(request_data_to_limit, max_blocks=3)
+                        # 修改了请求体后同步更新 Content-Length（请求头键名已统一为小写）
+                        # 基础headers也要更新，后续重试和切换API时复用的都是限制后的请求体
+                        headers['content-length'] = retry_headers['content-length'] = str(len(converted_body))
                 except Exception as e:
-                    print(f"[cache_control限制] 应用失败，使用原始请求: {e}", file=sys.stderr)
+                    elog("[cache_control限制] 应用失败，使用原始请求: %s", e)
+                cache_limit_checked_body = converted_body
 
             # 6. 以流式模式向上游发送请求（使用转换后的请求体和重试专用headers）
             upstream_req = retry_client.build_request(
@@ -3411,22 +4176,17 @@ async def reverse_proxy(request: Request, path: str):
             
             # Codex请求使用30秒连接超时（只针对连接阶段，不影响后续流式读取）
             if is_codex_request:
-                import asyncio
                 try:
-                    upstream_resp = await asyncio.wait_for(
-                        retry_client.send(upstream_req, stream=True),
-                        timeout=TimeoutConfig.get_codex_connect_timeout()
-                    )
+                    upstream_resp = await send_with_connect_timeout(retry_client, upstream_req, codex_connect_timeout)
                 except asyncio.TimeoutError:
-                    timeout_msg = f"[Codex连接超时][{request_id}] {TimeoutConfig.get_codex_connect_timeout()}秒内未收到响应，准备重试"
+                    timeout_msg = f"[Codex连接超时][{request_id}] {codex_connect_timeout}秒内未收到响应，准备重试"
                     retry_errors.append(timeout_msg)
-                    print(timeout_msg, file=sys.stderr)  # ← 立即打印超时信息
+                    elog(timeout_msg)  # ← 立即打印超时信息
                     # 记录Codex连接超时错误
                     msg = record_codex_error(codex_current_config_index, 503, silent=True)
                     if msg:
                         retry_errors.append(msg)
-                        print(msg, file=sys.stderr)  # ← 立即打印错误详情
-                    await retry_client.aclose()
+                        elog(msg)  # ← 立即打印错误详情
                     # 转换为httpx.ReadTimeout以复用现有重试逻辑
                     raise httpx.ReadTimeout("Codex connection timeout: 30 seconds")
             else:
@@ -3434,15 +4194,16 @@ async def reverse_proxy(request: Request, path: str):
             
             # 检查状态码是否需要策略重试（临时性错误，快速恢复）
             status_code = upstream_resp.status_code
-            strategy_retry_status_codes = TimeoutConfig.get_strategy_retry_status_codes()
+            # 三种策略的状态码集合取自请求入口的配置快照（frozenset，成员判断为一次哈希查找）
+            strategy_code_sets = retry_ctx.strategy_code_sets
+            strategy_retry_status_codes = strategy_code_sets["strategy_retry"]
             
             # 临时性错误：使用策略重试（快速尝试其他API）
             if (not is_codex_request) and status_code in strategy_retry_status_codes:
-                print(f"[策略重试触发][{request_id}] 检测到临时性错误{status_code}，将使用超时重试策略", file=sys.stderr)
+                elog("[策略重试触发][%s] 检测到临时性错误%s，将使用超时重试策略", request_id, status_code)
                 # 保存状态码，后续在异常处理块外使用策略重试
                 # 这里先关闭响应，制造一个"需要策略重试"的状态
                 await upstream_resp.aclose()
-                await retry_client.aclose()
                 # 抛出特殊标记，后续捕获并使用策略重试
                 raise httpx.HTTPStatusError(
                     f"Status {status_code} - Strategy Retry Needed",
@@ -3452,48 +4213,35 @@ async def reverse_proxy(request: Request, path: str):
             
             # 临时性错误处理：内部重试，不返回给用户（Codex和Claude都适用）
             # 从配置中读取哪些状态码需要触发API切换
-            strategies = config_mgr.get_error_handling_strategies()
-            http_codes = strategies.get("http_status_codes", {})
-            switch_api_codes = [int(code) for code, strategy in http_codes.items()
-                              if strategy == "switch_api" and code != "default"]
-            no_retry_codes = [int(code) for code, strategy in http_codes.items()
-                            if strategy == "normal_retry" and code != "default"]
+            switch_api_codes = strategy_code_sets["switch"]
+            no_retry_codes = strategy_code_sets["no_retry"]
             
             # no_retry策略：记录错误，延时后跳出重试循环（Codex和Claude都适用）
             if status_code in no_retry_codes:
+                # 记录错误（Codex和Claude分别计数）
                 if is_codex_request:
-                    # Codex请求：记录错误
-                    print(f"[不重试策略][{request_id}] 检测到错误{status_code}，延时后返回错误给用户", file=sys.stderr)
                     msg = record_codex_error(codex_current_config_index, status_code, silent=True)
-                    if msg:
-                        print(msg, file=sys.stderr)
-                    # 添加延时
-                    import asyncio
-                    delay = 2
-                    print(f"[不重试策略][{request_id}] 等待 {delay} 秒后继续...", file=sys.stderr)
-                    await asyncio.sleep(delay)
-                    # 跳出重试循环，让后续的正常流程处理响应（保留usage信息）
-                    break
                 else:
-                    # Claude请求：记录错误
-                    print(f"[不重试策略][{request_id}] 检测到错误{status_code}，延时后返回错误给用户", file=sys.stderr)
                     msg = record_api_error(current_config_index, status_code, silent=True)
-                    if msg:
-                        print(msg, file=sys.stderr)
-                    # 添加延时
-                    import asyncio
-                    delay = 2
-                    print(f"[不重试策略][{request_id}] 等待 {delay} 秒后继续...", file=sys.stderr)
-                    await asyncio.sleep(delay)
-                    # 跳出重试循环，让后续的正常流程处理响应（保留usage信息）
-                    break
+                # 添加延时
+                delay = 2
+                # 多行日志合并为一条记录输出
+                if msg:
+                    elog("[不重试策略][%s] 检测到错误%s，延时后返回错误给用户\n%s\n[不重试策略][%s] 等待 %s 秒后继续...",
+                         request_id, status_code, msg, request_id, delay)
+                else:
+                    elog("[不重试策略][%s] 检测到错误%s，延时后返回错误给用户\n[不重试策略][%s] 等待 %s 秒后继续...",
+                         request_id, status_code, request_id, delay)
+                await asyncio.sleep(delay)
+                # 跳出重试循环，让后续的正常流程处理响应（保留usage信息）
+                break
             
             if status_code in switch_api_codes:
                 # 根据请求类型选择不同的错误提示
                 request_type = "Codex" if is_codex_request else "Claude"
                 error_msg = f"[{request_type}错误重试 {retry_attempt + 1}/{max_retries}][{request_id}] 检测到错误{status_code}，内部重试"
                 retry_errors.append(error_msg)
-                print(error_msg, file=sys.stderr)  # ← 立即打印错误信息
+                elog(error_msg)  # ← 立即打印错误信息
                 
                 # 初始化切换标志
                 switch_success = False
@@ -3504,7 +4252,7 @@ async def reverse_proxy(request: Request, path: str):
                     msg = record_codex_error(codex_current_config_index, status_code, silent=True)
                     if msg:
                         retry_errors.append(msg)
-                        print(msg, file=sys.stderr)  # ← 立即打印错误详情
+                        elog(msg)  # ← 立即打印错误详情
                 # Claude请求：不在这里记录错误，改为在重试循环结束后统一记录
                 # 更新错误追踪信息
                 else:
@@ -3520,7 +4268,7 @@ async def reverse_proxy(request: Request, path: str):
                     if switch_success:
                         switch_msg = f"[Codex错误重试][{request_id}] 已切换到 {CODEX_CONFIGS[new_codex_api_index]['name']}"
                         retry_errors.append(switch_msg)
-                        print(switch_msg, file=sys.stderr)  # ← 立即打印切换信息
+                        elog(switch_msg)  # ← 立即打印切换信息
                 else:
                     # Claude请求的API切换
                     current_api_index = current_config_index
@@ -3529,11 +4277,10 @@ async def reverse_proxy(request: Request, path: str):
                     if switch_success:
                         switch_msg = f"[Claude错误重试][{request_id}] 已切换到 {API_CONFIGS[new_api_index]['name']}"
                         retry_errors.append(switch_msg)
-                        print(switch_msg, file=sys.stderr)  # ← 立即打印切换信息
+                        elog(switch_msg)  # ← 立即打印切换信息
                 
-                # 关闭当前响应和客户端
+                # 关闭当前响应（客户端为共享连接池，不关闭）
                 await upstream_resp.aclose()
-                await retry_client.aclose()
                 
                 # 根据请求类型重新构建配置和URL
                 if is_codex_request:
@@ -3545,7 +4292,7 @@ async def reverse_proxy(request: Request, path: str):
                         print(f"\n{get_current_codex_info()}")
                     
                     # 重新构建URL和认证信息
-                    upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, current_codex_config["base_url"])
+                    upstream_url = join_upstream_url(current_codex_config["base_url"], upstream_suffix)
                     headers['authorization'] = f'Bearer {current_codex_config["key"]}'
                 else:
                     # Claude请求的配置重建
@@ -3555,7 +4302,7 @@ async def reverse_proxy(request: Request, path: str):
                         if is_valid:
                             headers['authorization'] = real_auth_header
                             # 重新构建URL（base_url可能已变化）
-                            upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
+                            upstream_url = join_upstream_url(base_url_override, upstream_suffix)
                             print(f"\n{get_current_api_info()}")  # 显示切换后的API信息
                 
                 # 继续下一次重试
@@ -3571,202 +4318,61 @@ async def reverse_proxy(request: Request, path: str):
                     # 还有重试机会，继续重试
                     error_msg = f"[重试 {retry_attempt + 1}/{max_retries}][{request_id}] 检测到错误{upstream_resp.status_code}，继续重试"
                     retry_errors.append(error_msg)
-                    print(error_msg, file=sys.stderr)
+                    elog(error_msg)
                     await upstream_resp.aclose()
-                    await retry_client.aclose()
                     continue
                 else:
                     # 最后一次重试，跳出循环返回错误
                     break
             
-        except (httpx.HTTPStatusError, httpx.RequestError) as e:
+        except _HX_EXC as e:
             last_error = e
-            error_type_name = "状态码错误" if isinstance(e, httpx.HTTPStatusError) else "连接错误"
+            error_type_name = "状态码错误" if isinstance(e, _HX_HTTPStatusError) else "连接错误"
             general_error_msg = f"[重试 {retry_attempt + 1}/{max_retries}][{request_id}] {error_type_name}: {e}"
             retry_errors.append(general_error_msg)
-            print(general_error_msg, file=sys.stderr)  # ← 立即打印通用错误
-            
-            # 关闭当前的client实例，避免状态异常影响后续重试
-            await retry_client.aclose()
+            elog(general_error_msg)  # ← 立即打印通用错误
             
-            # 特殊处理ReadError：根据配置决定处理策略
-            if isinstance(e, httpx.ReadError):
-                read_error_strategy = TimeoutConfig.get_network_error_strategy("ReadError")
+            # 特殊处理ReadError/ConnectError：根据配置决定处理策略
+            conn_error_kind = match_connection_error(e)
+            if conn_error_kind is not None:
+                strategy_key, error_label, error_desc, tag = conn_error_kind
+                conn_error_strategy = retry_ctx.network_error_strategies[strategy_key]
                 
                 if is_codex_request:
-                    # Codex请求的ReadError：每次都记录错误（保持原有逻辑）
-                    retry_errors.append(f"[SSL读取错误][{request_id}] Codex检测到SSL读取错误或连接中断")
+                    # Codex请求的连接类错误：每次都记录错误（保持原有逻辑）
+                    retry_errors.append(f"[{error_label}][{request_id}] Codex{error_desc}")
                     msg = record_codex_error(codex_current_config_index, 503, silent=True)
                     if msg:
                         retry_errors.append(msg)
-                # Claude请求的ReadError：不在这里记录错误，改为在重试循环结束后统一记录
+                # Claude请求的连接类错误：不在这里记录错误，改为在重试循环结束后统一记录
                 
                 # 为normal_retry策略设置错误记录标志
-                if (not is_codex_request) and read_error_strategy == "normal_retry":
+                if (not is_codex_request) and conn_error_strategy == "normal_retry":
                     last_error_status_code = 503
                     last_error_strategy = "normal_retry"
                     should_record_error_after_retry = True
                 
-                if (not is_codex_request) and read_error_strategy == "switch_api":
-                    # 配置为switch_api策略：强制切换API
-                    read_error_msg = f"[SSL读取错误-切换API][{request_id}] 检测到SSL读取错误或连接中断，强制切换API"
-                    retry_errors.append(read_error_msg)
-                    print(read_error_msg, file=sys.stderr)  # ← 立即打印ReadError检测
-                    
-                    # ReadError视为严重连接错误，直接记录错误并尝试切换API
-                    current_api_index = current_config_index
-                    switch_success, new_api_index = smart_switch_api(current_api_index, 503)  # 使用503错误码触发切换
-                    if switch_success:
-                        read_switch_msg = f"[SSL读取错误-切换API成功][{request_id}] API切换成功，使用新API重试"
-                        retry_errors.append(read_switch_msg)
-                        print(read_switch_msg, file=sys.stderr)  # ← 立即打印ReadError切换成功
-                        # 重新构建请求头和URL，使用新API
-                        is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
-                        if is_valid:
-                            headers['authorization'] = real_auth_header
-                            new_upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
-                            
-                            # 根据配置决定是否修改重试请求头
-                            read_error_retry_headers = headers.copy()
-                            if TimeoutConfig.get_modify_retry_headers():
-                                read_error_retry_headers['connection'] = 'close'
-                                import random
-                                import time
-                                read_error_rand = random.randint(1000,9999)
-                                read_error_timestamp = int(time.time() * 1000)
-                                read_error_retry_headers['x-request-id'] = f"{request_id}-readerror-{retry_attempt + 1}-{read_error_rand}"
-                                read_error_retry_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                                read_error_retry_headers['pragma'] = 'no-cache'
-                                read_error_retry_headers['expires'] = '0'
-                                read_error_retry_headers['x-cache-bypass'] = f'{read_error_timestamp}-{read_error_rand}'
-                                read_error_retry_headers['x-retry-count'] = str(retry_attempt + 1)
-                        
-                        try:
-                            # 使用新的重试客户端
-                            read_error_retry_client = httpx.AsyncClient(timeout=timeout, limits=limits)
-                            read_error_upstream_req = read_error_retry_client.build_request(
-                                method=request.method,
-                                url=new_upstream_url,
-                                headers=read_error_retry_headers,
-                                content=converted_body
-                            )
-                            upstream_resp = await read_error_retry_client.send(read_error_upstream_req, stream=True)
-                            retry_client = read_error_retry_client  # 更新重试客户端引用
-                            read_status_msg = f"[SSL读取错误-切换API][{request_id}] 新API响应状态码: {upstream_resp.status_code}"
-                            retry_errors.append(read_status_msg)
-                            print(read_status_msg, file=sys.stderr)  # ← 立即打印新API状态码
-                            # 只有成功响应（< 400）才跳出重试循环，错误响应继续重试
-                            if upstream_resp.status_code < 400:
-                                retry_errors.clear()
-                                break
-                            else:
-                                read_error_status_msg = f"[SSL读取错误-切换API][{request_id}] 新API仍返回错误{upstream_resp.status_code}，继续重试"
-                                retry_errors.append(read_error_status_msg)
-                                print(read_error_status_msg, file=sys.stderr)  # ← 立即打印新API错误
-                                await upstream_resp.aclose()
-                                await read_error_retry_client.aclose()
-                                # 不break，继续下一次重试
-                        except Exception as read_error_retry_exception:
-                            retry_errors.append(f"[SSL读取错误-切换API失败][{request_id}] 新API重试也失败: {read_error_retry_exception}")
-                            await read_error_retry_client.aclose()
-                    else:
-                        read_fail_msg = f"[SSL读取错误-切换API失败][{request_id}] API切换失败，继续正常重试流程"
-                        retry_errors.append(read_fail_msg)
-                        print(read_fail_msg, file=sys.stderr)  # ← 立即打印ReadError切换失败
-            
-            # 特殊处理ConnectError：根据配置决定处理策略
-            if isinstance(e, httpx.ConnectError):
-                connect_error_strategy = TimeoutConfig.get_network_error_strategy("ConnectError")
-                
-                if is_codex_request:
-                    # Codex请求的ConnectError：每次都记录错误（保持原有逻辑）
-                    retry_errors.append(f"[连接失败][{request_id}] Codex检测到连接错误")
-                    msg = record_codex_error(codex_current_config_index, 503, silent=True)
-                    if msg:
-                        retry_errors.append(msg)
-                # Claude请求的ConnectError：不在这里记录错误，改为在重试循环结束后统一记录
-                
-                # 为normal_retry策略设置错误记录标志
-                if (not is_codex_request) and connect_error_strategy == "normal_retry":
-                    last_error_status_code = 503
-                    last_error_strategy = "normal_retry"
-                    should_record_error_after_retry = True
-                
-                if (not is_codex_request) and connect_error_strategy == "switch_api":
-                    # 配置为switch_api策略：强制切换API
-                    connect_error_msg = f"[连接失败-切换API][{request_id}] 检测到连接错误，强制切换API"
-                    retry_errors.append(connect_error_msg)
-                    print(connect_error_msg, file=sys.stderr)  # ← 立即打印ConnectError检测
-                    
-                    # ConnectError视为严重连接错误，直接记录错误并尝试切换API
-                    current_api_index = current_config_index
-                    switch_success, new_api_index = smart_switch_api(current_api_index, 503)  # 使用503错误码触发切换
-                    if switch_success:
-                        connect_switch_msg = f"[连接失败-切换API成功][{request_id}] API切换成功，使用新API重试"
-                        retry_errors.append(connect_switch_msg)
-                        print(connect_switch_msg, file=sys.stderr)  # ← 立即打印ConnectError切换成功
-                        # 重新构建请求头和URL，使用新API
-                        is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
-                        if is_valid:
-                            headers['authorization'] = real_auth_header
-                            new_upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
-                            
-                            # 使用全新headers副本，强制断开旧连接
-                            connect_error_retry_headers = headers.copy()
-                            if TimeoutConfig.get_modify_retry_headers():
-                                connect_error_retry_headers['connection'] = 'close'
-                                import random
-                                import time
-                                connect_error_rand = random.randint(1000,9999)
-                                connect_error_timestamp = int(time.time() * 1000)
-                                connect_error_retry_headers['x-request-id'] = f"{request_id}-connecterror-{retry_attempt + 1}-{connect_error_rand}"
-                                connect_error_retry_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                                connect_error_retry_headers['pragma'] = 'no-cache'
-                                connect_error_retry_headers['expires'] = '0'
-                                connect_error_retry_headers['x-cache-bypass'] = f'{connect_error_timestamp}-{connect_error_rand}'
-                                connect_error_retry_headers['x-retry-count'] = str(retry_attempt + 1)
-                        
-                        try:
-                            # 使用新的重试客户端
-                            connect_error_retry_client = httpx.AsyncClient(timeout=timeout, limits=limits)
-                            connect_error_upstream_req = connect_error_retry_client.build_request(
-                                method=request.method,
-                                url=new_upstream_url,
-                                headers=connect_error_retry_headers,
-                                content=converted_body
-                            )
-                            upstream_resp = await connect_error_retry_client.send(connect_error_upstream_req, stream=True)
-                            retry_client = connect_error_retry_client  # 更新重试客户端引用
-                            connect_status_msg = f"[连接失败-切换API][{request_id}] 新API响应状态码: {upstream_resp.status_code}"
-                            retry_errors.append(connect_status_msg)
-                            print(connect_status_msg, file=sys.stderr)  # ← 立即打印新API状态码
-                            # 只有成功响应（< 400）才跳出重试循环，错误响应继续重试
-                            if upstream_resp.status_code < 400:
-                                retry_errors.clear()
-                                break
-                            else:
-                                connect_error_status_msg = f"[连接失败-切换API][{request_id}] 新API仍返回错误{upstream_resp.status_code}，继续重试"
-                                retry_errors.append(connect_error_status_msg)
-                                print(connect_error_status_msg, file=sys.stderr)  # ← 立即打印新API错误
-                                await upstream_resp.aclose()
-                                await connect_error_retry_client.aclose()
-                                # 不break，继续下一次重试
-                        except Exception as connect_error_retry_exception:
-                            retry_errors.append(f"[连接失败-切换API失败][{request_id}] 新API重试也失败: {connect_error_retry_exception}")
-                            await connect_error_retry_client.aclose()
-                    else:
-                        connect_fail_msg = f"[连接失败-切换API失败][{request_id}] API切换失败，继续正常重试流程"
-                        retry_errors.append(connect_fail_msg)
-                        print(connect_fail_msg, file=sys.stderr)  # ← 立即打印ConnectError切换失败
+                if (not is_codex_request) and conn_error_strategy == "switch_api":
+                    # 配置为switch_api策略：强制切换API并立即用新API重发
+                    switched_resp = await switch_api_and_resend(
+                        error_label, error_desc, tag, request, headers, converted_body,
+                        request_id, retry_attempt, clean_path, is_openai_format,
+                        base_url_override, user_auth_header, retry_errors
+                    )
+                    if switched_resp is not None:
+                        upstream_resp = switched_resp
+                        retry_client = get_pooled_client("streaming")  # 更新重试客户端引用
+                        retry_errors.clear()
+                        break
             
             # 特殊处理网络错误和HTTPStatusError：根据配置决定是否使用策略重试
-            is_read_timeout = isinstance(e, httpx.ReadTimeout)
-            is_strategy_status = isinstance(e, httpx.HTTPStatusError) and "Strategy Retry Needed" in str(e)
+            is_read_timeout = isinstance(e, _HX_ReadTimeout)
+            is_strategy_status = isinstance(e, _HX_HTTPStatusError) and "Strategy Retry Needed" in str(e)
             # 检查其他网络错误是否配置为strategy_retry
-            is_read_error_strategy = isinstance(e, httpx.ReadError) and TimeoutConfig.get_network_error_strategy("ReadError") == "strategy_retry"
-            is_connect_error_strategy = isinstance(e, httpx.ConnectError) and TimeoutConfig.get_network_error_strategy("ConnectError") == "strategy_retry"
+            is_read_error_strategy = isinstance(e, _HX_ReadError) and retry_ctx.network_error_strategies["ReadError"] == "strategy_retry"
+            is_connect_error_strategy = isinstance(e, _HX_ConnectError) and retry_ctx.network_error_strategies["ConnectError"] == "strategy_retry"
             # ReadTimeout根据配置决定是否使用策略重试
-            is_read_timeout_strategy = is_read_timeout and TimeoutConfig.get_network_error_strategy("ReadTimeout") == "strategy_retry"
+            is_read_timeout_strategy = is_read_timeout and retry_ctx.network_error_strategies["ReadTimeout"] == "strategy_retry"
             
             if (is_read_timeout_strategy or is_read_error_strategy or is_connect_error_strategy or is_strategy_status) and not is_codex_request:
                 # 识别错误类型
@@ -3780,14 +4386,14 @@ async def reverse_proxy(request: Request, path: str):
                     error_type = "临时性状态码"
                 strategy_detect_msg = f"[策略重试][{request_id}] 检测到{error_type}，尝试第{retry_attempt + 1}个策略"
                 retry_errors.append(strategy_detect_msg)
-                print(strategy_detect_msg, file=sys.stderr)  # ← 立即打印策略重试检测
+                elog(strategy_detect_msg)  # ← 立即打印策略重试检测
                 
                 # 检查是否有对应的重试策略
                 if retry_attempt < len(READ_TIMEOUT_RETRY_CONFIGS):
                     retry_config = READ_TIMEOUT_RETRY_CONFIGS[retry_attempt]
                     strategy_use_msg = f"[策略重试][{request_id}] 使用策略: {retry_config['name']}"
                     retry_errors.append(strategy_use_msg)
-                    print(strategy_use_msg, file=sys.stderr)  # ← 立即打印使用策略
+                    elog(strategy_use_msg)  # ← 立即打印使用策略
                     
                     # 构建重试URL（与build_upstream_url函数逻辑保持一致）
                     temp_upstream_url = f"{retry_config['base_url']}/{clean_path}"
@@ -3801,24 +4407,11 @@ async def reverse_proxy(request: Request, path: str):
                         temp_upstream_url += "?beta=true"
                     
                     # 构建临时请求头，使用策略配置的key
-                    temp_headers = headers.copy()
+                    temp_headers = build_retry_headers(headers, f"{request_id}-readtimeout-{retry_attempt + 1}", retry_attempt + 1)
                     temp_headers['authorization'] = f"Bearer {retry_config['key']}"
-                    if TimeoutConfig.get_modify_retry_headers():
-                        temp_headers['connection'] = 'close'
-                        # 添加完整的防缓存头部，确保ReadTimeout重试时API不使用缓存
-                        import time
-                        temp_rand = random.randint(1000,9999)
-                        temp_timestamp = int(time.time() * 1000)
-                        temp_headers['x-request-id'] = f"{request_id}-readtimeout-{retry_attempt + 1}-{temp_rand}"
-                        temp_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                        temp_headers['pragma'] = 'no-cache'
-                        temp_headers['expires'] = '0'
-                        temp_headers['x-cache-bypass'] = f'{temp_timestamp}-{temp_rand}'
-                        temp_headers['x-retry-count'] = str(retry_attempt + 1)
                     
                     # 使用策略重试专用的超时配置（200秒读取超时）
-                    extended_timeout = TimeoutConfig.get_strategy_retry_timeout()
-                    temp_client = httpx.AsyncClient(timeout=extended_timeout, limits=limits)
+                    temp_client = get_pooled_client("strategy")
                     try:
                         temp_upstream_req = temp_client.build_request(
                             method=request.method,
@@ -3829,7 +4422,7 @@ async def reverse_proxy(request: Request, path: str):
                         upstream_resp = await temp_client.send(temp_upstream_req, stream=True)
                         strategy_status_msg = f"[策略重试][{request_id}] {retry_config['name']} 响应状态码: {upstream_resp.status_code}"
                         retry_errors.append(strategy_status_msg)
-                        print(strategy_status_msg, file=sys.stderr)  # ← 立即打印策略响应状态码
+                        elog(strategy_status_msg)  # ← 立即打印策略响应状态码
                         
                         # 只有成功响应（< 400）才跳出重试循环，错误响应继续重试
                         if upstream_resp.status_code < 400:
@@ -3839,9 +4432,8 @@ async def reverse_proxy(request: Request, path: str):
                         else:
                             strategy_error_msg = f"[策略重试][{request_id}] {retry_config['name']} 仍返回错误{upstream_resp.status_code}，继续重试"
                             retry_errors.append(strategy_error_msg)
-                            print(strategy_error_msg, file=sys.stderr)  # ← 立即打印策略错误
+                            elog(strategy_error_msg)  # ← 立即打印策略错误
                             await upstream_resp.aclose()
-                            await temp_client.aclose()
                             # 不break，继续下一次重试
                         
                     except Exception as strategy_error:
@@ -3850,23 +4442,19 @@ async def reverse_proxy(request: Request, path: str):
                         strategy_fail_msg1 = f"[策略重试][{request_id}] {retry_config['name']} 失败"
                         strategy_fail_msg2 = f"[策略重试][{request_id}] 错误类型: {error_type}"
                         strategy_fail_msg3 = f"[策略重试][{request_id}] 错误详情: {error_msg}"
-                        retry_errors.append(strategy_fail_msg1)
-                        retry_errors.append(strategy_fail_msg2)
-                        retry_errors.append(strategy_fail_msg3)
-                        print(strategy_fail_msg1, file=sys.stderr)  # ← 立即打印策略失败
-                        print(strategy_fail_msg2, file=sys.stderr)
-                        print(strategy_fail_msg3, file=sys.stderr)
+                        retry_errors.extend((strategy_fail_msg1, strategy_fail_msg2, strategy_fail_msg3))
+                        # ← 立即打印策略失败（三行合并为一条日志记录）
+                        elog("%s\n%s\n%s", strategy_fail_msg1, strategy_fail_msg2, strategy_fail_msg3)
                         retry_errors.append(f"[策略重试][{request_id}] 尝试的URL: {temp_upstream_url}")
                         retry_errors.append(f"[策略重试][{request_id}] 使用的Key: {retry_config['key'][:20]}...")
                         
                         # 特殊检查：如果是https连接问题，给出建议
                         if "https://anyrouter.top" in temp_upstream_url:
-                            if "timeout" in error_msg.lower() or isinstance(strategy_error, (httpx.ReadTimeout, httpx.ConnectTimeout)):
+                            if "timeout" in error_msg.lower() or isinstance(strategy_error, _HX_TIMEOUT_EXC):
                                 retry_errors.append(f"[读取超时-策略重试][{request_id}] 提示: anyrouter.top可能网络延迟较高，考虑检查网络连接")
                             elif "ssl" in error_msg.lower() or "certificate" in error_msg.lower():
                                 retry_errors.append(f"[读取超时-策略重试][{request_id}] 提示: anyrouter.top可能有SSL证书问题")
                         
-                        await temp_client.aclose()
                         # 继续下一个重试策略
                 else:
                     retry_errors.append(f"[读取超时-策略重试][{request_id}] 已超出预定义策略数量，回到正常重试逻辑")
@@ -3879,179 +4467,55 @@ async def reverse_proxy(request: Request, path: str):
             
             if retry_attempt < max_retries - 1:
                 # 还有重试机会，使用递增延迟（指数退避）让网络状态有时间恢复
-                import asyncio
-                delay = 2 ** retry_attempt  # 1, 2, 4, 8秒的递增延迟
-                retry_errors.append(f"[{request_id}] 等待 {delay} 秒后重试...")
+                delay = _RETRY_BACKOFF[min(retry_attempt, len(_RETRY_BACKOFF) - 1)] + random.uniform(0, _RETRY_BACKOFF_JITTER)
+                retry_errors.append(f"[{request_id}] 等待 {delay:.2f} 秒后重试...")
                 await asyncio.sleep(delay)
                 continue
             else:
                 # 最后一次重试失败，输出所有收集的错误信息
                 for err in retry_errors:
-                    print(err, file=sys.stderr)
+                    elog(err)
                 
                 # Claude请求：在所有重试都失败后，统一记录错误
                 if not is_codex_request and should_record_error_after_retry:
-                    if last_error_strategy == "switch_api" and last_error_status_code:
-                        # switch_api策略：重试max_retries次都失败，记录+1次错误
-                        msg = record_api_error(current_config_index, last_error_status_code, silent=True)
-                        if msg:
-                            print(msg, file=sys.stderr)
-                    elif last_error_strategy == "strategy_retry":
-                        # strategy_retry策略：所有备用节点都失败，记录+1次错误
-                        msg = record_api_error(current_config_index, 503, silent=True)
-                        if msg:
-                            print(msg, file=sys.stderr)
-                    elif last_error_strategy == "normal_retry" and last_error_status_code:
-                        # normal_retry策略：重试max_retries次都失败，记录+1次错误
-                        msg = record_api_error(current_config_index, last_error_status_code, silent=True)
-                        if msg:
-                            print(msg, file=sys.stderr)
+                    record_final_retry_error(last_error_strategy, last_error_status_code)
                 
-                import traceback
                 error_message = f"Proxy Error: Could not connect to upstream server at {upstream_url}. Exception: {e}"
-                print(f"[{request_id}] {error_message}", file=sys.stderr)
-                print(f"[{request_id}] 连接错误详情: {traceback.format_exc()}", file=sys.stderr)
-                print(f"[{request_id}] 请求方法: {request.method}, 目标URL: {upstream_url}", file=sys.stderr)
-                print(f"[{request_id}] 请求头: {dict(headers)}", file=sys.stderr)
+                elog("[%s] %s\n[%s] 请求方法: %s, 目标URL: %s", request_id, error_message, request_id, request.method, upstream_url)
+                # 调用栈和请求头只在调试模式下输出（PROXY_DEBUG=1），重试风暴时不做栈展开和整表复制
+                if DEBUG:
+                    print(f"[{request_id}] 连接错误详情: {traceback.format_exc()}", file=sys.stderr)
+                    elog("[%s] 请求头: %s", request_id, headers)
                 
-                from fastapi.responses import Response
                 
                 # switch_api策略：不立即返回错误，尝试切换所有可用API
-                strategies = config_mgr.get_error_handling_strategies()
-                http_codes = strategies.get("http_status_codes", {})
-                switch_api_codes = [int(code) for code, strategy in http_codes.items()
-                                  if strategy == "switch_api" and code != "default"]
+                switch_api_codes = retry_ctx.strategy_code_sets["switch"]
                 
                 # 如果配置了switch_api策略，尝试扩展重试
-                if len(switch_api_codes) > 0:
-                    extended_retry_success = False
-                    max_api_count = len(CODEX_CONFIGS) if is_codex_request else len(API_CONFIGS)
-                    extended_switch_count = 0
-                    max_extended_switches = max_api_count * 3  # 每个API最多尝试3次
-                    
-                    print(f"[switch_api扩展重试][{request_id}] 主重试循环失败，开始尝试其他可用API...", file=sys.stderr)
-                    
-                    while extended_switch_count < max_extended_switches:
-                        # 尝试切换API
-                        if is_codex_request:
-                            switch_success, new_index = smart_codex_switch_api(codex_current_config_index, 503)
-                        else:
-                            switch_success, new_index = smart_switch_api(current_config_index, 503)
-                        
-                        if not switch_success:
-                            print(f"[switch_api扩展重试][{request_id}] 无法切换到新API，所有API已尝试", file=sys.stderr)
-                            break
-                        
-                        extended_switch_count += 1
-                        print(f"[switch_api扩展重试][{request_id}] 第{extended_switch_count}次API切换", file=sys.stderr)
-                        
-                        # 重新构建请求
-                        try:
-                            if is_codex_request:
-                                current_codex_config = get_current_codex_config()
-                                print(f"\n{get_current_codex_info()}")
-                                upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, current_codex_config["base_url"])
-                                headers['authorization'] = f'Bearer {current_codex_config["key"]}'
-                                
-                                codex_timeout = httpx.Timeout(
-                                    connect=TimeoutConfig.get_connect_timeout(),
-                                    read=None,
-                                    write=TimeoutConfig.get_write_timeout(),
-                                    pool=TimeoutConfig.get_pool_timeout()
-                                )
-                                extended_client = httpx.AsyncClient(timeout=codex_timeout, limits=limits)
-                            else:
-                                is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
-                                if is_valid:
-                                    headers['authorization'] = real_auth_header
-                                    upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
-                                    print(f"\n{get_current_api_info()}")
-                                else:
-                                    print(f"[switch_api扩展重试][{request_id}] 验证Key失败: {error_msg}", file=sys.stderr)
-                                    break
-                                
-                                if should_convert_to_openai and not user_wants_stream:
-                                    extended_client = httpx.AsyncClient(timeout=non_streaming_timeout, limits=limits)
-                                else:
-                                    extended_client = httpx.AsyncClient(timeout=timeout, limits=limits)
-                            
-                            # 发送请求
-                            extended_headers = headers.copy()
-                            if TimeoutConfig.get_modify_retry_headers():
-                                extended_headers['connection'] = 'close'
-                                import random, time
-                                ext_rand = random.randint(1000,9999)
-                                ext_timestamp = int(time.time() * 1000)
-                                extended_headers['x-request-id'] = f"{request_id}-extended-{extended_switch_count}-{ext_rand}"
-                                extended_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                                extended_headers['pragma'] = 'no-cache'
-                                extended_headers['expires'] = '0'
-                                extended_headers['x-cache-bypass'] = f'{ext_timestamp}-{ext_rand}'
-                            
-                            extended_req = extended_client.build_request(
-                                method=request.method,
-                                url=upstream_url,
-                                headers=extended_headers,
-                                content=converted_body
-                            )
-                            
-                            if is_codex_request:
-                                import asyncio
-                                try:
-                                    extended_resp = await asyncio.wait_for(
-                                        extended_client.send(extended_req, stream=True),
-                                        timeout=TimeoutConfig.get_codex_connect_timeout()
-                                    )
-                                except asyncio.TimeoutError:
-                                    print(f"[switch_api扩展重试][{request_id}] Codex连接超时", file=sys.stderr)
-                                    await extended_client.aclose()
-                                    continue
-                            else:
-                                extended_resp = await extended_client.send(extended_req, stream=True)
-                            
-                            print(f"[switch_api扩展重试][{request_id}] 响应状态码: {extended_resp.status_code}", file=sys.stderr)
-                            
-                            # 检查响应
-                            if extended_resp.status_code < 400:
-                                # 成功！使用这个响应
-                                print(f"[switch_api扩展重试][{request_id}] 成功！使用新API响应", file=sys.stderr)
-                                upstream_resp = extended_resp
-                                retry_client = extended_client
-                                extended_retry_success = True
-                                retry_errors.clear()  # 清空错误列表
-                                break
-                            else:
-                                # 失败，继续尝试其他API
-                                print(f"[switch_api扩展重试][{request_id}] API返回错误{extended_resp.status_code}，继续尝试其他API", file=sys.stderr)
-                                if is_codex_request:
-                                    record_codex_error(codex_current_config_index, extended_resp.status_code, silent=True)
-                                else:
-                                    record_api_error(current_config_index, extended_resp.status_code, silent=True)
-                                await extended_resp.aclose()
-                                await extended_client.aclose()
-                                continue
-                        
-                        except Exception as extended_error:
-                            print(f"[switch_api扩展重试][{request_id}] 扩展重试异常: {extended_error}", file=sys.stderr)
-                            if is_codex_request:
-                                record_codex_error(codex_current_config_index, 503, silent=True)
-                            else:
-                                record_api_error(current_config_index, 503, silent=True)
-                            await extended_client.aclose()
-                            continue
+                if switch_api_codes:
+                    stderr_logger.info("[switch_api扩展重试][%s] 主重试循环失败，开始尝试其他可用API...", request_id)
+                    extended_resp, upstream_url = await extended_switch_retry(
+                        request, headers, converted_body, request_id, upstream_url, 503, switch_api_codes, False,
+                        is_codex_request=is_codex_request, clean_path=clean_path, is_openai_format=is_openai_format,
+                        base_url_override=base_url_override, user_auth_header=user_auth_header,
+                        client_profile=extended_client_profile, codex_connect_timeout=codex_connect_timeout
+                    )
                     
                     # 如果扩展重试成功，不返回错误，继续正常流程
-                    if not extended_retry_success:
-                        print(f"[switch_api扩展重试][{request_id}] 所有API均已尝试，仍然失败", file=sys.stderr)
+                    if extended_resp is None:
+                        elog("[switch_api扩展重试][%s] 所有API均已尝试，仍然失败", request_id)
                         return Response(content=error_message, status_code=502)
+                    upstream_resp = extended_resp
+                    retry_client = get_pooled_client(extended_client_profile)
+                    retry_errors.clear()  # 清空错误列表
                 else:
                     # 非switch_api策略，直接返回错误
                     return Response(content=error_message, status_code=502)
-    
-    # 确保关闭重试创建的client实例（如果有的话）
-    if 'retry_client' in locals() and retry_client != client:
-        # 延迟关闭，确保响应处理完成后再关闭
-        pass  # 后续在finally块中处理
+        except BaseException:
+            # 非网络异常（包括客户端断开导致的任务取消）：释放本次尝试打开的响应，把连接还给共享连接池
+            if upstream_resp is not None and not upstream_resp.is_closed:
+                await upstream_resp.aclose()
+            raise
     
     # 删除详细的上游响应记录
     
@@ -4060,42 +4524,29 @@ async def reverse_proxy(request: Request, path: str):
         # 请求成功，重置当前API的错误计数
         if not is_codex_request:
             current_api_index = current_config_index
-            if (api_status[current_api_index]["error_count"] > 0 or
-                api_status[current_api_index]["cooldown_until"] is not None):
-                api_status[current_api_index].update({
-                    "error_count": 0,
-                    "cooldown_until": None,
-                    "status": "normal"
-                })
+            record_circuit_result(current_api_index, False, True)
+            if (api_status[current_api_index].error_count > 0 or
+                api_status[current_api_index].cooldown_until is not None):
+                api_status[current_api_index].reset()
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] API {API_CONFIGS[current_api_index]['name']} 请求成功，完全重置状态", file=sys.stderr)
         else:
             # Codex请求成功，重置错误计数
             current_codex_index = codex_current_config_index
+            record_circuit_result(current_codex_index, True, True)
             if current_codex_index < len(CODEX_CONFIGS) and current_codex_index in codex_api_status:
-                if (codex_api_status[current_codex_index]["error_count"] > 0 or
-                    codex_api_status[current_codex_index]["cooldown_until"] is not None):
-                    codex_api_status[current_codex_index].update({
-                        "error_count": 0,
-                        "cooldown_until": None,
-                        "status": "normal"
-                    })
+                if (codex_api_status[current_codex_index].error_count > 0 or
+                    codex_api_status[current_codex_index].cooldown_until is not None):
+                    codex_api_status[current_codex_index].reset()
                     print(f"[{datetime.now().strftime('%H:%M:%S')}] Codex {CODEX_CONFIGS[current_codex_index]['name']} 请求成功，完全重置状态", file=sys.stderr)
     else:
         # 重试循环正常结束但请求失败（status_code >= 400）
         # 对于switch_api策略，先尝试扩展重试，只有所有API都失败后才记录错误
-        strategies = config_mgr.get_error_handling_strategies()
-        http_codes = strategies.get("http_status_codes", {})
-        switch_api_codes = [int(code) for code, strategy in http_codes.items()
-                          if strategy == "switch_api" and code != "default"]
+        # switch_api状态码集合取自请求入口的配置快照（frozenset）
+        switch_api_codes = retry_ctx.strategy_code_sets["switch"]
         
         # 检查是否是switch_api策略的错误
-        if upstream_resp.status_code in switch_api_codes and len(switch_api_codes) > 0:
-            extended_retry_success = False
-            max_api_count = len(CODEX_CONFIGS) if is_codex_request else len(API_CONFIGS)
-            extended_switch_count = 0
-            max_extended_switches = max_api_count * 3  # 每个API最多尝试3次
-            
-            print(f"[switch_api扩展重试][{request_id}] 检测到switch_api错误{upstream_resp.status_code}，开始尝试其他可用API...", file=sys.stderr)
+        if upstream_resp.status_code in switch_api_codes:
+            stderr_logger.info("[switch_api扩展重试][%s] 检测到switch_api错误%s，开始尝试其他可用API...", request_id, upstream_resp.status_code)
             
             # 保存错误状态码
             failed_status_code = upstream_resp.status_code
@@ -4103,142 +4554,23 @@ async def reverse_proxy(request: Request, path: str):
             # 关闭当前失败的响应
             await upstream_resp.aclose()
             
-            while extended_switch_count < max_extended_switches:
-                # 尝试切换API
-                if is_codex_request:
-                    switch_success, new_index = smart_codex_switch_api(codex_current_config_index, failed_status_code)
-                else:
-                    switch_success, new_index = smart_switch_api(current_config_index, failed_status_code)
-                
-                if not switch_success:
-                    print(f"[switch_api扩展重试][{request_id}] 无法切换到新API，所有API已尝试", file=sys.stderr)
-                    break
-                
-                extended_switch_count += 1
-                print(f"[switch_api扩展重试][{request_id}] 第{extended_switch_count}次API切换", file=sys.stderr)
-                
-                # 重新构建请求
-                try:
-                    if is_codex_request:
-                        current_codex_config = get_current_codex_config()
-                        print(f"\n{get_current_codex_info()}")
-                        upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, current_codex_config["base_url"])
-                        headers['authorization'] = f'Bearer {current_codex_config["key"]}'
-                        
-                        codex_timeout = httpx.Timeout(
-                            connect=TimeoutConfig.get_connect_timeout(),
-                            read=None,
-                            write=TimeoutConfig.get_write_timeout(),
-                            pool=TimeoutConfig.get_pool_timeout()
-                        )
-                        extended_client = httpx.AsyncClient(timeout=codex_timeout, limits=limits)
-                    else:
-                        is_valid, real_auth_header, error_msg = validate_and_replace_user_key(user_auth_header)
-                        if is_valid:
-                            headers['authorization'] = real_auth_header
-                            upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
-                            print(f"\n{get_current_api_info()}")
-                        else:
-                            print(f"[switch_api扩展重试][{request_id}] 验证Key失败: {error_msg}", file=sys.stderr)
-                            break
-                        
-                        if should_convert_to_openai and not user_wants_stream:
-                            extended_client = httpx.AsyncClient(timeout=non_streaming_timeout, limits=limits)
-                        else:
-                            extended_client = httpx.AsyncClient(timeout=timeout, limits=limits)
-                    
-                    # 发送请求
-                    extended_headers = headers.copy()
-                    if TimeoutConfig.get_modify_retry_headers():
-                        extended_headers['connection'] = 'close'
-                        import random, time
-                        ext_rand = random.randint(1000,9999)
-                        ext_timestamp = int(time.time() * 1000)
-                        extended_headers['x-request-id'] = f"{request_id}-extended-{extended_switch_count}-{ext_rand}"
-                        extended_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                        extended_headers['pragma'] = 'no-cache'
-                        extended_headers['expires'] = '0'
-                        extended_headers['x-cache-bypass'] = f'{ext_timestamp}-{ext_rand}'
-                    
-                    extended_req = extended_client.build_request(
-                        method=request.method,
-                        url=upstream_url,
-                        headers=extended_headers,
-                        content=converted_body
-                    )
-                    
-                    if is_codex_request:
-                        import asyncio
-                        try:
-                            extended_resp = await asyncio.wait_for(
-                                extended_client.send(extended_req, stream=True),
-                                timeout=TimeoutConfig.get_codex_connect_timeout()
-                            )
-                        except asyncio.TimeoutError:
-                            print(f"[switch_api扩展重试][{request_id}] Codex连接超时", file=sys.stderr)
-                            await extended_client.aclose()
-                            continue
-                    else:
-                        extended_resp = await extended_client.send(extended_req, stream=True)
-                    
-                    print(f"[switch_api扩展重试][{request_id}] 响应状态码: {extended_resp.status_code}", file=sys.stderr)
-                    
-                    # 检查响应
-                    if extended_resp.status_code < 400:
-                        # 成功！使用这个响应
-                        print(f"[switch_api扩展重试][{request_id}] 成功！使用新API响应", file=sys.stderr)
-                        upstream_resp = extended_resp
-                        retry_client = extended_client
-                        extended_retry_success = True
-                        retry_errors.clear()  # 清空错误列表
-                        break
-                    elif extended_resp.status_code in switch_api_codes:
-                        # 仍然是switch_api错误，继续尝试其他API
-                        print(f"[switch_api扩展重试][{request_id}] API返回错误{extended_resp.status_code}，继续尝试其他API", file=sys.stderr)
-                        if is_codex_request:
-                            record_codex_error(codex_current_config_index, extended_resp.status_code, silent=True)
-                        else:
-                            record_api_error(current_config_index, extended_resp.status_code, silent=True)
-                        await extended_resp.aclose()
-                        await extended_client.aclose()
-                        continue
-                    else:
-                        # 不同类型的错误，停止扩展重试
-                        print(f"[switch_api扩展重试][{request_id}] API返回非switch_api错误{extended_resp.status_code}，停止扩展重试", file=sys.stderr)
-                        upstream_resp = extended_resp
-                        retry_client = extended_client
-                        break
-                
-                except Exception as extended_error:
-                    print(f"[switch_api扩展重试][{request_id}] 扩展重试异常: {extended_error}", file=sys.stderr)
-                    if is_codex_request:
-                        record_codex_error(codex_current_config_index, 503, silent=True)
-                    else:
-                        record_api_error(current_config_index, 503, silent=True)
-                    await extended_client.aclose()
-                    continue
+            extended_resp, upstream_url = await extended_switch_retry(
+                request, headers, converted_body, request_id, upstream_url, failed_status_code, switch_api_codes, True,
+                is_codex_request=is_codex_request, clean_path=clean_path, is_openai_format=is_openai_format,
+                base_url_override=base_url_override, user_auth_header=user_auth_header,
+                client_profile=extended_client_profile, codex_connect_timeout=codex_connect_timeout
+            )
+            if extended_resp is not None:
+                upstream_resp = extended_resp
+                retry_client = get_pooled_client(extended_client_profile)
             
             # 如果扩展重试失败，继续记录错误
-            if not extended_retry_success:
-                print(f"[switch_api扩展重试][{request_id}] 所有API均已尝试，仍然失败，记录错误", file=sys.stderr)
+            if extended_resp is None or extended_resp.status_code >= 400:
+                elog("[switch_api扩展重试][%s] 所有API均已尝试，仍然失败，记录错误", request_id)
         
         # 记录错误（原有逻辑）
         if not is_codex_request and should_record_error_after_retry and upstream_resp.status_code >= 400:
-            if last_error_strategy == "switch_api" and last_error_status_code:
-                # switch_api策略：重试max_retries次都失败，记录+1次错误
-                msg = record_api_error(current_config_index, last_error_status_code, silent=True)
-                if msg:
-                    print(msg, file=sys.stderr)
-            elif last_error_strategy == "strategy_retry":
-                # strategy_retry策略：所有备用节点都失败，记录+1次错误
-                msg = record_api_error(current_config_index, 503, silent=True)
-                if msg:
-                    print(msg, file=sys.stderr)
-            elif last_error_strategy == "normal_retry" and last_error_status_code:
-                # normal_retry策略：重试max_retries次都失败，记录+1次错误
-                msg = record_api_error(current_config_index, last_error_status_code, silent=True)
-                if msg:
-                    print(msg, file=sys.stderr)
+            record_final_retry_error(last_error_strategy, last_error_status_code)
     
     if upstream_resp.status_code >= 400:
         error_msg = f"上游API返回错误状态码: {upstream_resp.status_code}"
@@ -4266,24 +4598,13 @@ async def reverse_proxy(request: Request, path: str):
                         await upstream_resp.aclose()  # 关闭原有连接
                         
                         # 重新构建URL使用新API (动态头部已自动避免缓存)
-                        new_upstream_url = build_upstream_url(clean_path, request.url.query, is_openai_format, base_url_override)
+                        new_upstream_url = join_upstream_url(base_url_override, upstream_suffix)
                         
                         # 获取重试API配置
                         retry_config = get_current_config()
                         
                         # API切换重试也要使用全新headers副本，强制断开旧连接
-                        api_switch_headers = headers.copy()
-                        if TimeoutConfig.get_modify_retry_headers():
-                            api_switch_headers['connection'] = 'close'
-                            # 添加完整的防缓存头部，确保API切换重试时不使用缓存
-                            import time
-                            api_switch_rand = random.randint(1000,9999)
-                            api_switch_timestamp = int(time.time() * 1000)
-                            api_switch_headers['x-request-id'] = f"{request_id}-apiswitch-{api_switch_rand}"
-                            api_switch_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                            api_switch_headers['pragma'] = 'no-cache'
-                            api_switch_headers['expires'] = '0'
-                            api_switch_headers['x-cache-bypass'] = f'{api_switch_timestamp}-{api_switch_rand}'
+                        api_switch_headers = build_retry_headers(headers, f"{request_id}-apiswitch")
                         
                         upstream_req = retry_client.build_request(
                             method=request.method,
@@ -4345,64 +4666,53 @@ async def reverse_proxy(request: Request, path: str):
     if should_convert_to_openai and not user_wants_stream:
         # 用户要求非流式响应，需要收集完整流式数据然后转换为JSON
         try:
-            # 收集所有流式数据
+            # 收集所有流式数据，边接收边按行解析（不再整体解码、切分后二次解析）
             all_chunks = []
-            async for chunk in upstream_resp.aiter_raw():
-                all_chunks.append(chunk)
+            content_parts = []  # 文本增量
+            usage_events = []  # 可能携带usage的事件，供统计使用
+            pending_line = b""  # 跨chunk的未完整行
             
-            # 合并所有数据
-            complete_response = b''.join(all_chunks)
-            response_text = complete_response.decode('utf-8', errors='ignore')
+            def collect_sse_lines(buffer: bytes, end: int):
+                for match in SSE_DATA_LINE.finditer(buffer, 0, end):
+                    claude_data = parse_sse_payload(match.group(1))
+                    if not isinstance(claude_data, dict):
+                        continue
+                    # 提取文本内容（只解码提取出的文本增量）
+                    if claude_data.get("type") == "content_block_delta":
+                        delta = claude_data.get("delta", {})
+                        if delta.get("type") == "text_delta":
+                            content_parts.append(delta.get("text", ""))
+                    elif is_usage_event(claude_data):
+                        usage_events.append(claude_data)
             
+            try:
+                async for chunk in upstream_resp.aiter_raw():
+                    all_chunks.append(chunk)
+                    buffer = pending_line + chunk
+                    # 只扫描到最后一个换行为止，剩余部分留到下一个chunk
+                    complete_end = buffer.rfind(b'\n') + 1
+                    if complete_end:
+                        collect_sse_lines(buffer, complete_end)
+                    pending_line = buffer[complete_end:]
+            finally:
+                # 读取中途出错时也要释放连接，归还给共享连接池
+                await upstream_resp.aclose()
+            if pending_line:
+                collect_sse_lines(pending_line, len(pending_line))
             
             # 【错误检测】使用增强的错误检测功能
-            is_error, error_info, decompressed_content = detect_compressed_error(response_text.encode('utf-8'))
+            is_error, error_info, decompressed_content = detect_compressed_error(b''.join(all_chunks))
             
             # 如果检测到错误，使用统一错误处理函数
             if is_error and not is_codex_request:
                 handle_detected_error(request_id, error_info, decompressed_content, "非流式")
             
-            # 解析流式数据并提取内容
-            full_content = ""
-            lines = response_text.split('\n')
+            full_content = "".join(content_parts)
             
-            for line in lines:
-                if line.startswith('data: ') and line != 'data: [DONE]':
-                    try:
-                        json_str = line[6:]  # 移除 'data: '
-                        claude_data = json.loads(json_str)
-                        
-                        # 提取文本内容
-                        if claude_data.get("type") == "content_block_delta":
-                            delta = claude_data.get("delta", {})
-                            if delta.get("type") == "text_delta":
-                                full_content += delta.get("text", "")
-                                
-                    except json.JSONDecodeError:
-                        continue
-            
-            # 构造标准OpenAI JSON响应
-            openai_response = {
-                "id": "chatcmpl-adapter",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": original_request_data.get("model", "gpt-4"),
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": full_content
-                        },
-                        "finish_reason": "stop"
-                    }
-                ],
-                "usage": {
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "total_tokens": 0
-                }
-            }
+            # 构造标准OpenAI JSON响应（固定结构已预先编码，只填入动态字段）
+            openai_response = encode_openai_completion(
+                original_request_data.get("model", "gpt-4"), full_content, int(time.time())
+            )
             
             # 构建响应信息显示
             response_info = f"响应: {upstream_resp.status_code}"
@@ -4418,15 +4728,15 @@ async def reverse_proxy(request: Request, path: str):
             # ✅ 实时统计token使用量（非流式响应）
             if stats_mgr and all_chunks:
                 try:
-                    usage_data = extract_usage_from_chunks(all_chunks, is_codex_request)
+                    usage_data = extract_usage_from_events(usage_events, is_codex_request)
                     if usage_data:
                         # 获取模型名称
                         model_name = "unknown"
                         try:
-                            if 'user_model' in locals():
+                            if user_model is not None:
                                 model_name = user_model
                             elif body:
-                                request_data = json.loads(body.decode('utf-8'))
+                                request_data = json_loads(body)
                                 model_name = request_data.get('model', 'unknown')
                         except:
                             pass
@@ -4440,10 +4750,11 @@ async def reverse_proxy(request: Request, path: str):
                 except Exception as stats_error:
                     pass
 
-            return JSONResponse(
+            # 直接输出编码好的JSON字节，跳过JSONResponse内部的标准库序列化
+            return Response(
                 content=openai_response,
                 status_code=upstream_resp.status_code,
-                headers={"content-type": "application/json"}
+                media_type="application/json"
             )
             
         except Exception as e:
@@ -4457,83 +4768,96 @@ async def reverse_proxy(request: Request, path: str):
             return JSONResponse(content=error_response, status_code=500)
 
     # 8. 流式响应处理（用户要求流式或非OpenAI客户端）  
-    response_chunks = []
+    response_chunks = ResponseChunkBuffer(keep_all=ENABLE_FULL_LOG)
     is_stream_started = False
     
     async def stream_generator():
         nonlocal is_stream_started
         global codex_timeout_extra_seconds, codex_success_count
         connection_interrupted = False  # 连接中断标志
-        line_buffer = ""  # 缓冲区用于处理TCP分包的SSE流
+        line_buf = bytearray()  # 字节缓冲区用于处理TCP分包的SSE流，按字节切分完整行
+        json_parts = []  # 非SSE的JSON响应在文档完整前累积的原始块
+        json_buffered = 0  # json_parts中的字节数
+        json_passthrough = False  # 响应不是可转换的JSON（或过大），后续数据原样转发
         
         # Codex流式读取总超时（基础超时 + 额外超时秒数）
         stream_total_timeout = None
-        stream_start_time = None
-        stream_aiter = None
+        stream_start_mono = None  # 单调时钟起点，不受系统时间跳变影响
+        stream_deadline = None
+        # SSE逐事件转发，保持上游的分块以免延迟事件；其他响应（完整JSON等）按64KiB聚合，减少迭代次数
+        # 仍使用aiter_raw：响应头原样透传（含content-encoding），不能在这里解压
+        is_event_stream = "text/event-stream" in str(upstream_resp.headers.get("content-type", ""))
+        stream_aiter = upstream_resp.aiter_raw(chunk_size=None if is_event_stream else STREAM_AGGREGATE_CHUNK_SIZE).__aiter__()
+        # 逐事件转换循环中使用的函数绑定为局部名称，省去每个事件的全局查找
+        loads = json_loads
+        dumps = json_dumps_bytes
+        convert = convert_response_to_openai
+        
+        async def read_with_deadline():
+            """Codex请求：在流式总超时内读取下一个chunk，超时时记录错误、增加下次的额外超时并抛出ReadTimeout"""
+            nonlocal connection_interrupted
+            global codex_timeout_extra_seconds, codex_success_count
+            # 计算剩余时间（每个chunk只读取一次时钟）
+            remaining = stream_deadline - time.monotonic()
+            
+            if remaining <= 0:
+                # 已经超时
+                elapsed = stream_total_timeout - remaining
+                connection_interrupted = True
+                
+                # 记录Codex流式超时错误
+                record_codex_error(codex_current_config_index, 503)
+                
+                codex_increment = TimeoutConfig.get_codex_timeout_increment()
+                codex_timeout_extra_seconds += codex_increment
+                codex_success_count = 0
+                new_timeout = codex_timeout_extra_seconds
+                codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
+                sys.stderr.write(
+                    f"\n[Codex流式超时] 总时间{elapsed:.1f}秒超过{stream_total_timeout}秒\n"
+                    f"[Codex自适应超时] 下次流式超时增加到 {codex_base_timeout + new_timeout}秒\n"
+                )
+                raise httpx.ReadTimeout(f"Codex stream total timeout: {elapsed:.1f}s > {stream_total_timeout}s")
+            
+            # 精确控制每次chunk等待的超时
+            try:
+                return await anext_with_timeout(stream_aiter, remaining)
+            except asyncio.TimeoutError:
+                # asyncio超时，精确到剩余时间
+                elapsed = time.monotonic() - stream_start_mono
+                connection_interrupted = True
+                
+                # 记录Codex流式精确超时错误
+                record_codex_error(codex_current_config_index, 503)
+                
+                codex_increment = TimeoutConfig.get_codex_timeout_increment()
+                codex_timeout_extra_seconds += codex_increment
+                codex_success_count = 0
+                new_timeout = codex_timeout_extra_seconds
+                codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
+                sys.stderr.write(
+                    f"\n[Codex流式超时] 总时间{elapsed:.1f}秒达到{stream_total_timeout}秒限制（精确检测）\n"
+                    f"[Codex自适应超时] 下次流式超时增加到 {codex_base_timeout + new_timeout}秒\n"
+                )
+                raise httpx.ReadTimeout(f"Codex stream total timeout (precise): {elapsed:.1f}s >= {stream_total_timeout}s")
         
         if is_codex_request:
-            import time
-            import asyncio
             codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
-            with codex_timeout_lock:
-                current_extra_seconds = codex_timeout_extra_seconds
+            current_extra_seconds = codex_timeout_extra_seconds
             stream_total_timeout = codex_base_timeout + current_extra_seconds
-            stream_start_time = time.time()
-            # 获取异步迭代器
-            stream_aiter = upstream_resp.aiter_raw().__aiter__()
+            stream_start_mono = time.monotonic()
+            stream_deadline = stream_start_mono + stream_total_timeout
+            # Codex请求使用精确的asyncio超时控制
+            read_next = read_with_deadline
         else:
-            stream_aiter = upstream_resp.aiter_raw().__aiter__()
+            # 非Codex请求，正常迭代
+            read_next = stream_aiter.__anext__
         
         try:
             while True:
                 try:
-                    # Codex请求使用精确的asyncio超时控制
-                    if is_codex_request:
-                        # 计算剩余时间
-                        elapsed = time.time() - stream_start_time
-                        remaining = stream_total_timeout - elapsed
-                        
-                        if remaining <= 0:
-                            # 已经超时
-                            connection_interrupted = True
-                            print(f"\n[Codex流式超时] 总时间{elapsed:.1f}秒超过{stream_total_timeout}秒", file=sys.stderr)
-                            
-                            # 记录Codex流式超时错误
-                            record_codex_error(codex_current_config_index, 503)
-                            
-                            codex_increment = TimeoutConfig.get_codex_timeout_increment()
-                            with codex_timeout_lock:
-                                codex_timeout_extra_seconds += codex_increment
-                                codex_success_count = 0
-                                new_timeout = codex_timeout_extra_seconds
-                            codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
-                            print(f"[Codex自适应超时] 下次流式超时增加到 {codex_base_timeout + new_timeout}秒", file=sys.stderr)
-                            raise httpx.ReadTimeout(f"Codex stream total timeout: {elapsed:.1f}s > {stream_total_timeout}s")
-                        
-                        # 使用asyncio.wait_for精确控制每次chunk等待的超时
-                        try:
-                            chunk = await asyncio.wait_for(stream_aiter.__anext__(), timeout=remaining)
-                        except asyncio.TimeoutError:
-                            # asyncio超时，精确到剩余时间
-                            elapsed = time.time() - stream_start_time
-                            connection_interrupted = True
-                            print(f"\n[Codex流式超时] 总时间{elapsed:.1f}秒达到{stream_total_timeout}秒限制（精确检测）", file=sys.stderr)
-                            
-                            # 记录Codex流式精确超时错误
-                            record_codex_error(codex_current_config_index, 503)
-                            
-                            codex_increment = TimeoutConfig.get_codex_timeout_increment()
-                            with codex_timeout_lock:
-                                codex_timeout_extra_seconds += codex_increment
-                                codex_success_count = 0
-                                new_timeout = codex_timeout_extra_seconds
-                            codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
-                            print(f"[Codex自适应超时] 下次流式超时增加到 {codex_base_timeout + new_timeout}秒", file=sys.stderr)
-                            raise httpx.ReadTimeout(f"Codex stream total timeout (precise): {elapsed:.1f}s >= {stream_total_timeout}s")
-                    else:
-                        # 非Codex请求，正常迭代
-                        chunk = await stream_aiter.__anext__()
-                    
+                    # 读取方式在循环外选定一次，循环内不再判断请求类型
+                    chunk = await read_next()
                 except StopAsyncIteration:
                     # 流式读取正常结束
                     break
@@ -4545,25 +4869,26 @@ async def reverse_proxy(request: Request, path: str):
                     is_stream_started = True
                     
                     # 【错误检测】使用增强的错误检测功能
-                    is_error, error_info, decompressed_content = detect_compressed_error(chunk)
-                    
-                    chunk_text = chunk.decode('utf-8', errors='ignore')
-                    
-                    # 如果检测到错误，使用统一错误处理函数
-                    if is_error and not is_codex_request:
-                        handle_detected_error(request_id, error_info, decompressed_content, "流式")
+                    # 2xx的SSE响应是纯文本事件流，不可能是压缩的错误体；只有首块含error事件时才需要完整检测
+                    if not is_codex_request and (upstream_resp.status_code >= 400 or not is_event_stream
+                                                 or b'event: error' in chunk):
+                        is_error, error_info, decompressed_content = detect_compressed_error(chunk)
+                        
+                        # 如果检测到错误，使用统一错误处理函数
+                        if is_error:
+                            handle_detected_error(request_id, error_info, decompressed_content, "流式")
                     
-                    response_info = f"响应: {upstream_resp.status_code}"
-                    if model_conversion_info:
-                        response_info += f" | {model_conversion_info}"
-                    response_info += " | "
-                    print(response_info, end="")
                     if should_convert_to_openai:
-                        print("Claude → OpenAI格式（使用缓冲区处理TCP分包）")
+                        format_name = "Claude → OpenAI格式（使用缓冲区处理TCP分包）"
                     else:
                         # 根据请求类型显示对应的原始格式
                         format_name = "Codex原始格式" if is_codex_request else "Claude原始格式"
-                        print(format_name)
+                    # 拼成一行后一次写出
+                    if model_conversion_info:
+                        response_info = f"响应: {upstream_resp.status_code} | {model_conversion_info} | {format_name}\n"
+                    else:
+                        response_info = f"响应: {upstream_resp.status_code} | {format_name}\n"
+                    sys.stdout.write(response_info)
                     sys.stdout.flush()
                 
                 # 处理响应数据转换
@@ -4571,63 +4896,58 @@ async def reverse_proxy(request: Request, path: str):
                 
                 # 只有OpenAI客户端才转换响应格式
                 if should_convert_to_openai:
-                    content_type = str(upstream_resp.headers.get("content-type", ""))
-                    
-                    if "text/event-stream" in content_type:
+                    if is_event_stream:
                         # 流式响应转换（使用缓冲区处理TCP分包）
                         try:
-                            chunk_text = chunk.decode('utf-8', errors='ignore')
-                            line_buffer += chunk_text  # 累积到缓冲区
+                            line_buf.extend(chunk)  # 累积原始字节到缓冲区
                             
-                            converted_lines = []
+                            converted_out = []
                             
-                            # 处理缓冲区中的完整行
-                            while '\n' in line_buffer:
-                                line, line_buffer = line_buffer.split('\n', 1)
-                                line = line.strip()
+                            # 处理缓冲区中的完整行（全程按字节处理，输出直接拼接为字节块）
+                            idx = line_buf.find(b'\n')
+                            while idx >= 0:
+                                line = bytes(line_buf[:idx]).strip()
+                                del line_buf[:idx + 1]
+                                idx = line_buf.find(b'\n')
                                 
                                 if not line:
                                     continue
                                     
-                                if line.startswith('data: ') and line != 'data: [DONE]':
+                                if line.startswith(SSE_DATA_PREFIX) and line != SSE_DONE_LINE:
+                                    json_str = line[6:]  # 移除 'data: '（line已strip，末尾无空白）
+                                    # 不以}或]结尾的JSON必然不完整，直接放回缓冲区等待更多数据，省去一次必然失败的解析
+                                    if json_str[-1:] not in (b'}', b']'):
+                                        line_buf[0:0] = line + b'\n'
+                                        break
                                     try:
-                                        json_str = line[6:]  # 移除 'data: '
-                                        claude_data = json.loads(json_str)
-                                        openai_data = convert_response_to_openai(claude_data)
-                                        converted_lines.append(f'data: {json.dumps(openai_data, separators=(",", ":"))}')
+                                        claude_data = loads(json_str)
+                                        openai_data = convert(claude_data)
+                                        converted_out.append(SSE_DATA_PREFIX + dumps(openai_data))
                                         
                                         # OpenAI响应数据收集功能已删除
                                         
-                                    except json.JSONDecodeError as e:
-                                        # 检查是否是不完整的JSON（而非格式错误）
-                                        json_str_stripped = json_str.rstrip()
-                                        # 如果看起来像完整JSON（以}结尾）但仍解析失败，可能是格式错误
-                                        if json_str_stripped.endswith('}') or json_str_stripped.endswith(']'):
-                                            print(f"JSON格式错误，跳过此行: {e}, 内容: {line[:100]}", file=sys.stderr)
-                                            continue  # 跳过这个错误行
-                                        else:
-                                            # 可能是不完整的JSON，放回缓冲区等待更多数据
-                                            line_buffer = line + '\n' + line_buffer
-                                            break
-                                elif line == 'data: [DONE]':
-                                    converted_lines.append('data: [DONE]')
-                                elif line.startswith('event:'):
+                                    except ValueError as e:
+                                        # 看起来像完整JSON（以}或]结尾）但仍解析失败（含非法UTF-8），属于格式错误
+                                        print(f"JSON格式错误，跳过此行: {e}, 内容: {line[:100].decode('utf-8', 'ignore')}", file=sys.stderr)
+                                        continue  # 跳过这个错误行
+                                elif line == SSE_DONE_LINE:
+                                    converted_out.append(SSE_DONE_LINE)
+                                elif line.startswith(SSE_EVENT_PREFIX):
                                     # 过滤掉Claude特有的事件类型，只保留兼容OpenAI的
                                     continue
                                 else:
                                     if line:  # 只添加非空行
-                                        converted_lines.append(line)
+                                        converted_out.append(line)
                             
                             # 只有当有完整的转换行时才输出
-                            if converted_lines:
-                                processed_chunk = ('\n'.join(converted_lines) + '\n').encode('utf-8')
+                            if converted_out:
+                                processed_chunk = b'\n'.join(converted_out) + b'\n'
                             else:
                                 # 如果没有完整的行，暂时不输出，等待更多数据
                                 continue
                                 
                         except Exception as convert_error:
                             # 转换出错时详细打印，但停止转换以避免格式混乱
-                            import traceback
                             print(f"\n流式响应转换出错: {convert_error}", file=sys.stderr)
                             print(f"转换错误详情: {traceback.format_exc()}", file=sys.stderr)
                             # 删除原始chunk内容记录
@@ -4638,36 +4958,52 @@ async def reverse_proxy(request: Request, path: str):
                                 return
                             processed_chunk = chunk  # 非OpenAI客户端使用原始块
                     else:
-                        # 非流式响应转换（JSON响应）
-                        try:
-                            chunk_text = chunk.decode('utf-8', errors='ignore')
-                            if chunk_text.strip():
-                                claude_data = json.loads(chunk_text)
-                                openai_data = convert_response_to_openai(claude_data)
-                                processed_chunk = json.dumps(openai_data, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
-                                
-                                # 非流式响应转换记录功能已删除
-                                
-                        except json.JSONDecodeError:
-                            # 不是完整的JSON，可能是分块传输，保持原样
-                            pass
-                        except Exception as convert_error:
-                            # 转换出错时详细打印，但停止转换以避免格式混乱
-                            import traceback
-                            print(f"\nJSON响应转换出错: {convert_error}", file=sys.stderr)
-                            print(f"转换错误详情: {traceback.format_exc()}", file=sys.stderr)
-                            # 删除原始chunk内容记录
-                            # 如果是OpenAI客户端但转换失败，返回错误JSON
-                            if should_convert_to_openai:
-                                error_response = {
-                                    "error": {
-                                        "message": "Response conversion failed",
-                                        "type": "conversion_error"
-                                    }
-                                }
-                                processed_chunk = json.dumps(error_response, separators=(",", ":")).encode('utf-8')
+                        # 非流式响应转换（JSON响应）：分块传输时先累积，文档完整后只解析转换一次
+                        if json_passthrough:
+                            processed_chunk = chunk
+                        else:
+                            json_parts.append(chunk)
+                            json_buffered += len(chunk)
+                            first_byte = json_parts[0].lstrip()[:1]
+                            if (first_byte and first_byte != b'{') or json_buffered > JSON_CONVERT_MAX_BUFFER:
+                                # 不是JSON对象（如HTML/文本错误页）或累积超过上限：已缓冲的内容原样转发，不再尝试转换
+                                json_passthrough = True
+                                processed_chunk = b''.join(json_parts)
+                                json_parts.clear()
                             else:
-                                processed_chunk = chunk
+                                if chunk.rstrip()[-1:] != b'}':
+                                    # 末尾不是}的JSON文档必然不完整，等待更多数据
+                                    continue
+                                raw_document = b''.join(json_parts)
+                                try:
+                                    claude_data = loads(raw_document)
+                                except ValueError:
+                                    # 不是完整的JSON，可能是分块传输，继续累积
+                                    continue
+                                json_parts.clear()
+                                json_buffered = 0
+                                try:
+                                    openai_data = convert(claude_data)
+                                    processed_chunk = dumps(openai_data)
+                            
+                                    # 非流式响应转换记录功能已删除
+                            
+                                except Exception as convert_error:
+                                    # 转换出错时详细打印，但停止转换以避免格式混乱
+                                    print(f"\nJSON响应转换出错: {convert_error}", file=sys.stderr)
+                                    print(f"转换错误详情: {traceback.format_exc()}", file=sys.stderr)
+                                    # 删除原始chunk内容记录
+                                    # 如果是OpenAI客户端但转换失败，返回错误JSON
+                                    if should_convert_to_openai:
+                                        error_response = {
+                                            "error": {
+                                                "message": "Response conversion failed",
+                                                "type": "conversion_error"
+                                            }
+                                        }
+                                        processed_chunk = json.dumps(error_response, separators=(",", ":")).encode('utf-8')
+                                    else:
+                                        processed_chunk = raw_document
                 
                 # 精简的数据块显示（移除详细打印）
                 # 只在调试时需要时才打印具体内容
@@ -4679,42 +5015,50 @@ async def reverse_proxy(request: Request, path: str):
                     print(f"\n客户端断开连接: {conn_error}", file=sys.stderr)
                     return
             
+            # async for循环结束，无法解析为JSON的剩余数据原样输出
+            if json_parts:
+                yield b''.join(json_parts)
+            
             # async for循环结束，处理缓冲区中剩余的数据
-            if should_convert_to_openai and line_buffer.strip():
+            remaining_buffer = bytes(line_buf).strip() if should_convert_to_openai else b''
+            if remaining_buffer:
                 try:
-                    remaining_lines = line_buffer.strip().split('\n')
-                    converted_lines = []
+                    remaining_lines = remaining_buffer.split(b'\n')
+                    converted_out = []
                     
                     for line in remaining_lines:
                         line = line.strip()
                         if not line:
                             continue
                             
-                        if line.startswith('data: ') and line != 'data: [DONE]':
+                        if line.startswith(SSE_DATA_PREFIX) and line != SSE_DONE_LINE:
+                            json_str = line[6:]
+                            if json_str[-1:] not in (b'}', b']'):
+                                # 流已结束，不完整的JSON无法再补齐
+                                print(f"缓冲区剩余数据无法解析: {line[:100].decode('utf-8', 'ignore')}", file=sys.stderr)
+                                continue
                             try:
-                                json_str = line[6:]
-                                claude_data = json.loads(json_str)
-                                openai_data = convert_response_to_openai(claude_data)
-                                converted_lines.append(f'data: {json.dumps(openai_data, separators=(",", ":"))}')
-                            except json.JSONDecodeError:
-                                print(f"缓冲区剩余数据无法解析: {line[:100]}", file=sys.stderr)
-                        elif line == 'data: [DONE]':
-                            converted_lines.append('data: [DONE]')
-                        elif not line.startswith('event:'):
+                                claude_data = loads(json_str)
+                                openai_data = convert(claude_data)
+                                converted_out.append(SSE_DATA_PREFIX + dumps(openai_data))
+                            except ValueError:
+                                print(f"缓冲区剩余数据无法解析: {line[:100].decode('utf-8', 'ignore')}", file=sys.stderr)
+                        elif line == SSE_DONE_LINE:
+                            converted_out.append(SSE_DONE_LINE)
+                        elif not line.startswith(SSE_EVENT_PREFIX):
                             if line:
-                                converted_lines.append(line)
+                                converted_out.append(line)
                     
-                    if converted_lines:
-                        final_chunk = ('\n'.join(converted_lines) + '\n').encode('utf-8')
+                    if converted_out:
+                        final_chunk = b'\n'.join(converted_out) + b'\n'
                         yield final_chunk
                 except Exception as e:
                     print(f"处理剩余缓冲区数据时出错: {e}", file=sys.stderr)
                     
         except Exception as e:
-            import traceback
             
             # 检查是否是ReadTimeout异常，直接转换为连接错误
-            if isinstance(e, httpx.ReadTimeout):
+            if isinstance(e, _HX_ReadTimeout):
                 connection_interrupted = True
                 error_msg = str(e)
                 print(f"\n流处理超时: {e}", file=sys.stderr)
@@ -4727,28 +5071,17 @@ async def reverse_proxy(request: Request, path: str):
                     record_codex_error(codex_current_config_index, 503)
                     
                     codex_increment = TimeoutConfig.get_codex_timeout_increment()
-                    with codex_timeout_lock:
-                        codex_timeout_extra_seconds += codex_increment
-                        codex_success_count = 0  # 重置成功计数
-                        new_timeout = codex_timeout_extra_seconds
+                    codex_timeout_extra_seconds += codex_increment
+                    codex_success_count = 0  # 重置成功计数
+                    new_timeout = codex_timeout_extra_seconds
                     codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
                     print(f"[Codex自适应超时] 超时失败，下次超时增加到 {codex_base_timeout + new_timeout}秒", file=sys.stderr)
                 
                 # 抛出特殊异常用于外层重试检测
                 raise ConnectionError(f"Stream read timeout: {e}")
             
-            # 检查是否是连接中断相关的错误
-            error_str = str(e).lower()
-            connection_errors = [
-                'peer closed connection',
-                'incomplete chunked read',
-                'remoteprotocolerror',
-                'connection reset',
-                'broken pipe',
-                'connection aborted'
-            ]
-            
-            is_connection_error = any(err in error_str for err in connection_errors)
+            # 检查是否是连接中断相关的错误（先按类型判断，消息匹配只作兜底）
+            is_connection_error = isinstance(e, _CONN_EXC) or _CONN_ERROR_TEXT.search(str(e)) is not None
             if is_connection_error:
                 connection_interrupted = True
                 print(f"\n流处理连接中断: {e}", file=sys.stderr)
@@ -4759,25 +5092,24 @@ async def reverse_proxy(request: Request, path: str):
                 print(f"异常详情: {traceback.format_exc()}", file=sys.stderr)
                 print(f"已处理的响应块数量: {len(response_chunks)}", file=sys.stderr)
                 if upstream_resp:
-                    print(f"上游响应状态: {upstream_resp.status_code}", file=sys.stderr)
-                    print(f"上游响应头: {dict(upstream_resp.headers)}", file=sys.stderr)
+                    # 延迟格式化，不复制响应头
+                    elog("上游响应状态: %s\n上游响应头: %s", upstream_resp.status_code, upstream_resp.headers)
         finally:
             # Codex请求成功时，增加成功计数（只有在有额外超时时才需要计数和重置）
             if is_codex_request and not connection_interrupted:
-                with codex_timeout_lock:
-                    if codex_timeout_extra_seconds > 0:
-                        codex_success_count += 1
-                        current_count = codex_success_count
-                        print(f"\n[Codex自适应超时] 请求成功 (连续{current_count}/3次)", file=sys.stderr)
+                if codex_timeout_extra_seconds > 0:
+                    codex_success_count += 1
+                    current_count = codex_success_count
+                    print(f"\n[Codex自适应超时] 请求成功 (连续{current_count}/3次)", file=sys.stderr)
                         
-                        # 连续3次成功，重置超时
-                        if codex_success_count >= 3:
-                            print(f"[Codex自适应超时] 连续3次成功，重置超时至默认 60秒", file=sys.stderr)
-                            codex_timeout_extra_seconds = 0
-                            codex_success_count = 0
+                    # 连续3次成功，重置超时
+                    if codex_success_count >= 3:
+                        print(f"[Codex自适应超时] 连续3次成功，重置超时至默认 60秒", file=sys.stderr)
+                        codex_timeout_extra_seconds = 0
+                        codex_success_count = 0
             
-            # 确保关闭retry_client，避免client状态累积
-            if 'retry_client' in locals():
+            # 确保关闭单次请求创建的retry_client（共享客户端不关闭）
+            if not is_pooled_client(retry_client):
                 try:
                     await retry_client.aclose()
                 except Exception as close_error:
@@ -4803,7 +5135,7 @@ async def reverse_proxy(request: Request, path: str):
                         # 获取模型名称
                         model_name = "unknown"
                         try:
-                            if 'user_model' in locals():
+                            if user_model is not None:
                                 model_name = user_model
                             elif body:
                                 request_data = json.loads(body.decode('utf-8'))
@@ -4828,8 +5160,8 @@ async def reverse_proxy(request: Request, path: str):
                 if model_conversion_info:
                     completion_info = f" ✓ 完成 [{model_conversion_info}]"
                 # 添加Codex请求的实际用时
-                if is_codex_request and 'stream_start_time' in locals():
-                    actual_elapsed = time.time() - stream_start_time
+                if is_codex_request and stream_start_mono is not None:
+                    actual_elapsed = time.monotonic() - stream_start_mono
                     completion_info += f" (耗时: {actual_elapsed:.1f}秒)"
                 print(completion_info)
                 print("=" * 50)  # 结束分隔线
@@ -4850,11 +5182,12 @@ async def reverse_proxy(request: Request, path: str):
     max_stream_retries = 1  # 禁用流重试，避免重复发送（主重试逻辑已足够）
     for stream_retry_count in range(max_stream_retries):
         try:
-            response_headers = dict(upstream_resp.headers)
-            
-            # 如果进行了OpenAI格式转换，需要移除Content-Length让FastAPI自动处理
-            if should_convert_to_openai and "content-length" in response_headers:
-                del response_headers["content-length"]  # 让FastAPI自动处理Content-Length
+            if should_convert_to_openai:
+                # 进行了OpenAI格式转换，需要移除Content-Length让FastAPI自动处理
+                response_headers = {k: v for k, v in upstream_resp.headers.items() if k != "content-length"}
+            else:
+                # 原样透传：Starlette只通过.items()读取响应头，无需先复制成dict
+                response_headers = upstream_resp.headers
 
             return StreamingResponse(
                 content=stream_generator(),
@@ -4872,88 +5205,51 @@ async def reverse_proxy(request: Request, path: str):
                     await upstream_resp.aclose()  # 关闭当前连接
                     
                     # 重新发起请求（使用全新headers，强制断开旧连接）
-                    # 根据请求类型选择合适的超时配置
+                    # 按请求类型复用对应超时配置的共享客户端（Codex配置禁用read超时，由流式总超时控制）
+                    new_client = get_pooled_client(extended_client_profile)
                     if is_codex_request:
-                        # Codex流重试：禁用read超时，由流式总超时控制
-                        codex_timeout = httpx.Timeout(
-                            connect=TimeoutConfig.get_connect_timeout(),
-                            read=None,  # ✅ 禁用read超时，由流式总超时控制
-                            write=TimeoutConfig.get_write_timeout(),
-                            pool=TimeoutConfig.get_pool_timeout()
-                        )
-                        new_client = httpx.AsyncClient(timeout=codex_timeout, limits=limits)
                         codex_base_timeout = TimeoutConfig.get_codex_base_timeout()
-                        with codex_timeout_lock:
-                            current_extra_seconds = codex_timeout_extra_seconds
-                        print(f"[流重试][Codex超时配置] 连接超时: {TimeoutConfig.get_codex_connect_timeout()}秒 | 流式总超时: {codex_base_timeout + current_extra_seconds}秒", file=sys.stderr)
-                    elif should_convert_to_openai and not user_wants_stream:
-                        # 非流式请求使用60秒超时
-                        new_client = httpx.AsyncClient(timeout=non_streaming_timeout, limits=limits)
+                        current_extra_seconds = codex_timeout_extra_seconds
+                        print(f"[流重试][Codex超时配置] 连接超时: {codex_connect_timeout}秒 | 流式总超时: {codex_base_timeout + current_extra_seconds}秒", file=sys.stderr)
+                    # 流重试也要使用全新headers副本，避免连接复用
+                    stream_retry_headers = build_retry_headers(headers, f"{request_id}-stream-retry{stream_retry_count}", stream_retry_count + 1)
+                    
+                    new_upstream_req = new_client.build_request(
+                        method=request.method,
+                        url=upstream_url,
+                        headers=stream_retry_headers,  # 使用流重试专用headers
+                        content=converted_body
+                    )
+                    
+                    # Codex流重试也使用30秒连接超时
+                    if is_codex_request:
+                        try:
+                            upstream_resp = await send_with_connect_timeout(new_client, new_upstream_req, codex_connect_timeout)
+                        except asyncio.TimeoutError:
+                            print(f"[Codex流重试连接超时][{request_id}] {codex_connect_timeout}秒内未收到响应", file=sys.stderr)
+                            
+                            # 记录Codex流重试连接超时错误
+                            record_codex_error(codex_current_config_index, 503)
+                            
+                            raise httpx.ReadTimeout("Codex stream retry connection timeout: 30 seconds")
                     else:
-                        # 流式请求使用标准超时
-                        new_client = httpx.AsyncClient(timeout=timeout, limits=limits)
-                    try:
-                        # 流重试也要使用全新headers副本，避免连接复用
-                        stream_retry_headers = headers.copy()
-                        if TimeoutConfig.get_modify_retry_headers():
-                            stream_retry_headers['connection'] = 'close'
-                            # 添加完整的防缓存头部，确保流重试时API不使用缓存
-                            import time
-                            stream_retry_rand = random.randint(1000,9999)
-                            stream_retry_timestamp = int(time.time() * 1000)
-                            stream_retry_headers['x-request-id'] = f"{request_id}-stream-retry{stream_retry_count}-{stream_retry_rand}"
-                            stream_retry_headers['cache-control'] = 'no-cache, no-store, must-revalidate'
-                            stream_retry_headers['pragma'] = 'no-cache'
-                            stream_retry_headers['expires'] = '0'
-                            stream_retry_headers['x-cache-bypass'] = f'{stream_retry_timestamp}-{stream_retry_rand}'
-                            stream_retry_headers['x-retry-count'] = str(stream_retry_count + 1)
-                        
-                        new_upstream_req = new_client.build_request(
-                            method=request.method,
-                            url=upstream_url,
-                            headers=stream_retry_headers,  # 使用流重试专用headers
-                            content=converted_body
-                        )
-                        
-                        # Codex流重试也使用30秒连接超时
-                        if is_codex_request:
-                            import asyncio
-                            try:
-                                upstream_resp = await asyncio.wait_for(
-                                    new_client.send(new_upstream_req, stream=True),
-                                    timeout=TimeoutConfig.get_codex_connect_timeout()
-                                )
-                            except asyncio.TimeoutError:
-                                print(f"[Codex流重试连接超时][{request_id}] {TimeoutConfig.get_codex_connect_timeout()}秒内未收到响应", file=sys.stderr)
-                                
-                                # 记录Codex流重试连接超时错误
-                                record_codex_error(codex_current_config_index, 503)
-                                
-                                await new_client.aclose()
-                                raise httpx.ReadTimeout("Codex stream retry connection timeout: 30 seconds")
-                        else:
-                            upstream_resp = await new_client.send(new_upstream_req, stream=True)
-                        
-                        print(f"[流重试 {stream_retry_count + 1}/{max_stream_retries}][{request_id}] 重新建立连接成功", file=sys.stderr)
-                        
-                        # 重置流处理相关变量
-                        response_chunks = []
-                        is_stream_started = False
-                        
-                        # 等待配置的时间后重试
-                        import asyncio
-                        await asyncio.sleep(TimeoutConfig.get_stream_retry_wait())
-                        continue
-                    finally:
-                        # 确保关闭new_client连接
-                        await new_client.aclose()
+                        upstream_resp = await new_client.send(new_upstream_req, stream=True)
+                    
+                    print(f"[流重试 {stream_retry_count + 1}/{max_stream_retries}][{request_id}] 重新建立连接成功", file=sys.stderr)
+                    
+                    # 重置流处理相关变量
+                    response_chunks = ResponseChunkBuffer(keep_all=ENABLE_FULL_LOG)
+                    is_stream_started = False
+                    
+                    # 等待配置的时间后重试
+                    await asyncio.sleep(TimeoutConfig.get_stream_retry_wait())
+                    continue
                     
                 except Exception as retry_error:
                     print(f"[流重试 {stream_retry_count + 1}/{max_stream_retries}][{request_id}] 重连失败: {retry_error}", file=sys.stderr)
                     continue
             
             # 最后一次重试失败，返回错误响应
-            from fastapi.responses import Response
             return Response(content=f"Stream processing failed after {max_stream_retries} retries: {ce}", status_code=502)
 
 if __name__ == "__main__":
@@ -5,11 +5,347 @@
 支持多类型配置: API配置、Codex配置、OpenAI转Claude配置、超时重试配置
 """
 import json
-import copy
+import atexit
+import hashlib
+import logging
 import os
+import stat
+import sys
+import tempfile
 import threading
-from typing import List, Dict, Any, Optional
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, FrozenSet, Tuple
 from datetime import datetime
+from types import MappingProxyType
+
+# 可选的orjson加速（未安装时回退到标准库json）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _dumps_config(obj) -> bytes:
+    """序列化配置为带2空格缩进的UTF-8 JSON字节（保留非ASCII字符）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+# 解析配置JSON（接受str或bytes）
+_loads_config = orjson.loads if orjson is not None else json.loads
+
+_CONTAINER_TYPES = (dict, list)
+
+def _copy_json(obj):
+    """按类型逐层复制dict/list，其余（str/数字/布尔/None）不可变直接复用；省去deepcopy的memo和__reduce_ex__分派"""
+    if type(obj) is dict:
+        return {k: _copy_json(v) if type(v) in _CONTAINER_TYPES else v for k, v in obj.items()}
+    if type(obj) is list:
+        return [_copy_json(v) if type(v) in _CONTAINER_TYPES else v for v in obj]
+    return obj
+
+def _clone_config(obj):
+    """深拷贝一条JSON结构的配置：有orjson时经序列化往返复制（全程在C中完成），否则按类型逐层复制"""
+    if orjson is not None:
+        return orjson.loads(orjson.dumps(obj))
+    return _copy_json(obj)
+
+def _payload_digest(payload: bytes) -> bytes:
+    """配置文件内容的摘要，用于判断内容是否变化"""
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+def _setup_logger() -> logging.Logger:
+    """配置管理日志器：输出到stdout，可通过环境变量 PROXY_CONFIG_LOG_LEVEL=WARNING 关闭加载/保存提示，被过滤的记录不会格式化"""
+    config_logger = logging.getLogger('config_manager')
+    level = getattr(logging, os.getenv("PROXY_CONFIG_LOG_LEVEL", "INFO").upper(), None)
+    config_logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    if not config_logger.handlers:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('[配置管理] %(message)s'))
+        config_logger.addHandler(console_handler)
+        config_logger.propagate = False  # 防止传播到根日志器
+    return config_logger
+
+logger = _setup_logger()
+
+def _stat_signature(st: os.stat_result) -> Tuple[int, int]:
+    """文件的(修改时间ns, 大小)，用于不读文件就判断是否被改动过"""
+    return st.st_mtime_ns, st.st_size
+
+# 修改后延迟写盘的合并窗口（秒）：窗口内的多次修改只序列化、写入一次
+SAVE_DEBOUNCE_SECONDS = 0.2
+# 写盘失败后，后台线程等待多久再重试（秒）
+SAVE_RETRY_SECONDS = 5.0
+
+
+# 配置校验规则
+_URL_PREFIXES = ("http://", "https://")
+_MIN_KEY_LEN = 10
+
+
+def _validate_endpoint_config(config: Dict[str, Any]) -> bool:
+    """校验base_url和key必填：URL须以http(s)开头，Key至少10个字符"""
+    # 先做不需要strip的检查，绝大多数非法输入在这里就被拒绝
+    base_url = config.get("base_url")
+    key = config.get("key")
+    if not base_url or not key:
+        return False
+    
+    # 验证URL格式
+    if not base_url.strip().startswith(_URL_PREFIXES):
+        return False
+    
+    # 验证Key长度
+    return len(key.strip()) >= _MIN_KEY_LEN
+
+def _validate_model_conversion(config: Dict[str, Any]) -> bool:
+    """校验源模型和目标模型必填"""
+    return bool(config.get("source_model")) and bool(config.get("target_model"))
+
+
+# 各项设置的默认值（只读），读取时与已存储的设置合并
+_DEFAULT_TIMEOUT_SETTINGS = MappingProxyType({
+    "connect_timeout": 60.0,
+    "write_timeout": 60.0,
+    "pool_timeout": 120.0,
+    "streaming_read_timeout": 60.0,
+    "non_streaming_read_timeout": 60.0,
+    "extended_connect_timeout": 90.0,
+    "api_cooldown_seconds": 600,
+    "api_error_threshold": 3,
+    "codex_error_threshold": 3,
+    "codex_base_timeout": 60,
+    "codex_timeout_increment": 60,
+    "codex_connect_timeout": 30.0,
+    "primary_api_check_interval": 30,
+    "billing_cycle_delay": 60,
+    "health_check_interval": 0.5,
+    "billing_send_interval": 1.0,
+    "stream_retry_wait": 1.0,
+    "strategy_retry_read_timeout": 200.0,
+    "modify_retry_headers": True
+})
+
+_DEFAULT_ERROR_HANDLING_STRATEGIES = MappingProxyType({
+    "http_status_codes": MappingProxyType({
+        "400": "strategy_retry",
+        "404": "strategy_retry",
+        "408": "strategy_retry",  # Request Timeout
+        "429": "strategy_retry",
+        "500": "strategy_retry",
+        "502": "strategy_retry",
+        "503": "strategy_retry",
+        "504": "strategy_retry",  # Gateway Timeout
+        "520": "strategy_retry",
+        "521": "strategy_retry",
+        "522": "strategy_retry",
+        "524": "strategy_retry",
+        "401": "switch_api",
+        "403": "switch_api",
+        "default": "strategy_retry"  # 默认策略：未列出的错误码使用策略重试
+    }),
+    "network_errors": MappingProxyType({
+        "ReadError": "switch_api",
+        "ConnectError": "switch_api",
+        "ReadTimeout": "strategy_retry",
+        "default": "switch_api"  # 默认策略：未列出的网络错误切换API
+    })
+})
+
+_DEFAULT_OPTIMIZATION_SETTINGS = MappingProxyType({
+    "enable_cache_control_limit": True
+})
+
+
+class RWLock:
+    """读写锁：多个读者可以并发，写者独占
+    
+    - 写锁可重入，持有写锁的线程也可以直接读
+    - 读锁可在同一线程内嵌套
+    - 有写者等待时新读者让路，避免写者饿死
+    - `with lock:` 等价于 `with lock.write():`，兼容原先的RLock用法
+    """
+    __slots__ = ('_cond', '_readers', '_writer', '_write_depth', '_writers_waiting', '_local')
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None  # 持有写锁的线程id
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()  # 当前线程的读锁嵌套深度
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth or self._writer == threading.get_ident():
+            # 已持有读锁或写锁，直接进入
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release_write()
+
+
+class _ConfigSection:
+    """一类列表配置（API/Codex/OpenAI转Claude/超时重试/模型转换）的通用增删改查，各类之间只有默认值和校验规则不同"""
+    __slots__ = ('mgr', 'key', 'validate', 'name_fmt', 'defaults', 'list_fields', 'stamp_toggle', 'dup_name_fmt', 'copy_items')
+
+    def __init__(self, mgr: "ConfigManager", key: str, name_fmt: str, defaults: Optional[Dict[str, Any]] = None,
+                 validate=_validate_endpoint_config, stamp_toggle: bool = False,
+                 dup_name_fmt: Optional[str] = None, copy_items: bool = False):
+        self.mgr = mgr
+        self.key = key  # 在all_configs中的字段名
+        self.validate = validate
+        self.name_fmt = name_fmt  # 新增时的默认名称，{}为新条目序号
+        self.defaults = defaults or {}  # 新增时补充的默认字段
+        self.list_fields = tuple(field for field, value in self.defaults.items() if isinstance(value, list))
+        self.stamp_toggle = stamp_toggle  # 切换启用状态时是否记录updated_at
+        self.dup_name_fmt = dup_name_fmt  # 复制时无名称的回退名称，None表示复制时不改名
+        self.copy_items = copy_items  # 读取时是否逐条复制
+
+    # 写时复制：修改时先复制列表（和被改的条目）再整体替换，已发布的列表和条目不再原地修改，
+    # 读取方直接拿当前引用，既不加锁也不复制
+
+    def all(self) -> List[Dict[str, Any]]:
+        """全部条目（返回的列表供只读使用）"""
+        configs = self.mgr._all_configs.get(self.key, [])
+        return [cfg.copy() for cfg in configs] if self.copy_items else configs
+
+    def enabled(self) -> List[Dict[str, Any]]:
+        configs = self.mgr._get_enabled(self.key)
+        return [cfg.copy() for cfg in configs] if self.copy_items else configs
+
+    def _publish(self, configs: List[Dict[str, Any]]) -> None:
+        """用新列表替换本类配置并安排写盘（调用方持有本分区的锁）"""
+        self.mgr._all_configs[self.key] = configs
+        self.mgr._mark_dirty()
+
+    def add(self, config: Dict[str, Any]) -> bool:
+        with self.mgr._section_write(self.key):
+            if not self.validate(config):
+                return False
+            configs = self.mgr._all_configs.get(self.key, [])
+            # 一次合并补齐名称和默认字段，调用方提供的字段优先
+            new_config = {"name": self.name_fmt.format(len(configs) + 1), **self.defaults, **config}
+            for field in self.list_fields:
+                if new_config[field] is self.defaults[field]:
+                    new_config[field] = list(new_config[field])  # 默认列表每条配置各持一份
+            new_config.setdefault("created_at", self.mgr._now_iso())
+            self._publish(configs + [new_config])
+            return True
+
+    def update(self, index: int, config: Dict[str, Any]) -> bool:
+        with self.mgr._section_write(self.key):
+            configs = self.mgr._all_configs.get(self.key, [])
+            if 0 <= index < len(configs):
+                config.setdefault("updated_at", self.mgr._now_iso())
+                configs = list(configs)
+                configs[index] = {**configs[index], **config}
+                self._publish(configs)
+                return True
+            return False
+
+    def delete(self, index: int) -> bool:
+        with self.mgr._section_write(self.key):
+            configs = self.mgr._all_configs.get(self.key, [])
+            if 0 <= index < len(configs):
+                self._publish(configs[:index] + configs[index + 1:])
+                return True
+            return False
+
+    def toggle(self, index: int) -> Optional[bool]:
+        with self.mgr._section_write(self.key):
+            configs = self.mgr._all_configs.get(self.key, [])
+            if 0 <= index < len(configs):
+                toggled = dict(configs[index])
+                toggled["enabled"] = not toggled.get("enabled", True)
+                if self.stamp_toggle:
+                    toggled["updated_at"] = self.mgr._now_iso()
+                configs = list(configs)
+                configs[index] = toggled
+                self._publish(configs)
+                return toggled["enabled"]
+            return None
+
+    def move(self, index: int, direction: str) -> bool:
+        with self.mgr._section_write(self.key):
+            configs = self.mgr._all_configs.get(self.key, [])
+            if not configs or not (0 <= index < len(configs)):
+                return False
+            direction = (direction or "").lower()
+            target = {"up": index - 1, "down": index + 1, "top": 0, "bottom": len(configs) - 1}.get(direction)
+            if target is None or target == index or not (0 <= target < len(configs)):
+                return False
+            # 四种移动统一为"取出后插到目标位置"，按切片一次拼出新列表
+            rest = configs[:index] + configs[index + 1:]
+            self._publish(rest[:target] + [configs[index]] + rest[target:])
+            return True
+
+    def duplicate(self, index: int) -> bool:
+        with self.mgr._section_write(self.key):
+            configs = self.mgr._all_configs.get(self.key, [])
+            if 0 <= index < len(configs):
+                new_config = _clone_config(configs[index])
+                new_config.pop("updated_at", None)
+                new_config["created_at"] = self.mgr._now_iso()
+                if self.dup_name_fmt is not None:
+                    original_name = new_config.get("name", self.dup_name_fmt.format(index + 1))
+                    new_config["name"] = f"{original_name}(复制)"
+                self._publish(configs[:index + 1] + [new_config] + configs[index + 1:])
+                return True
+            return False
 
 
 class ConfigManager:
@@ -22,8 +358,55 @@ class ConfigManager:
             config_file = os.path.join(script_dir, config_file)
 
         self.config_file = config_file
-        self.lock = threading.RLock()
+        self.lock = RWLock()  # 单个分区的修改走读锁+分区锁，整体替换配置和写盘快照走写锁
+        self._state_lock = threading.Lock()  # 保护版本号和脏标记
         self._all_configs = {}
+        self.version = 0  # 配置版本号，每次修改/重新加载后递增，供调用方判断缓存是否失效
+        self._switch_api_codes: Tuple[Optional[int], FrozenSet[int]] = (None, frozenset())  # (配置版本号, 状态码集合)
+        self._enabled_cache: Dict[str, Tuple[int, List[Dict[str, Any]]]] = {}  # 已启用配置列表，按版本号缓存
+        self._settings_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}  # 合并默认值后的各项设置，按版本号缓存
+        self._dirty = False  # 内存配置有未写盘的修改
+        self._flush_event = threading.Event()  # 有待写盘的修改时置位，唤醒后台写盘线程
+        self._batch_depth = 0
+        self._batch_now: Optional[str] = None  # 批量修改期间共用的时间戳
+        self._sections: Dict[str, _ConfigSection] = {
+            "api_configs": _ConfigSection(
+                self, "api_configs", "API-{}",
+                defaults={
+                    "type": "primary",
+                    "enabled": True,
+                    "time_enabled": [1, 1, 1, 1, 1, 1, 1],  # 默认周一至周日全部启用
+                    "activation_enabled": False,  # 默认不启用定时激活
+                    "activation_time": "08:00",  # 默认激活时间为上午8点
+                },
+                dup_name_fmt="API-{}"),
+            "codex_configs": _ConfigSection(
+                self, "codex_configs", "Codex-{}",
+                defaults={"type": "primary", "enabled": True, "time_enabled": [1, 1, 1, 1, 1, 1, 1]},
+                stamp_toggle=True, dup_name_fmt="Codex-{}"),
+            "openai_to_claude_configs": _ConfigSection(
+                self, "openai_to_claude_configs", "OpenAI转Claude-{}",
+                defaults={"type": "openai_to_claude", "enabled": True},
+                stamp_toggle=True, dup_name_fmt="OpenAI-{}", copy_items=True),
+            "retry_configs": _ConfigSection(
+                self, "retry_configs", "第{}次重试", defaults={"enabled": True}),
+            "model_conversions": _ConfigSection(
+                self, "model_conversions", "模型转换{}", defaults={"enabled": True},
+                validate=_validate_model_conversion, dup_name_fmt="模型转换{}"),
+        }
+        # 每个分区一把锁：修改某类配置不会阻塞其他分区的修改
+        self._section_locks: Dict[str, threading.Lock] = {
+            section: threading.Lock()
+            for section in (*self._sections, "timeout_settings", "error_handling_strategies", "optimization_settings")
+        }
+        self._last_saved_digest: Optional[bytes] = None  # 最近一次读取/写入的文件内容摘要，内容未变时跳过写盘和重新解析
+        self._last_queued_digest: Optional[bytes] = None  # 最近一次交给写盘的快照摘要，内容未变时不再排队
+        self._io_lock = threading.Lock()  # 串行化文件写入（不占用读写锁，写盘期间读者不受影响）
+        self._pending_lock = threading.Lock()  # 保护待写快照槽位的交换
+        self._pending_write: Optional[Tuple[bytes, bytes]] = None  # 最新的待写快照(内容, 摘要)，新快照直接覆盖旧的
+        threading.Thread(target=self._flusher_loop, name="config-flusher", daemon=True).start()
+        atexit.register(self.flush)  # 退出前把未写盘的修改写完
+        self._last_stat: Optional[Tuple[int, int]] = None  # 最近一次读取/写入后文件的(修改时间ns, 大小)，未变时重新加载直接跳过
         self.load_all_configs()
     
     def load_all_configs(self) -> Dict[str, Any]:
@@ -31,86 +414,282 @@ class ConfigManager:
         with self.lock:
             if os.path.exists(self.config_file):
                 try:
-                    with open(self.config_file, 'r', encoding='utf-8') as f:
-                        self._all_configs = json.load(f)
-                    
-                    # 补充缺失的字段（向后兼容旧配置文件）
-                    default_configs = self._get_default_all_configs()
-                    config_updated = False
+                    # 以二进制一次读入，直接交给解析器，省去先整体解码为str
+                    with open(self.config_file, 'rb') as f:
+                        raw = f.read()
+                        stat_sig = _stat_signature(os.fstat(f.fileno()))
+                    self._all_configs = _loads_config(raw)
+                    self._last_saved_digest = self._last_queued_digest = _payload_digest(raw)
+                    self._last_stat = stat_sig
+                    self.version += 1
                     
-                    # 如果没有model_conversions字段，从默认配置补充
-                    if "model_conversions" not in self._all_configs:
-                        self._all_configs["model_conversions"] = default_configs["model_conversions"]
-                        config_updated = True
-                        print(f"[配置管理] 自动补充缺失的model_conversions配置")
-
-                    # 如果是旧版单配置格式，转换为列表格式
-                    if "openai_to_claude_configs" not in self._all_configs:
-                        single_config = self._all_configs.pop("openai_to_claude_config", None)
-                        if isinstance(single_config, dict):
-                            single_config.setdefault("enabled", True)
-                            self._all_configs["openai_to_claude_configs"] = [single_config]
-                            config_updated = True
-                            print(f"[配置管理] 自动迁移openai_to_claude配置为多配置列表")
-                        else:
-                            self._all_configs["openai_to_claude_configs"] = default_configs["openai_to_claude_configs"]
-                            config_updated = True
-                            print(f"[配置管理] 自动补充缺失的openai_to_claude_configs配置")
-
-                    # 确保openai_to_claude_configs为列表结构
-                    if not isinstance(self._all_configs.get("openai_to_claude_configs"), list):
-                        self._all_configs["openai_to_claude_configs"] = default_configs["openai_to_claude_configs"]
-                        config_updated = True
-                        print(f"[配置管理] 修正openai_to_claude_configs配置格式")
-
-                    # 保存更新后的配置
-                    if config_updated:
-                        self.save_all_configs()
+                    # 补充缺失的字段（向后兼容旧配置文件），修改经由延迟写盘落盘
+                    if self._migrate(self._all_configs):
+                        self._mark_dirty()
                     
-                    print(f"[配置管理] 从 {self.config_file} 加载配置成功")
-                    print(f"  - API配置: {len(self._all_configs.get('api_configs', []))} 个")
-                    print(f"  - Codex配置: {len(self._all_configs.get('codex_configs', []))} 个")
-                    openai_cfgs = self._all_configs.get('openai_to_claude_configs', [])
-                    print(f"  - OpenAI转Claude配置: {len(openai_cfgs)} 个")
-                    print(f"  - 超时重试配置: {len(self._all_configs.get('retry_configs', []))} 个")
-                    print(f"  - 模型转换配置: {len(self._all_configs.get('model_conversions', []))} 个")
+                    if logger.isEnabledFor(logging.INFO):
+                        configs = self._all_configs
+                        logger.info(
+                            "从 %s 加载配置成功\n"
+                            "  - API配置: %d 个\n"
+                            "  - Codex配置: %d 个\n"
+                            "  - OpenAI转Claude配置: %d 个\n"
+                            "  - 超时重试配置: %d 个\n"
+                            "  - 模型转换配置: %d 个",
+                            self.config_file,
+                            len(configs.get('api_configs', [])),
+                            len(configs.get('codex_configs', [])),
+                            len(configs.get('openai_to_claude_configs', [])),
+                            len(configs.get('retry_configs', [])),
+                            len(configs.get('model_conversions', [])))
                 except Exception as e:
-                    print(f"[配置管理] 加载配置文件失败: {e}")
+                    logger.error("加载配置文件失败: %s", e)
                     self._all_configs = self._get_default_all_configs()
             else:
-                print(f"[配置管理] 配置文件不存在，使用默认配置")
+                logger.info("配置文件不存在，使用默认配置")
                 self._all_configs = self._get_default_all_configs()
                 self.save_all_configs()
             return self._all_configs.copy()
     
+    def _migrate(self, configs: Dict[str, Any]) -> bool:
+        """把旧版配置就地补齐/迁移到当前结构，返回是否有改动（默认配置只在需要时构建一次）"""
+        defaults: Optional[Dict[str, Any]] = None
+        changed = False
+        
+        # 如果没有model_conversions字段，从默认配置补充
+        if "model_conversions" not in configs:
+            defaults = self._get_default_all_configs()
+            configs["model_conversions"] = defaults["model_conversions"]
+            changed = True
+            logger.info("自动补充缺失的model_conversions配置")
+        
+        openai_configs = configs.get("openai_to_claude_configs")
+        if "openai_to_claude_configs" not in configs:
+            # 如果是旧版单配置格式，转换为列表格式
+            single_config = configs.pop("openai_to_claude_config", None)
+            if isinstance(single_config, dict):
+                single_config.setdefault("enabled", True)
+                configs["openai_to_claude_configs"] = [single_config]
+                logger.info("自动迁移openai_to_claude配置为多配置列表")
+            else:
+                defaults = defaults or self._get_default_all_configs()
+                configs["openai_to_claude_configs"] = defaults["openai_to_claude_configs"]
+                logger.info("自动补充缺失的openai_to_claude_configs配置")
+            changed = True
+        elif not isinstance(openai_configs, list):
+            # 确保openai_to_claude_configs为列表结构
+            defaults = defaults or self._get_default_all_configs()
+            configs["openai_to_claude_configs"] = defaults["openai_to_claude_configs"]
+            changed = True
+            logger.info("修正openai_to_claude_configs配置格式")
+        
+        return changed
+    
     def reload_all_configs(self) -> bool:
         """重新加载配置文件（用于手动修改配置后同步）"""
         with self.lock:
+            # 先写入尚未落盘的修改，避免被文件中的旧内容覆盖
+            self.flush()
             try:
-                old_configs = copy.deepcopy(self._all_configs)
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    new_configs = json.load(f)
-                if old_configs != new_configs:
-                    self._all_configs = new_configs
-                    print(f"[配置管理] 配置已重新加载")
-                else:
-                    self._all_configs = new_configs
+                if _stat_signature(os.stat(self.config_file)) == self._last_stat:
+                    # 修改时间和大小都没变，连文件都不用读
+                    return True
+                with open(self.config_file, 'rb') as f:
+                    raw = f.read()
+                    stat_sig = _stat_signature(os.fstat(f.fileno()))
+                digest = _payload_digest(raw)
+                if digest == self._last_saved_digest:
+                    # 文件内容与上次读取/写入时一致，无需重新解析
+                    self._last_stat = stat_sig
+                    return True
+                self._all_configs = _loads_config(raw)
+                self._last_saved_digest = self._last_queued_digest = digest
+                self._last_stat = stat_sig
+                self.version += 1
+                logger.info("配置已重新加载")
                 return True
             except Exception as e:
-                print(f"[配置管理] 重新加载配置失败: {e}")
+                logger.error("重新加载配置失败: %s", e)
                 return False
     
     def save_all_configs(self) -> bool:
-        """保存所有配置"""
+        """立即保存所有配置"""
         with self.lock:
-            try:
-                with open(self.config_file, 'w', encoding='utf-8') as f:
-                    json.dump(self._all_configs, f, ensure_ascii=False, indent=2)
-                print(f"[配置管理] 配置已保存到 {self.config_file}")
+            # 调用方都是修改内存配置后再保存，在这里统一递增版本号
+            self.version += 1
+            self._dirty = True
+        return self.flush()
+    
+    @contextmanager
+    def _section_write(self, section: str):
+        """修改单个配置分区：不同分区的修改可以并行，只与整体替换配置（加载/重新加载/批量修改/写盘快照）互斥"""
+        with self.lock.read(), self._section_locks[section]:
+            yield
+    
+    def _mark_dirty(self) -> None:
+        """内存配置已修改：递增版本号并安排延迟写盘（批量修改期间只记标记，退出批量时统一写盘）"""
+        # 各分区的修改可能并行进行，版本号等状态另用一把小锁保护（不能再取写锁：调用方持有读锁）
+        with self._state_lock:
+            self.version += 1
+            self._dirty = True
+            if self._batch_depth == 0:
+                self._flush_event.set()
+    
+    @contextmanager
+    def batch_update(self):
+        """批量修改：期间的所有修改在退出时只写盘一次"""
+        outermost = False
+        try:
+            with self.lock:
+                if self._batch_depth == 0:
+                    self._batch_now = None
+                self._batch_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._batch_depth -= 1
+                    outermost = self._batch_depth == 0
+        finally:
+            # 释放写锁后再写盘，读取方不必等待磁盘IO
+            if outermost:
+                self.flush()
+    
+    def _now_iso(self) -> str:
+        """当前时间的ISO字符串；同一次批量修改内只取一次时间，各条目共用同一个时间戳"""
+        if self._batch_depth:
+            if self._batch_now is None:
+                self._batch_now = datetime.now().isoformat()
+            return self._batch_now
+        return datetime.now().isoformat()
+    
+    def flush(self) -> bool:
+        """把未写盘的修改立即写入配置文件（后台线程正在写的快照也等它写完）
+        
+        只在写锁内取快照，写盘在释放写锁后进行；调用方自己持有写锁时（如reload）写盘仍在锁内完成
+        """
+        with self.lock:
+            if self._dirty and not self._take_snapshot():
+                return False
+        # 返回前保证文件已是最新内容：reload等调用方紧接着就要读文件
+        return self._write_pending()
+    
+    def _flusher_loop(self) -> None:
+        """后台写盘线程：被修改唤醒后等一个合并窗口，再把期间的所有修改一次写盘"""
+        while True:
+            self._flush_event.wait()
+            time.sleep(SAVE_DEBOUNCE_SECONDS)
+            # 先清事件再取快照：取快照之后的修改会重新置位，不会漏写
+            self._flush_event.clear()
+            with self.lock:
+                # 批量修改期间不写，退出批量时会同步写盘
+                if not self._dirty or self._batch_depth:
+                    continue
+                ok = self._take_snapshot()
+            if not (ok and self._write_pending()):
+                # 失败时已重新置位事件，隔一段时间再重试，避免持续失败时刷屏
+                time.sleep(SAVE_RETRY_SECONDS)
+    
+    def _take_snapshot(self) -> bool:
+        """序列化当前配置放入待写槽位（调用方持有写锁）；内容与最近一次排队/写入的相同时不排队，序列化失败返回False"""
+        self._dirty = False
+        try:
+            payload = _dumps_config(self._all_configs)
+        except Exception as e:
+            self._schedule_retry()
+            logger.error("保存配置失败: %s", e)
+            return False
+        digest = _payload_digest(payload)
+        if digest == self._last_queued_digest:
+            # 与上次写入（或已排队）的内容完全相同，无需写盘
+            return True
+        self._last_queued_digest = digest
+        with self._pending_lock:
+            self._pending_write = (payload, digest)
+        return True
+    
+    def _write_pending(self) -> bool:
+        """写出待写槽位中的快照（槽位里总是最新的快照）；由_io_lock串行，不需要持有读写锁"""
+        with self._io_lock:
+            with self._pending_lock:
+                pending, self._pending_write = self._pending_write, None
+            if pending is None:
                 return True
+            payload, digest = pending
+            try:
+                self._write_file_atomic(payload)
+                self._last_stat = _stat_signature(os.stat(self.config_file))
             except Exception as e:
-                print(f"[配置管理] 保存配置失败: {e}")
+                # 清空排队摘要，重试时即使内容相同也会重新写盘
+                self._last_queued_digest = None
+                self._schedule_retry()
+                logger.error("保存配置失败: %s", e)
                 return False
+            self._last_saved_digest = digest
+            logger.info("配置已保存到 %s", self.config_file)
+            return True
+    
+    def _schedule_retry(self) -> None:
+        """取快照或写盘失败：恢复脏标记并重新唤醒后台写盘线程，由它稍后重试"""
+        with self._state_lock:
+            self._dirty = True
+            if self._batch_depth == 0:
+                self._flush_event.set()
+    
+    def _write_file_atomic(self, payload: bytes) -> None:
+        """先写同目录下的唯一临时文件并fsync，再原子替换配置文件，写入中途崩溃也不会留下半截文件"""
+        config_dir = os.path.dirname(self.config_file) or "."
+        # mkstemp创建的文件权限是0600，替换前改回原文件的权限（原文件不存在时用0644），保存配置不改变文件权限
+        try:
+            mode = stat.S_IMODE(os.stat(self.config_file).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        fd, tmp_file = tempfile.mkstemp(dir=config_dir, prefix=".cfg.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(os, "fchmod"):
+                    os.fchmod(f.fileno(), mode)
+                else:
+                    os.chmod(tmp_file, mode)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.config_file)
+        except BaseException:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+            raise
+        # 把目录项的变化也刷到磁盘，断电后不会回到替换前的文件（Windows不支持打开目录，跳过）
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(config_dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    
+    def _get_enabled(self, section: str) -> List[Dict[str, Any]]:
+        """获取某类配置中已启用的条目（按配置版本缓存，返回的列表供只读使用）"""
+        with self.lock.read():
+            # 先取版本号再读数据：构建期间若有分区修改，缓存记的是旧版本号，下次读取会重新构建
+            version = self.version
+            cached = self._enabled_cache.get(section)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            result = [cfg for cfg in self._all_configs.get(section, []) if cfg.get("enabled", True)]
+            self._enabled_cache[section] = (version, result)
+            return result
+    
+    def _get_cached_settings(self, name: str, build) -> Dict[str, Any]:
+        """按配置版本缓存合并后的设置：版本未变时不加锁直接返回，配置修改/重新加载后才重新构建"""
+        cached = self._settings_cache.get(name)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        with self.lock.read():
+            version = self.version
+            result = build()
+            self._settings_cache[name] = (version, result)
+            return result
     
     def _get_default_all_configs(self) -> Dict[str, Any]:
         """获取默认配置"""
@@ -309,129 +888,44 @@ class ConfigManager:
     # ========== API配置管理 ==========
     def get_api_configs(self) -> List[Dict[str, Any]]:
         """获取所有API配置"""
-        with self.lock:
-            return self._all_configs.get("api_configs", []).copy()
+        return self._sections["api_configs"].all()
     
     def get_enabled_api_configs(self) -> List[Dict[str, Any]]:
         """获取已启用的API配置"""
-        with self.lock:
-            return [cfg for cfg in self._all_configs.get("api_configs", []) if cfg.get("enabled", True)]
+        return self._sections["api_configs"].enabled()
     
     def add_api_config(self, config: Dict[str, Any]) -> bool:
         """添加API配置"""
-        with self.lock:
-            # 验证必填字段
-            base_url = config.get("base_url", "").strip()
-            key = config.get("key", "").strip()
-            
-            if not base_url or not key:
-                return False
-            
-            # 验证URL格式
-            if not base_url.startswith(("http://", "https://")):
-                return False
-            
-            # 验证Key长度（至少10个字符）
-            if len(key) < 10:
-                return False
-            
-            configs = self._all_configs.setdefault("api_configs", [])
-            config.setdefault("name", f"API-{len(configs) + 1}")
-            config.setdefault("type", "primary")
-            config.setdefault("enabled", True)
-            config.setdefault("time_enabled", [1, 1, 1, 1, 1, 1, 1])  # 默认周一至周日全部启用
-            config.setdefault("activation_enabled", False)  # 默认不启用定时激活
-            config.setdefault("activation_time", "08:00")  # 默认激活时间为上午8点
-            config.setdefault("created_at", datetime.now().isoformat())
-            
-            configs.append(config)
-            self.save_all_configs()
-            return True
+        return self._sections["api_configs"].add(config)
     
     def update_api_config(self, index: int, config: Dict[str, Any]) -> bool:
         """更新API配置"""
-        with self.lock:
-            configs = self._all_configs.get("api_configs", [])
-            if 0 <= index < len(configs):
-                config.setdefault("updated_at", datetime.now().isoformat())
-                configs[index].update(config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["api_configs"].update(index, config)
     
     def delete_api_config(self, index: int) -> bool:
         """删除API配置"""
-        with self.lock:
-            configs = self._all_configs.get("api_configs", [])
-            if 0 <= index < len(configs):
-                configs.pop(index)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["api_configs"].delete(index)
     
     def toggle_api_config(self, index: int) -> Optional[bool]:
         """切换API配置启用状态"""
-        with self.lock:
-            configs = self._all_configs.get("api_configs", [])
-            if 0 <= index < len(configs):
-                configs[index]["enabled"] = not configs[index].get("enabled", True)
-                self.save_all_configs()
-                return configs[index]["enabled"]
-            return None
+        return self._sections["api_configs"].toggle(index)
     
     def move_api_config(self, index: int, direction: str) -> bool:
         """移动API配置"""
-        with self.lock:
-            configs = self._all_configs.get("api_configs", [])
-            if not configs or not (0 <= index < len(configs)):
-                return False
-            direction = (direction or "").lower()
-            if direction == "up" and index > 0:
-                configs[index], configs[index - 1] = configs[index - 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "down" and index < len(configs) - 1:
-                configs[index], configs[index + 1] = configs[index + 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "top" and index > 0:
-                item = configs.pop(index)
-                configs.insert(0, item)
-                self.save_all_configs()
-                return True
-            if direction == "bottom" and index < len(configs) - 1:
-                item = configs.pop(index)
-                configs.append(item)
-                self.save_all_configs()
-                return True
-            return False
-
+        return self._sections["api_configs"].move(index, direction)
 
     def duplicate_api_config(self, index: int) -> bool:
         """复制一条API配置"""
-        with self.lock:
-            configs = self._all_configs.get("api_configs", [])
-            if 0 <= index < len(configs):
-                new_config = copy.deepcopy(configs[index])
-                new_config.pop("updated_at", None)
-                new_config["created_at"] = datetime.now().isoformat()
-                original_name = new_config.get("name", f"API-{index + 1}")
-                new_config["name"] = f"{original_name}(复制)"
-                configs.insert(index + 1, new_config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["api_configs"].duplicate(index)
     
     # ========== Codex配置管理 ==========
     def get_codex_configs(self) -> List[Dict[str, Any]]:
         """获取所有Codex配置"""
-        with self.lock:
-            return self._all_configs.get("codex_configs", []).copy()
+        return self._sections["codex_configs"].all()
     
     def get_enabled_codex_configs(self) -> List[Dict[str, Any]]:
         """获取已启用的Codex配置"""
-        with self.lock:
-            return [cfg for cfg in self._all_configs.get("codex_configs", []) if cfg.get("enabled", True)]
+        return self._sections["codex_configs"].enabled()
     
     def get_codex_config(self) -> Dict[str, Any]:
         """获取Codex配置（向后兼容，返回第一个启用的配置）"""
@@ -440,122 +934,40 @@ class ConfigManager:
     
     def add_codex_config(self, config: Dict[str, Any]) -> bool:
         """添加Codex配置"""
-        with self.lock:
-            # 验证必填字段
-            base_url = config.get("base_url", "").strip()
-            key = config.get("key", "").strip()
-            
-            if not base_url or not key:
-                return False
-            
-            # 验证URL格式
-            if not base_url.startswith(("http://", "https://")):
-                return False
-            
-            # 验证Key长度（至少10个字符）
-            if len(key) < 10:
-                return False
-            
-            configs = self._all_configs.setdefault("codex_configs", [])
-            config.setdefault("name", f"Codex-{len(configs) + 1}")
-            config.setdefault("type", "primary")
-            config.setdefault("enabled", True)
-            config.setdefault("time_enabled", [1, 1, 1, 1, 1, 1, 1])
-            config.setdefault("created_at", datetime.now().isoformat())
-            
-            configs.append(config)
-            self.save_all_configs()
-            return True
+        return self._sections["codex_configs"].add(config)
     
     def update_codex_config(self, index: int, config: Dict[str, Any]) -> bool:
         """更新Codex配置"""
-        with self.lock:
-            configs = self._all_configs.get("codex_configs", [])
-            if 0 <= index < len(configs):
-                config.setdefault("updated_at", datetime.now().isoformat())
-                configs[index].update(config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["codex_configs"].update(index, config)
     
     def delete_codex_config(self, index: int) -> bool:
         """删除Codex配置"""
-        with self.lock:
-            configs = self._all_configs.get("codex_configs", [])
-            if 0 <= index < len(configs):
-                configs.pop(index)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["codex_configs"].delete(index)
     
-    def toggle_codex_config(self, index: int) -> bool:
+    def toggle_codex_config(self, index: int) -> Optional[bool]:
         """切换Codex配置的启用状态"""
-        with self.lock:
-            configs = self._all_configs.get("codex_configs", [])
-            if 0 <= index < len(configs):
-                configs[index]["enabled"] = not configs[index].get("enabled", True)
-                configs[index]["updated_at"] = datetime.now().isoformat()
-                self.save_all_configs()
-                return configs[index]["enabled"]
-            return None
+        return self._sections["codex_configs"].toggle(index)
     
     def move_codex_config(self, index: int, direction: str) -> bool:
         """移动Codex配置的顺序"""
-        with self.lock:
-            configs = self._all_configs.get("codex_configs", [])
-            if not configs or not (0 <= index < len(configs)):
-                return False
-            direction = (direction or "").lower()
-            if direction == "up" and index > 0:
-                configs[index], configs[index - 1] = configs[index - 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "down" and index < len(configs) - 1:
-                configs[index], configs[index + 1] = configs[index + 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "top" and index > 0:
-                item = configs.pop(index)
-                configs.insert(0, item)
-                self.save_all_configs()
-                return True
-            if direction == "bottom" and index < len(configs) - 1:
-                item = configs.pop(index)
-                configs.append(item)
-                self.save_all_configs()
-                return True
-            return False
-
+        return self._sections["codex_configs"].move(index, direction)
 
     def duplicate_codex_config(self, index: int) -> bool:
         """复制一条Codex配置"""
-        with self.lock:
-            configs = self._all_configs.get("codex_configs", [])
-            if 0 <= index < len(configs):
-                new_config = copy.deepcopy(configs[index])
-                new_config.pop("updated_at", None)
-                new_config["created_at"] = datetime.now().isoformat()
-                original_name = new_config.get("name", f"Codex-{index + 1}")
-                new_config["name"] = f"{original_name}(复制)"
-                configs.insert(index + 1, new_config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["codex_configs"].duplicate(index)
     
     # ========== OpenAI转Claude配置管理 ==========
     def get_openai_to_claude_configs(self) -> List[Dict[str, Any]]:
         """获取所有OpenAI转Claude配置"""
-        with self.lock:
-            return [cfg.copy() for cfg in self._all_configs.get("openai_to_claude_configs", [])]
+        return self._sections["openai_to_claude_configs"].all()
 
     def get_enabled_openai_to_claude_configs(self) -> List[Dict[str, Any]]:
         """获取已启用的OpenAI转Claude配置"""
-        with self.lock:
-            return [cfg.copy() for cfg in self._all_configs.get("openai_to_claude_configs", []) if cfg.get("enabled", True)]
+        return self._sections["openai_to_claude_configs"].enabled()
 
     def get_openai_to_claude_config(self) -> Dict[str, Any]:
         """获取首选的OpenAI转Claude配置（向后兼容）"""
-        with self.lock:
+        with self.lock.read():
             configs = self._all_configs.get("openai_to_claude_configs", [])
             for cfg in configs:
                 if cfg.get("enabled", True):
@@ -564,349 +976,110 @@ class ConfigManager:
 
     def add_openai_to_claude_config(self, config: Dict[str, Any]) -> bool:
         """添加OpenAI转Claude配置"""
-        with self.lock:
-            # 验证必填字段
-            base_url = config.get("base_url", "").strip()
-            key = config.get("key", "").strip()
-            
-            if not base_url or not key:
-                return False
-            
-            # 验证URL格式
-            if not base_url.startswith(("http://", "https://")):
-                return False
-            
-            # 验证Key长度（至少10个字符）
-            if len(key) < 10:
-                return False
-
-            configs = self._all_configs.setdefault("openai_to_claude_configs", [])
-            config.setdefault("name", f"OpenAI转Claude-{len(configs) + 1}")
-            config.setdefault("type", "openai_to_claude")
-            config.setdefault("enabled", True)
-            config.setdefault("created_at", datetime.now().isoformat())
-
-            configs.append(config)
-            self.save_all_configs()
-            return True
+        return self._sections["openai_to_claude_configs"].add(config)
 
     def update_openai_to_claude_config(self, index: int, config: Dict[str, Any]) -> bool:
         """更新OpenAI转Claude配置"""
-        with self.lock:
-            configs = self._all_configs.get("openai_to_claude_configs", [])
-            if 0 <= index < len(configs):
-                config.setdefault("updated_at", datetime.now().isoformat())
-                configs[index].update(config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["openai_to_claude_configs"].update(index, config)
 
     def delete_openai_to_claude_config(self, index: int) -> bool:
         """删除OpenAI转Claude配置"""
-        with self.lock:
-            configs = self._all_configs.get("openai_to_claude_configs", [])
-            if 0 <= index < len(configs):
-                configs.pop(index)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["openai_to_claude_configs"].delete(index)
 
     def toggle_openai_to_claude_config(self, index: int) -> Optional[bool]:
         """切换OpenAI转Claude配置启用状态"""
-        with self.lock:
-            configs = self._all_configs.get("openai_to_claude_configs", [])
-            if 0 <= index < len(configs):
-                configs[index]["enabled"] = not configs[index].get("enabled", True)
-                configs[index]["updated_at"] = datetime.now().isoformat()
-                self.save_all_configs()
-                return configs[index]["enabled"]
-            return None
+        return self._sections["openai_to_claude_configs"].toggle(index)
 
     def move_openai_to_claude_config(self, index: int, direction: str) -> bool:
         """移动OpenAI转Claude配置顺序"""
-        with self.lock:
-            configs = self._all_configs.get("openai_to_claude_configs", [])
-            if not configs or not (0 <= index < len(configs)):
-                return False
-            direction = (direction or "").lower()
-            if direction == "up" and index > 0:
-                configs[index], configs[index - 1] = configs[index - 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "down" and index < len(configs) - 1:
-                configs[index], configs[index + 1] = configs[index + 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "top" and index > 0:
-                item = configs.pop(index)
-                configs.insert(0, item)
-                self.save_all_configs()
-                return True
-            if direction == "bottom" and index < len(configs) - 1:
-                item = configs.pop(index)
-                configs.append(item)
-                self.save_all_configs()
-                return True
-            return False
-
+        return self._sections["openai_to_claude_configs"].move(index, direction)
 
     def duplicate_openai_to_claude_config(self, index: int) -> bool:
         """复制一条OpenAI转Claude配置"""
-        with self.lock:
-            configs = self._all_configs.get("openai_to_claude_configs", [])
-            if 0 <= index < len(configs):
-                new_config = copy.deepcopy(configs[index])
-                new_config.pop("updated_at", None)
-                new_config["created_at"] = datetime.now().isoformat()
-                original_name = new_config.get("name", f"OpenAI-{index + 1}")
-                new_config["name"] = f"{original_name}(复制)"
-                configs.insert(index + 1, new_config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["openai_to_claude_configs"].duplicate(index)
     
     # ========== 超时重试配置管理 ==========
     def get_retry_configs(self) -> List[Dict[str, Any]]:
         """获取所有超时重试配置"""
-        with self.lock:
-            return self._all_configs.get("retry_configs", []).copy()
+        return self._sections["retry_configs"].all()
     
     def get_enabled_retry_configs(self) -> List[Dict[str, Any]]:
         """获取已启用的超时重试配置"""
-        with self.lock:
-            return [cfg for cfg in self._all_configs.get("retry_configs", []) if cfg.get("enabled", True)]
+        return self._sections["retry_configs"].enabled()
     
     def add_retry_config(self, config: Dict[str, Any]) -> bool:
         """添加超时重试配置"""
-        with self.lock:
-            # 验证必填字段
-            base_url = config.get("base_url", "").strip()
-            key = config.get("key", "").strip()
-            
-            if not base_url or not key:
-                return False
-            
-            # 验证URL格式
-            if not base_url.startswith(("http://", "https://")):
-                return False
-            
-            # 验证Key长度（至少10个字符）
-            if len(key) < 10:
-                return False
-            
-            configs = self._all_configs.setdefault("retry_configs", [])
-            config.setdefault("name", f"第{len(configs) + 1}次重试")
-            config.setdefault("enabled", True)
-            config.setdefault("created_at", datetime.now().isoformat())
-            
-            configs.append(config)
-            self.save_all_configs()
-            return True
+        return self._sections["retry_configs"].add(config)
     
     def update_retry_config(self, index: int, config: Dict[str, Any]) -> bool:
         """更新超时重试配置"""
-        with self.lock:
-            configs = self._all_configs.get("retry_configs", [])
-            if 0 <= index < len(configs):
-                config.setdefault("updated_at", datetime.now().isoformat())
-                configs[index].update(config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["retry_configs"].update(index, config)
     
     def delete_retry_config(self, index: int) -> bool:
         """删除超时重试配置"""
-        with self.lock:
-            configs = self._all_configs.get("retry_configs", [])
-            if 0 <= index < len(configs):
-                configs.pop(index)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["retry_configs"].delete(index)
     
     def toggle_retry_config(self, index: int) -> Optional[bool]:
         """切换超时重试配置启用状态"""
-        with self.lock:
-            configs = self._all_configs.get("retry_configs", [])
-            if 0 <= index < len(configs):
-                configs[index]["enabled"] = not configs[index].get("enabled", True)
-                self.save_all_configs()
-                return configs[index]["enabled"]
-            return None
+        return self._sections["retry_configs"].toggle(index)
     
     def move_retry_config(self, index: int, direction: str) -> bool:
         """移动超时重试配置"""
-        with self.lock:
-            configs = self._all_configs.get("retry_configs", [])
-            if not configs or not (0 <= index < len(configs)):
-                return False
-            direction = (direction or "").lower()
-            if direction == "up" and index > 0:
-                configs[index], configs[index - 1] = configs[index - 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "down" and index < len(configs) - 1:
-                configs[index], configs[index + 1] = configs[index + 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "top" and index > 0:
-                item = configs.pop(index)
-                configs.insert(0, item)
-                self.save_all_configs()
-                return True
-            if direction == "bottom" and index < len(configs) - 1:
-                item = configs.pop(index)
-                configs.append(item)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["retry_configs"].move(index, direction)
 
     def duplicate_retry_config(self, index: int) -> bool:
         """复制一条超时重试配置"""
-        with self.lock:
-            configs = self._all_configs.get("retry_configs", [])
-            if 0 <= index < len(configs):
-                new_config = copy.deepcopy(configs[index])
-                new_config.pop("updated_at", None)
-                new_config["created_at"] = datetime.now().isoformat()
-                configs.insert(index + 1, new_config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["retry_configs"].duplicate(index)
 
     # ========== 模型转换配置管理 ==========
     def get_model_conversions(self) -> List[Dict[str, Any]]:
         """获取所有模型转换配置"""
-        with self.lock:
-            return self._all_configs.get("model_conversions", []).copy()
+        return self._sections["model_conversions"].all()
     
     def get_enabled_model_conversions(self) -> List[Dict[str, Any]]:
         """获取已启用的模型转换配置"""
-        with self.lock:
-            return [cfg for cfg in self._all_configs.get("model_conversions", []) if cfg.get("enabled", True)]
+        return self._sections["model_conversions"].enabled()
     
     def add_model_conversion(self, config: Dict[str, Any]) -> bool:
         """添加模型转换配置"""
-        with self.lock:
-            if not config.get("source_model") or not config.get("target_model"):
-                return False
-            
-            configs = self._all_configs.setdefault("model_conversions", [])
-            config.setdefault("name", f"模型转换{len(configs) + 1}")
-            config.setdefault("enabled", True)
-            config.setdefault("created_at", datetime.now().isoformat())
-            configs.append(config)
-            self.save_all_configs()
-            return True
+        return self._sections["model_conversions"].add(config)
     
     def update_model_conversion(self, index: int, config: Dict[str, Any]) -> bool:
         """更新模型转换配置"""
-        with self.lock:
-            configs = self._all_configs.get("model_conversions", [])
-            if 0 <= index < len(configs):
-                config.setdefault("updated_at", datetime.now().isoformat())
-                configs[index].update(config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["model_conversions"].update(index, config)
     
     def delete_model_conversion(self, index: int) -> bool:
         """删除模型转换配置"""
-        with self.lock:
-            configs = self._all_configs.get("model_conversions", [])
-            if 0 <= index < len(configs):
-                configs.pop(index)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["model_conversions"].delete(index)
     
     def toggle_model_conversion(self, index: int) -> Optional[bool]:
         """切换模型转换配置启用状态"""
-        with self.lock:
-            configs = self._all_configs.get("model_conversions", [])
-            if 0 <= index < len(configs):
-                configs[index]["enabled"] = not configs[index].get("enabled", True)
-                self.save_all_configs()
-                return configs[index]["enabled"]
-            return None
+        return self._sections["model_conversions"].toggle(index)
     
     def move_model_conversion(self, index: int, direction: str) -> bool:
         """移动模型转换配置"""
-        with self.lock:
-            configs = self._all_configs.get("model_conversions", [])
-            if not configs or not (0 <= index < len(configs)):
-                return False
-            direction = (direction or "").lower()
-            if direction == "up" and index > 0:
-                configs[index], configs[index - 1] = configs[index - 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "down" and index < len(configs) - 1:
-                configs[index], configs[index + 1] = configs[index + 1], configs[index]
-                self.save_all_configs()
-                return True
-            if direction == "top" and index > 0:
-                item = configs.pop(index)
-                configs.insert(0, item)
-                self.save_all_configs()
-                return True
-            if direction == "bottom" and index < len(configs) - 1:
-                item = configs.pop(index)
-                configs.append(item)
-                self.save_all_configs()
-                return True
-            return False
-
+        return self._sections["model_conversions"].move(index, direction)
 
     def duplicate_model_conversion(self, index: int) -> bool:
         """复制一条模型转换配置"""
-        with self.lock:
-            configs = self._all_configs.get("model_conversions", [])
-            if 0 <= index < len(configs):
-                new_config = copy.deepcopy(configs[index])
-                new_config.pop("updated_at", None)
-                new_config["created_at"] = datetime.now().isoformat()
-                original_name = new_config.get("name", f"模型转换{index + 1}")
-                new_config["name"] = f"{original_name}(复制)"
-                configs.insert(index + 1, new_config)
-                self.save_all_configs()
-                return True
-            return False
+        return self._sections["model_conversions"].duplicate(index)
     
     # ========== 超时设置管理 ==========
     def get_timeout_settings(self) -> Dict[str, Any]:
-        """获取超时设置"""
-        with self.lock:
-            default_settings = {
-                "connect_timeout": 60.0,
-                "write_timeout": 60.0,
-                "pool_timeout": 120.0,
-                "streaming_read_timeout": 60.0,
-                "non_streaming_read_timeout": 60.0,
-                "extended_connect_timeout": 90.0,
-                "api_cooldown_seconds": 600,
-                "api_error_threshold": 3,
-                "codex_error_threshold": 3,
-                "codex_base_timeout": 60,
-                "codex_timeout_increment": 60,
-                "codex_connect_timeout": 30.0,
-                "primary_api_check_interval": 30,
-                "billing_cycle_delay": 60,
-                "health_check_interval": 0.5,
-                "billing_send_interval": 1.0,
-                "stream_retry_wait": 1.0,
-                "strategy_retry_read_timeout": 200.0,
-                "modify_retry_headers": True
-            }
-            stored_settings = self._all_configs.get("timeout_settings", {})
-            merged_settings = default_settings.copy()
-            if isinstance(stored_settings, dict):
-                merged_settings.update(stored_settings)
-            return merged_settings
+        """获取超时设置（按配置版本缓存，返回的字典供只读使用）"""
+        return self._get_cached_settings("timeout_settings", self._build_timeout_settings)
     
+    def _build_timeout_settings(self) -> Dict[str, Any]:
+        """合并默认值和已存储的超时设置（调用方持有读锁）"""
+        stored_settings = self._all_configs.get("timeout_settings", {})
+        merged_settings = dict(_DEFAULT_TIMEOUT_SETTINGS)
+        if isinstance(stored_settings, dict):
+            merged_settings.update(stored_settings)
+        return merged_settings
+
     def update_timeout_settings(self, settings: Dict[str, Any]) -> bool:
         """更新超时设置（带输入校验）"""
-        with self.lock:
+        with self._section_write("timeout_settings"):
             # 校验必需字段
             required_fields = [
                 "connect_timeout", "write_timeout", "pool_timeout",
@@ -938,54 +1111,47 @@ class ConfigManager:
                 if value <= 0:
                     return False
             
-            settings.setdefault("updated_at", datetime.now().isoformat())
+            settings.setdefault("updated_at", self._now_iso())
             self._all_configs["timeout_settings"] = settings
-            self.save_all_configs()
+            self._mark_dirty()
             return True
 
     # ========== 错误处理策略管理 ==========
     def get_error_handling_strategies(self) -> Dict[str, Any]:
-        """获取错误处理策略配置"""
-        with self.lock:
-            default_strategies = {
-                "http_status_codes": {
-                    "400": "strategy_retry",
-                    "404": "strategy_retry",
-                    "408": "strategy_retry",  # Request Timeout
-                    "429": "strategy_retry",
-                    "500": "strategy_retry",
-                    "502": "strategy_retry",
-                    "503": "strategy_retry",
-                    "504": "strategy_retry",  # Gateway Timeout
-                    "520": "strategy_retry",
-                    "521": "strategy_retry",
-                    "522": "strategy_retry",
-                    "524": "strategy_retry",
-                    "401": "switch_api",
-                    "403": "switch_api",
-                    "default": "strategy_retry"  # 默认策略：未列出的错误码使用策略重试
-                },
-                "network_errors": {
-                    "ReadError": "switch_api",
-                    "ConnectError": "switch_api",
-                    "ReadTimeout": "strategy_retry",
-                    "default": "switch_api"  # 默认策略：未列出的网络错误切换API
-                }
-            }
-            stored_strategies = self._all_configs.get("error_handling_strategies", {})
-            
-            # 合并默认配置和存储配置
-            result = default_strategies.copy()
-            if "http_status_codes" in stored_strategies:
-                result["http_status_codes"].update(stored_strategies["http_status_codes"])
-            if "network_errors" in stored_strategies:
-                result["network_errors"].update(stored_strategies["network_errors"])
-            
-            return result
+        """获取错误处理策略配置（按配置版本缓存，返回的字典供只读使用）"""
+        return self._get_cached_settings("error_handling_strategies", self._build_error_handling_strategies)
+    
+    def _build_error_handling_strategies(self) -> Dict[str, Any]:
+        """合并默认值和已存储的错误处理策略配置（调用方持有读锁）"""
+        stored_strategies = self._all_configs.get("error_handling_strategies", {})
+        
+        # 合并默认配置和存储配置（默认值是只读常量，逐层复制后再合并）
+        result = {section: dict(defaults) for section, defaults in _DEFAULT_ERROR_HANDLING_STRATEGIES.items()}
+        if "http_status_codes" in stored_strategies:
+            result["http_status_codes"].update(stored_strategies["http_status_codes"])
+        if "network_errors" in stored_strategies:
+            result["network_errors"].update(stored_strategies["network_errors"])
+        
+        return result
+
+    def get_switch_api_codes(self) -> FrozenSet[int]:
+        """获取配置为switch_api策略的HTTP状态码集合（按配置版本缓存，只在配置变化后重新计算）"""
+        with self.lock.read():
+            version = self.version
+            cached_version, codes = self._switch_api_codes
+            if cached_version != version:
+                http_codes = self.get_error_handling_strategies()["http_status_codes"]
+                codes = frozenset(
+                    int(code) for code, strategy in http_codes.items()
+                    if strategy == "switch_api" and code != "default"
+                )
+                # 版本号和结果一起替换，并发读取不会看到不配套的组合
+                self._switch_api_codes = (version, codes)
+            return codes
     
     def update_error_handling_strategies(self, strategies: Dict[str, Any]) -> bool:
         """更新错误处理策略"""
-        with self.lock:
+        with self._section_write("error_handling_strategies"):
             try:
                 # 校验策略有效性
                 valid_strategies = {"strategy_retry", "switch_api", "normal_retry"}
@@ -1001,40 +1167,40 @@ class ConfigManager:
                             return False
                 
                 self._all_configs["error_handling_strategies"] = strategies
-                self.save_all_configs()
+                self._mark_dirty()
                 return True
             except Exception as e:
-                print(f"[配置管理] 更新错误处理策略失败: {e}")
+                logger.error("更新错误处理策略失败: %s", e)
                 return False
 
     # ========== 优化设置管理 ==========
     def get_optimization_settings(self) -> Dict[str, Any]:
-        """获取优化设置"""
-        with self.lock:
-            default_settings = {
-                "enable_cache_control_limit": True
-            }
-            stored_settings = self._all_configs.get("optimization_settings", {})
-            merged_settings = default_settings.copy()
-            if isinstance(stored_settings, dict):
-                merged_settings.update(stored_settings)
-            return merged_settings
+        """获取优化设置（按配置版本缓存，返回的字典供只读使用）"""
+        return self._get_cached_settings("optimization_settings", self._build_optimization_settings)
+    
+    def _build_optimization_settings(self) -> Dict[str, Any]:
+        """合并默认值和已存储的优化设置（调用方持有读锁）"""
+        stored_settings = self._all_configs.get("optimization_settings", {})
+        merged_settings = dict(_DEFAULT_OPTIMIZATION_SETTINGS)
+        if isinstance(stored_settings, dict):
+            merged_settings.update(stored_settings)
+        return merged_settings
 
     def update_optimization_settings(self, settings: Dict[str, Any]) -> bool:
         """更新优化设置"""
-        with self.lock:
+        with self._section_write("optimization_settings"):
             try:
                 # 校验字段
                 if "enable_cache_control_limit" in settings:
                     if not isinstance(settings["enable_cache_control_limit"], bool):
                         return False
 
-                settings.setdefault("updated_at", datetime.now().isoformat())
+                settings.setdefault("updated_at", self._now_iso())
                 self._all_configs["optimization_settings"] = settings
-                self.save_all_configs()
+                self._mark_dirty()
                 return True
             except Exception as e:
-                print(f"[配置管理] 更新优化设置失败: {e}")
+                logger.error("更新优化设置失败: %s", e)
                 return False
 
 